@@ -1,9 +1,13 @@
 import argparse
-
-import gui
-import no_gui
+from contextlib import nullcontext, redirect_stdout
+from importlib.util import find_spec
+from multiprocessing import freeze_support
 
 from pathlib import Path
+import sys
+
+import helper
+
 try:
     import pyi_splash
 except ModuleNotFoundError:
@@ -17,7 +21,22 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-ng", "--no_gui", action="store_true",
                         help="Disable gui.")
-    parser.add_argument("-f", "--file", help="File path to ICD-10 codes.")
+    parser.add_argument("-f", "--file", nargs='+', action='extend', help="File paths or glob patterns of files with ICD-10 codes. Every"
+                        " file is converted with the same loaded model and written to its own output file.")
+    parser.add_argument("--file_workers", type=int, default=1, help="Number of files converted at once when converting several files.")
+    parser.add_argument("--watch", help="Folder to watch for new input files, converting each file once it has finished landing until"
+                        " stopped with Ctrl+C. Files whose output file is newer than them are skipped. Only with -ng/--no_gui.")
+    parser.add_argument("--watch_pattern", default='*.csv', help="Glob pattern of the files converted in the watch folder. Output files"
+                        " are never converted.")
+    parser.add_argument("--watch_interval", type=float, default=10.0, help="Seconds between checks of the watch folder for new files.")
+    parser.add_argument("--serve", action="store_true", help="Keep the selected model loaded and serve JSON conversion requests over"
+                        " HTTP at /convert instead of converting a file.")
+    parser.add_argument("--host", default='127.0.0.1', help="Address the server listens on. Only with --serve.")
+    parser.add_argument("--port", type=int, default=8000, help="Port the server listens on. Use 0 for any free port. Only with --serve.")
+    parser.add_argument("--max_batch_size", type=int, default=256, help="Number of cases of concurrent requests that are converted"
+                        " together in one micro-batch. Only with --serve.")
+    parser.add_argument("--max_wait_ms", type=float, default=5.0, help="Longest time in milliseconds a request waits for other requests"
+                        " to join its micro-batch. Only with --serve.")
     parser.add_argument("-i", "--input_type", default='code_per_row',
                         choices=['code_per_row', 'case_per_row'],
                         help="The format of the ICD-10 codes in the input file. Use 'code-per-row' if the codes are in" 
@@ -30,38 +49,202 @@ def main():
                         help="Model to use for the conversion. Direct models directly convert ICD-10 codes to ISS; Indirect"
                         " models convert ICD-10 codes to AIS08 and then calculate ISS. FFNN models use a feedforward neural"
                         " network; NMT models use neural machine translation.")
+    parser.add_argument("--ensemble", nargs='+', choices=['direct_FFNN', 'direct_NMT', 'indirect_FFNN', 'indirect_NMT'], metavar='MODEL',
+                        help="Convert with two or more of the models direct_FFNN, direct_NMT, indirect_FFNN, and indirect_NMT in one run"
+                        " instead of the -m/--model model, importing and preprocessing the input once. FFNN and NMT models convert at the same time. The outputs of every model are written side"
+                        " by side to one output file, with each column prefixed by its model. Only with -ng/--no_gui.")
+    parser.add_argument("--consensus", action='store_true', default=False, help="Output the lower median ISS of the ensemble models"
+                        " that output an ISS, ignoring NaN outputs, as the median_iss column. Only with --ensemble.")
     parser.add_argument("--no_iss", action='store_true', default=False, help="Do not output ISS scores. Only for indirect models (indirect FFNN or indirect NMT).")
     parser.add_argument("--mais", action='store_true', default=False, help="Output MAIS scores. Only for indirect models (indirect FFNN or indirect NMT).")
     parser.add_argument("--max_sev_per_chapter", action='store_true', default=False, help="Output the greatest severity for each AIS chapter. Only for indirect models (indirect FFNN or indirect NMT).")
+    parser.add_argument("--output_format", default='csv', choices=['csv', 'parquet', 'feather'],
+                        help="File format of the output file. Use 'parquet' or 'feather' (Arrow IPC) to write typed integer output"
+                        " columns, with NaN outputs as nulls. Parquet and Feather input files are detected by their extension.")
+    parser.add_argument("--compression", default='none', choices=['none', 'gzip', 'zstd'],
+                        help="Compress the output. CSV output is compressed as a stream into a .gz or .zst file. Parquet output uses the"
+                        " codec within the file and Feather output can only use zstd. Input files ending in .gz or .zst are always"
+                        " decompressed as they are read. zstd needs the zstandard package for CSV files.")
+    parser.add_argument("--stdout", action='store_true', default=False, help="Write CSV output to standard output for piping instead"
+                        " of to a file next to the input file. Progress messages are written to standard error. Only with -ng/--no_gui.")
+    parser.add_argument("--save_scores", action='store_true', default=False, help="Also save the raw FFNN output scores or NMT"
+                        " hypotheses of every case to a folder next to the input file, named after the input file and model, such"
+                        " as codes.indirect_FFNN_scores, so that --from_scores can post-process them again. Only with -ng/--no_gui,"
+                        " not with --ensemble, --workers, --chunk_size, or --cache.")
+    parser.add_argument("--from_scores", help="Scores folder saved by --save_scores to post-process again with the selected output"
+                        " options and --threshold instead of converting an input file. The model and cases are those of the saved"
+                        " conversion. The output file is written next to the folder. Only with -ng/--no_gui.")
+    parser.add_argument("--threshold", type=float, help="Output score at or above which the indirect FFNN predicts an RCS code, added"
+                        f" to the output file name. The model was trained with {helper.INDIRECT_FFNN_THRESHOLD:g}. Only with --from_scores"
+                        " of the indirect FFNN.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes to convert cases across. Each worker loads the"
+                        " model once and converts contiguous shards of cases.")
+    parser.add_argument("--chunk_size", type=int, default=0, help="Read, convert, and write the input file in chunks of this many cases to keep"
+                        " memory use flat for large files. Cases are written in file order. In long format, the rows of each case must"
+                        " be next to each other. Use 0 to convert the whole file at once.")
+    parser.add_argument("--resume", action='store_true', default=False, help="Commit the output file after every chunk to a checkpoint"
+                        " file next to it, so that rerunning the same command after an interruption resumes after the last committed"
+                        " chunk with the same output file as an uninterrupted run. The checkpoint is removed once the file is"
+                        " converted. Only with --chunk_size and uncompressed CSV output to a file.")
+    parser.add_argument("--ffnn_batch_size", type=int, default=1024, help="Number of cases converted together in one batch. Only for FFNN models (direct FFNN or indirect FFNN).")
+    parser.add_argument("--ffnn_inference", default='sparse', choices=['sparse', 'dense'],
+                        help="How the first FFNN layer is computed. Use 'sparse' to sum the weights of only the codes present in each"
+                        " case. Use 'dense' to expand each batch to every known code first. Only for FFNN models (direct FFNN or indirect FFNN).")
+    parser.add_argument("--ffnn_backend", default='torch', choices=['torch', 'numpy'],
+                        help="Framework that runs the FFNN. Use 'numpy' to run the exported model weights without loading PyTorch,"
+                        " which starts faster and uses less memory. Only for FFNN models (direct FFNN or indirect FFNN).")
+    parser.add_argument("--precision", default='float32', choices=['float32', 'bfloat16', 'int8', 'int8_float32'],
+                        help="Numeric precision the model runs at. Use 'bfloat16' or 'int8' (dynamic quantization) for FFNN models with"
+                        " the torch backend. Use 'int8' or 'int8_float32' for NMT models. Reduced precisions are faster but may change"
+                        " some outputs, which --agreement_check measures.")
+    parser.add_argument("--agreement_check", action='store_true', default=False, help="Also convert the cases at full precision and"
+                        " report how many outputs of each output column differ from it. Only with a reduced precision and not with --serve.")
+    parser.add_argument("--nmt_batch_size", type=int, default=64, help="Maximum number of cases translated together in one batch. Cases are grouped by number of codes. Only for NMT models (direct NMT or indirect NMT).")
+    parser.add_argument("--inter_threads", type=int, default=1, help="Number of batches translated in parallel. Only for NMT models (direct NMT or indirect NMT).")
+    parser.add_argument("--intra_threads", type=int, default=0, help="Number of computation threads used per translated batch. Use 0 for the default. Only for NMT models (direct NMT or indirect NMT).")
+    parser.add_argument("--nmt_async", action='store_true', default=False, help="Submit translation batches asynchronously so that consecutive batches overlap. Only for NMT models (direct NMT or indirect NMT).")
+    parser.add_argument("--metrics", help="File path to write JSON metrics of the conversion to, with the wall time, CPU time, peak memory,"
+                        " cases per second, and batches of every pipeline stage as well as unknown code, deduplication, and result"
+                        " cache counts.")
+    parser.add_argument("--profile", help="File path to write cProfile statistics of the model conversion stage to, readable with pstats"
+                        " or snakeviz.")
+    parser.add_argument("--cache", help="File path to a result cache database, created if it does not exist. Cases whose codes were already"
+                        " converted with the same model and output options reuse the cached output. Cached outputs are discarded"
+                        " when the model files change.")
+    parser.add_argument("--cache_max_entries", type=int, default=1000000, help="Maximum number of outputs kept in the result cache, evicting"
+                        " the least recently used outputs first.")
 
     args = parser.parse_args()
 
-    # Require valid file if in no gui mode
-    if args.no_gui and (not args.file or not Path(args.file).is_file()):
-        raise ValueError('Must give valid file path if no-gui flag is used.')
+    # Expand the file paths and glob patterns into the files to convert
+    args.files, unmatched_file_patterns = helper.expand_file_patterns(args.file or [])
+
+    # Require at least one worker process and file worker
+    if args.workers < 1 or args.file_workers < 1:
+        raise ValueError('Must use at least one worker process and file worker.')
+
+    # Require non-negative chunk size
+    if args.chunk_size < 0:
+        raise ValueError('Chunk size cannot be negative.')
+
+    # Only resume chunked conversions whose output file can be cut back to the last committed chunk and appended to
+    if args.resume and (not args.chunk_size or args.output_format != 'csv' or args.compression != 'none' or args.stdout):
+        raise ValueError('Resumable conversions need --chunk_size and uncompressed CSV output to a file.')
+
+    # Require positive FFNN and NMT batch sizes
+    if args.ffnn_batch_size < 1 or args.nmt_batch_size < 1:
+        raise ValueError('FFNN and NMT batch sizes must be at least 1.')
+
+    # Take the model of the saved conversion when post-processing saved scores, which replaces converting input files, and
+    # only save the scores of whole files converted by a single process
+    if args.from_scores:
+        if not args.no_gui or args.serve or args.files or args.watch or args.ensemble or args.save_scores:
+            raise ValueError('Saved scores can only be post-processed with -ng/--no_gui, without input files, --watch, --serve, '
+                             '--ensemble, or --save_scores.')
+        import scores
+        args.model = scores.read_scores_metadata(args.from_scores)['model_type']
+    if args.save_scores and (not args.no_gui or args.serve or args.ensemble or args.workers > 1 or args.chunk_size or args.cache):
+        raise ValueError('Scores can only be saved with -ng/--no_gui, without --serve, --ensemble, --workers, --chunk_size, or --cache.')
+    if args.threshold is not None and (not args.from_scores or args.model != 'indirect_FFNN' or not 0 <= args.threshold <= 1):
+        raise ValueError('A threshold between 0 and 1 can only be given when post-processing saved scores of the indirect FFNN.')
+
+    # Require at least two different models for an ensemble, run from the command line by a single process, and an ensemble
+    # model that outputs an ISS for the consensus
+    if args.ensemble is not None:
+        args.ensemble = list(dict.fromkeys(args.ensemble))
+        if len(args.ensemble) < 2:
+            raise ValueError('An ensemble needs at least two different models.')
+        if not args.no_gui or args.serve or args.workers > 1 or args.agreement_check:
+            raise ValueError('Ensembles can only be run with -ng/--no_gui, without --serve, --workers, or --agreement_check.')
+    if args.consensus and (args.ensemble is None or args.no_iss and all(model_type in ['indirect_FFNN', 'indirect_NMT'] for model_type in args.ensemble)):
+        raise ValueError('The consensus ISS needs an ensemble with at least one model that outputs an ISS.')
+    model_list = args.ensemble or [args.model]
+
+    # Require a precision supported by the model types and FFNN backend, and a reduced precision for the agreement check
+    for model_type in model_list:
+        if model_type in ['direct_FFNN', 'indirect_FFNN'] and args.precision not in ['float32', 'bfloat16', 'int8']:
+            raise ValueError('FFNN models can only run at float32, bfloat16, or int8 precision.')
+        if model_type in ['direct_FFNN', 'indirect_FFNN'] and args.ffnn_backend == 'numpy' and args.precision != 'float32':
+            raise ValueError('Reduced precision FFNN inference needs the torch FFNN backend.')
+        if model_type in ['direct_NMT', 'indirect_NMT'] and args.precision not in ['float32', 'int8', 'int8_float32']:
+            raise ValueError('NMT models can only run at float32, int8, or int8_float32 precision.')
+    if args.agreement_check and args.precision == 'float32':
+        raise ValueError('The agreement check compares a reduced precision with float32. Select a reduced precision.')
+
+    # Require pyarrow for columnar output files, a supported output compression, and CSV output for standard output
+    if args.output_format != 'csv' and find_spec('pyarrow') is None:
+        raise ValueError('Parquet and Feather output files need pyarrow. Install pyarrow or use CSV output.')
+    if args.output_format == 'feather' and args.compression == 'gzip':
+        raise ValueError('Feather output can only be compressed with zstd.')
+    if args.output_format == 'csv' and args.compression == 'zstd' and find_spec('zstandard') is None:
+        raise ValueError('zstd compressed CSV output needs zstandard. Install zstandard or use gzip compression.')
+    if args.stdout and (args.output_format != 'csv' or not args.no_gui or args.serve):
+        raise ValueError('Only CSV output of a -ng/--no_gui conversion can be written to standard output.')
+    if args.stdout and (len(args.files) != 1 or args.watch) and not args.from_scores:
+        raise ValueError('Only the output of a single input file can be written to standard output.')
+
+    # Only profile one model conversion at a time, since the profiler cannot measure concurrent conversions
+    if args.profile and args.file_workers > 1:
+        raise ValueError('Cannot profile conversions of several files at once. Use one file worker.')
+    if args.profile and args.ensemble is not None:
+        raise ValueError('Cannot profile an ensemble, since its FFNN and NMT models convert at the same time. Profile each model on its own.')
+
+    # Require room for at least one result cache entry
+    if args.cache_max_entries < 1:
+        raise ValueError('Result cache must hold at least 1 entry.')
+
+    # Require a valid port and micro-batching limits for the server
+    if not 0 <= args.port <= 65535:
+        raise ValueError('Port must be between 0 and 65535.')
+    if args.max_batch_size < 1 or args.max_wait_ms < 0:
+        raise ValueError('Server micro-batches must hold at least 1 case and cannot wait a negative time.')
+
+    # Require valid files or a watch folder if in no gui mode
+    if args.no_gui and unmatched_file_patterns:
+        raise ValueError('No input files found for: ' + ', '.join(unmatched_file_patterns))
+    if args.no_gui and not args.files and not args.watch and not args.from_scores:
+        raise ValueError('Must give valid file path, watch folder, or scores folder if no-gui flag is used.')
+
+    # Require an existing watch folder, in no gui mode, and a positive watch interval
+    if args.watch and (not args.no_gui or args.serve or not Path(args.watch).is_dir()):
+        raise ValueError('Must give an existing watch folder and use the no-gui flag to watch a folder.')
+    if args.watch_interval <= 0:
+        raise ValueError('Watch interval must be positive.')
 
     # Check that an output option is selected when indirect method is used
-    if args.model in ['indirect_FFNN', 'indirect_NMT'] and args.no_iss and args.mais == args.max_sev_per_chapter is False:
+    if any(model_type in ['indirect_FFNN', 'indirect_NMT'] for model_type in model_list) and args.no_iss and args.mais == args.max_sev_per_chapter is False:
         raise ValueError('Must select some output for the indirect model. Cannot both ignore ISS as well as not output either the MAIS or greatest severity per AIS chapter.')
 
-    # Run respective main functions depending on whether no gui flag is set
-    if args.no_gui:
-        #  Confirm that a valid file path is provided
-        if not args.file or not Path(args.file).is_file():
-            raise ValueError('Must give valid file path if no-gui flag is used.')
+    # Run the server, or respective main functions depending on whether no gui flag is set
+    # Only import the modes that are used so that the command line never loads the GUI toolkit
+    if args.serve:
+        print('"Serve" flag was provided. Running in server mode......')
+        import server
+        server.main(args)
+
+    elif args.no_gui:
+        #  Confirm that valid file paths, a watch folder, or a scores folder are provided
+        if not args.files and not args.watch and not args.from_scores:
+            raise ValueError('Must give valid file path, watch folder, or scores folder if no-gui flag is used.')
         # Confirm that at least one output option is selected when an indirect model is used
-        if args.model in ['indirect_FFNN', 'indirect_NMT'] and args.no_iss and args.mais == args.max_sev_per_chapter is False:
+        if any(model_type in ['indirect_FFNN', 'indirect_NMT'] for model_type in model_list) and args.no_iss and args.mais == args.max_sev_per_chapter is False:
             raise ValueError('Must select some output for the indirect model. Cannot both ignore ISS as well as not output either the MAIS or greatest severity per AIS chapter.')
 
-        print('"No GUI" flag was provided. Running in terminal mode......')
-        no_gui.main(args)
+        # Write messages to standard error when the output is written to standard output so that they are not mixed into it
+        with redirect_stdout(sys.stderr) if args.stdout else nullcontext():
+            print('"No GUI" flag was provided. Running in terminal mode......')
+            import no_gui
+            no_gui.main(args)
 
     else:
         print('Running in GUI mode. Waiting for user to begin a conversion...')
+        import gui
         gui.main()
 
 
 if __name__ == "__main__":
+    # Let worker processes of the bundled application start up without re-running main
+    freeze_support()
     try:
         pyi_splash.close()
     except NameError:
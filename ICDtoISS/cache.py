@@ -0,0 +1,160 @@
+import sqlite3
+from importlib import resources
+from pathlib import Path
+from threading import Lock
+from time import time_ns
+
+# Files and folders in the data folder that determine the output of each model type. Cached outputs of a model type are
+# discarded whenever any of them change.
+MODEL_DATA_FILES = {
+    'direct_FFNN': ['direct_FF_model.tar', 'direct_FF_model.npz', 'icd10_codes.npy', 'icd10_code_dummies.npy', 'iss_by_dummy.npy'],
+    'indirect_FFNN': ['indirect_FF_model.tar', 'indirect_FF_model.npz', 'icd10_codes.npy', 'icd10_code_dummies.npy', 'ais_rcs_codes.npy', 'ais_rcs_code_dummies.npy'],
+    'direct_NMT': ['direct_NMT_model', 'iss_by_dummy.npy'],
+    'indirect_NMT': ['indirect_NMT_model', 'ais_rcs_codes.npy', 'ais_rcs_code_dummies.npy'],
+}
+
+
+class ResultCache:
+    """
+    Persistent SQLite cache of post-processed conversion outputs.
+
+    Each output is keyed by the model type, every option that changes its output, and the sorted codes of the
+    preprocessed case, so cases with the same codes share one entry across cases, files, and runs. At most max_entries
+    outputs are kept, evicting the least recently used outputs first. The cached outputs of a model type are discarded
+    automatically when its model files in the data folder change, as detected by their sizes and modification times.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1_000_000):
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1.')
+        self.path = path
+        self.max_entries = max_entries
+
+        self._lock = Lock()
+        self._validated_model_types = set()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results (model_type TEXT, options TEXT, codes TEXT, '
+                                     'output TEXT NOT NULL, last_used INTEGER NOT NULL, '
+                                     'PRIMARY KEY (model_type, options, codes)) WITHOUT ROWID')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS model_fingerprints (model_type TEXT PRIMARY KEY, '
+                                     'fingerprint TEXT NOT NULL)')
+        self._connection.execute('CREATE TEMP TABLE lookup_codes (codes TEXT PRIMARY KEY)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the cache database."""
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def get_many(self, codes_per_case_list: list, model_type: str, no_iss_bool: bool, mais_bool: bool,
+                 max_severity_chapter_bool: bool, ffnn_inference: str = 'sparse', ffnn_backend: str = 'torch',
+                 precision: str = 'float32') -> list:
+        """
+        Look up the cached outputs of preprocessed cases.
+
+        Args:
+            codes_per_case_list (list): List of lists that each contain all the trauma codes for a given patient/case.
+            model_type (str): Case representing which model type to use.
+            no_iss_bool (bool): Boolean representing whether ISS scores should not be outputted.
+            mais_bool (bool): Boolean representing whether the MAIS score should be outputted.
+            max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter
+            should be outputted.
+            ffnn_inference (str): Whether the FFNN runs on the 'sparse' or 'dense' input. Only for FFNN based models.
+            ffnn_backend (str): Framework that runs the FFNN. Only for FFNN based models.
+            precision (str): Numeric precision the model runs at.
+
+        Returns:
+            list: Cached post-processed output of each case, or None for cases that are not in the cache.
+        """
+        codes_key_list = [codes_key(code_list) for code_list in codes_per_case_list]
+        options = options_key(model_type, no_iss_bool, mais_bool, max_severity_chapter_bool, ffnn_inference, ffnn_backend, precision)
+        with self._lock, self._connection:
+            self._validate_model_files(model_type)
+            self._connection.execute('DELETE FROM lookup_codes')
+            self._connection.executemany('INSERT OR IGNORE INTO lookup_codes VALUES (?)', ((key,) for key in codes_key_list))
+            cached_output_dict = dict(self._connection.execute(
+                'SELECT results.codes, results.output FROM lookup_codes JOIN results ON results.model_type = ? AND '
+                'results.options = ? AND results.codes = lookup_codes.codes', (model_type, options)))
+            # Mark the found outputs as most recently used
+            self._connection.execute('UPDATE results SET last_used = ? WHERE model_type = ? AND options = ? AND codes IN '
+                                     '(SELECT codes FROM lookup_codes)', (time_ns(), model_type, options))
+        return [cached_output_dict.get(key) for key in codes_key_list]
+
+    def put_many(self, codes_per_case_list: list, output_list: list, model_type: str, no_iss_bool: bool, mais_bool: bool,
+                 max_severity_chapter_bool: bool, ffnn_inference: str = 'sparse', ffnn_backend: str = 'torch',
+                 precision: str = 'float32'):
+        """
+        Store the post-processed outputs of preprocessed cases, evicting the least recently used outputs if the cache
+        grows beyond max_entries. See get_many for the arguments.
+        """
+        options = options_key(model_type, no_iss_bool, mais_bool, max_severity_chapter_bool, ffnn_inference, ffnn_backend, precision)
+        last_used = time_ns()
+        with self._lock, self._connection:
+            self._validate_model_files(model_type)
+            self._connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                         ((model_type, options, codes_key(code_list), output, last_used)
+                                          for code_list, output in zip(codes_per_case_list, output_list)))
+            excess_entries = self._connection.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.max_entries
+            if excess_entries > 0:
+                self._connection.execute('DELETE FROM results WHERE (model_type, options, codes) IN (SELECT model_type, '
+                                         'options, codes FROM results ORDER BY last_used LIMIT ?)', (excess_entries,))
+
+    def _validate_model_files(self, model_type: str):
+        """Discard the cached outputs of the model type if its model files changed since they were cached."""
+        if model_type in self._validated_model_types:
+            return
+        fingerprint = model_files_fingerprint(model_type)
+        stored_fingerprint = self._connection.execute('SELECT fingerprint FROM model_fingerprints WHERE model_type = ?',
+                                                      (model_type,)).fetchone()
+        if stored_fingerprint is None or stored_fingerprint[0] != fingerprint:
+            self._connection.execute('DELETE FROM results WHERE model_type = ?', (model_type,))
+            self._connection.execute('INSERT OR REPLACE INTO model_fingerprints VALUES (?, ?)', (model_type, fingerprint))
+        self._validated_model_types.add(model_type)
+
+
+def codes_key(code_list) -> str:
+    """Canonical key of the codes of a case, independent of their order."""
+    return ' '.join(sorted(code_list))
+
+
+def options_key(model_type: str, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                ffnn_inference: str = 'sparse', ffnn_backend: str = 'torch', precision: str = 'float32') -> str:
+    """
+    Key of every option that changes the output of the model type. Direct models ignore all output options and NMT
+    models ignore the FFNN options. Reduced precisions are appended so that their outputs are kept apart from the full
+    precision outputs.
+    """
+    option_list = []
+    if model_type in ['indirect_FFNN', 'indirect_NMT']:
+        option_list.append(''.join('1' if option else '0' for option in (no_iss_bool, mais_bool, max_severity_chapter_bool)))
+    if model_type in ['direct_FFNN', 'indirect_FFNN']:
+        option_list.extend([ffnn_inference, ffnn_backend])
+    if precision != 'float32':
+        option_list.append(precision)
+    return ':'.join(option_list)
+
+
+def model_files_fingerprint(model_type: str) -> str:
+    """Fingerprint of the sizes and modification times of all the model files of the model type."""
+    data_path = Path(str(resources.files('data')))
+    file_path_list = []
+    for name in MODEL_DATA_FILES[model_type]:
+        path = data_path / name
+        file_path_list.extend(sorted(path.rglob('*')) if path.is_dir() else [path])
+    fingerprint_list = []
+    for file_path in file_path_list:
+        if file_path.is_file():
+            file_stat = file_path.stat()
+            fingerprint_list.append(f'{file_path.relative_to(data_path).as_posix()}:{file_stat.st_size}:{file_stat.st_mtime_ns}')
+    return ';'.join(fingerprint_list)
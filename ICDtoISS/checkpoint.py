@@ -0,0 +1,93 @@
+import json
+from os import fsync, replace
+from pathlib import Path
+
+# Version of the layout of checkpoint files, increased whenever older checkpoints can no longer be resumed from
+CHECKPOINT_FORMAT_VERSION = 2
+# Name endings added to the output file path for the checkpoint file of its conversion and the file of its code replacements
+CHECKPOINT_FILE_SUFFIX = '.checkpoint.json'
+CODE_REPLACEMENTS_FILE_SUFFIX = '.checkpoint.replacements.jsonl'
+
+
+class ChunkCheckpoint:
+    """
+    Checkpoint of a chunked conversion, kept next to its output file so that a rerun of the same conversion resumes after
+    the last chunk whose outputs were committed to the output file.
+
+    The checkpoint identifies the conversion by the path, size, and modification time of the input file and the options
+    that change the output file, and records the number of chunks and cases committed, the size of the output file after
+    the last committed chunk, and any other state that is reported at the end of the conversion. The outputs of a chunk
+    must be flushed to disk before the chunk is committed, and each commit atomically replaces the checkpoint file, so the
+    checkpoint never refers to outputs that were not written. The outputs of a chunk that was interrupted while being
+    written lie beyond the committed size and are cut off when resuming.
+
+    Code replacements grow with the input file, so rather than being rewritten with every checkpoint, the replacements new
+    to each chunk are appended as a JSON line to a separate file whose committed size is recorded in the checkpoint in the
+    same way as the size of the output file.
+    """
+
+    def __init__(self, output_file_path: str, input_file_path: str, options: dict):
+        self.output_file_path = output_file_path
+        self.path = output_file_path + CHECKPOINT_FILE_SUFFIX
+        self.code_replacements_path = output_file_path + CODE_REPLACEMENTS_FILE_SUFFIX
+        # Committed size of the code replacements file, after which the replacements of the next chunk are written
+        self._code_replacements_bytes = 0
+        input_stat = Path(input_file_path).stat()
+        # Round trip the identity through JSON so that it compares equal to the identity read back from the file
+        self._identity = json.loads(json.dumps({'format_version': CHECKPOINT_FORMAT_VERSION, 'input_file': str(Path(input_file_path).resolve()),
+                                                'input_size': input_stat.st_size, 'input_mtime_ns': input_stat.st_mtime_ns,
+                                                'options': options}))
+
+    def load(self) -> dict | None:
+        """
+        Read the state of the last committed chunk, with the code replacements of all committed chunks, if the checkpoint
+        belongs to the same input file and options and the output and code replacements files still hold everything that
+        was committed, or None if the conversion has to start over.
+        """
+        try:
+            with open(self.path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if any(checkpoint.get(key) != value for key, value in self._identity.items()):
+            return None
+        for path, committed_bytes in [(self.output_file_path, checkpoint['output_bytes']),
+                                      (self.code_replacements_path, checkpoint['code_replacements_bytes'])]:
+            if committed_bytes and (not Path(path).is_file() or Path(path).stat().st_size < committed_bytes):
+                return None
+        # Only read the code replacements of committed chunks
+        checkpoint['code_replacements'] = {}
+        if checkpoint['code_replacements_bytes']:
+            with open(self.code_replacements_path, 'rb') as code_replacements_file:
+                for line in code_replacements_file.read(checkpoint['code_replacements_bytes']).splitlines():
+                    checkpoint['code_replacements'].update(json.loads(line))
+        self._code_replacements_bytes = checkpoint['code_replacements_bytes']
+        return checkpoint
+
+    def commit(self, completed_chunks: int, cases_written: int, output_bytes: int, code_replacements: dict, **state):
+        """
+        Replace the checkpoint with the state after a chunk whose outputs were flushed to the output file, appending the
+        code replacements that the chunk added.
+        """
+        if code_replacements or not self._code_replacements_bytes:
+            # Write after the committed replacements, dropping any left by an interrupted chunk or an earlier conversion
+            with open(self.code_replacements_path, 'r+b' if self._code_replacements_bytes else 'wb') as code_replacements_file:
+                code_replacements_file.seek(self._code_replacements_bytes)
+                code_replacements_file.truncate()
+                if code_replacements:
+                    code_replacements_file.write(json.dumps(code_replacements).encode() + b'\n')
+                code_replacements_file.flush()
+                fsync(code_replacements_file.fileno())
+                self._code_replacements_bytes = code_replacements_file.tell()
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump(dict(self._identity, completed_chunks=completed_chunks, cases_written=cases_written, output_bytes=output_bytes,
+                           code_replacements_bytes=self._code_replacements_bytes, **state), checkpoint_file)
+            checkpoint_file.flush()
+            fsync(checkpoint_file.fileno())
+        replace(temporary_path, self.path)
+
+    def remove(self):
+        """Remove the checkpoint once the conversion is complete or its output file is discarded."""
+        Path(self.path).unlink(missing_ok=True)
+        Path(self.code_replacements_path).unlink(missing_ok=True)
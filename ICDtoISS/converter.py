@@ -1,76 +1,190 @@
-from bisect import bisect_left
+from __future__ import annotations
+
+import re
+from collections.abc import Callable
 from importlib import resources
+from importlib.util import find_spec
+from itertools import chain, islice, pairwise
 from os import sep
-from os.path import commonprefix, splitext
-import pickle
+from os.path import splitext
+from time import perf_counter
+from typing import TYPE_CHECKING
 
-import ctranslate2
 import numpy as np
-import pandas as pd
-import pandas.errors
-import torch
 from tqdm import tqdm
 
 import helper
+import writers
+
+# torch, ctranslate2, and pandas take long to import, so they are only imported once a model or input format that needs
+# them is used. This keeps NMT conversions free of torch and FFNN conversions free of ctranslate2.
+if TYPE_CHECKING:
+    import ctranslate2
+    import ffnn_numpy
+    import pandas as pd
+    import pyarrow as pa
+    import torch
+
+LONG_FORMAT_PARSER_ERROR_STRING = 'Encountered a pandas ParserError during importing of the data.\n\n Please check that the correct "input file data structure" option was selected.'
+LONG_FORMAT_COLUMNS_ERROR_STRING = 'Long format input data must have exactly two columns, the patient/case ID and the ICD-10 code.\n\n Please check that the correct "input file data structure" option was selected.'
+TABLE_PYARROW_ERROR_STRING = 'Importing Parquet or Feather input files needs pyarrow. Install pyarrow or convert the input file to CSV.'
+
+# Name of the consensus ISS output column of an ensemble of models
+CONSENSUS_COLUMN = 'median_iss'
+# Name ending of the folders of saved raw conversion output written next to their input files, such as '.indirect_FFNN_scores'
+SCORES_FOLDER_SUFFIX = '_scores'
+# Name ending of the output files written next to their input files, such as '.indirect_FFNN_iss_mais.csv.gz' or
+# '.ensemble_direct_FFNN_indirect_FFNN_iss_median_iss.csv'
+OUTPUT_FILE_NAME_PATTERN = re.compile(r'\.(ensemble(_(direct|indirect)_(FFNN|NMT))+|(direct|indirect)_(FFNN|NMT))(_iss)?(_mais)?'
+                                      r'(_max_chapter_severity)?(_median_iss)?(_threshold_[0-9.e+-]+)?\.(csv|parquet|feather)(\.gz|\.zst)?$')
+
+# Input file extensions of columnar file formats. Files with any other extension are read as CSV.
+TABLE_FILE_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather', '.ipc': 'feather'}
+
+# pyarrow is optional. When it is installed, whole input files are parsed by its multithreaded CSV reader and the codes are
+# held as Arrow strings, whose vectorized string operations run in Arrow compute kernels instead of Python.
+PYARROW_AVAILABLE = find_spec('pyarrow') is not None
+CSV_ENGINE = 'pyarrow' if PYARROW_AVAILABLE else 'c'
+
+
+def load_lookup_array(file_name: str) -> np.ndarray:
+    """Memory map a prebuilt lookup table array from the data folder so that every process shares the same pages."""
+    with resources.as_file(resources.files('data').joinpath(file_name)) as array_path:
+        return np.load(array_path, mmap_mode='r')
+
+
+def load_icd10_code_index() -> helper.CodeIndex:
+    """Load the sorted array of all known ICD-10 codes and the FFNN dummy variable index of each code."""
+    return helper.CodeIndex(load_lookup_array('icd10_codes.npy'), load_lookup_array('icd10_code_dummies.npy'))
+
+
+def load_iss_by_dummy() -> np.ndarray:
+    """Load the array of the ISS score of each direct dummy variable index."""
+    return load_lookup_array('iss_by_dummy.npy')
+
+
+def load_ais_rcs_code_index() -> helper.CodeIndex:
+    """Load the sorted array of all AIS RCS triplets and the indirect dummy variable index of each triplet."""
+    return helper.CodeIndex(load_lookup_array('ais_rcs_codes.npy'), load_lookup_array('ais_rcs_code_dummies.npy'))
+
+
+def load_model(model_type: str, inter_threads: int = 1, intra_threads: int = 0, ffnn_backend: str = 'torch',
+               precision: str = 'float32') -> torch.nn.Module | ffnn_numpy.NumpyNeuralNetwork | ctranslate2.Translator:
+    """
+    Load the selected conversion model from the data folder.
+
+    Args:
+        model_type (str): Case representing which model type to use.
+        inter_threads (int): Number of NMT batches translated in parallel. Only for NMT based models.
+        intra_threads (int): Number of computation threads used per NMT batch, with 0 using the ctranslate2 default.
+        Only for NMT based models.
+        ffnn_backend (str): Case representing which framework runs the FFNN. Either 'torch' to load the PyTorch model or
+        'numpy' to load its exported weights without importing torch. Only for FFNN based models.
+        precision (str): Case representing the numeric precision the model runs at. Either 'float32' for full precision,
+        'bfloat16' or 'int8' for a torch FFNN, or 'int8' or 'int8_float32' for an NMT translator.
+
+    Returns:
+        torch.nn.Module | ffnn_numpy.NumpyNeuralNetwork | ctranslate2.Translator: FFNN in evaluation mode on a cuda
+        enabled GPU if available or cpu if not, or its NumPy copy, for FFNN based models or a cpu translator for NMT
+        based models.
+    """
+    match model_type:
+        case 'direct_FFNN' | 'indirect_FFNN' if ffnn_backend == 'numpy':
+            import ffnn_numpy
+            # Load the weights exported from the FFNN model, which ends in LogSoftmax for direct and Sigmoid for indirect
+            weights_file_name, output_activation = ('direct_FF_model.npz', 'log_softmax') if model_type == 'direct_FFNN' else \
+                ('indirect_FF_model.npz', 'sigmoid')
+            with resources.as_file(resources.files('data').joinpath(weights_file_name)) as weights_path:
+                return ffnn_numpy.NumpyNeuralNetwork.load(weights_path, output_activation)
+
+        case 'direct_FFNN' | 'indirect_FFNN':
+            import torch
+
+            import ffnn
+            # Use cuda enabled GPU if available or cpu if not
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            # Initialize and load in the correct FFNN model based on direct vs indirect
+            if model_type == 'direct_FFNN':
+                model = ffnn.NeuralNetworkISS(num_input_categories=18372, num_output_categories=44)
+                model_path = str(resources.files('data').joinpath('direct_FF_model.tar'))
+            else:
+                model = ffnn.NeuralNetworkAIS(num_input_categories=18372, num_output_categories=104)
+                model_path = str(resources.files('data').joinpath('indirect_FF_model.tar'))
+            model.load_state_dict(torch.load(model_path, map_location=device))
+            model.to(device)
+            model.eval()
+            return ffnn.reduce_precision(model, precision)
+
+        case 'direct_NMT' | 'indirect_NMT':
+            import ctranslate2
+            translator_path = 'direct_NMT_model' + sep if model_type == 'direct_NMT' else 'indirect_NMT_model' + sep
+            # Quantize the translator weights when loading it if a reduced precision is selected
+            compute_type = 'default' if precision == 'float32' else precision
+            return ctranslate2.Translator(str(resources.files('data').joinpath(translator_path)), device='cpu', compute_type=compute_type,
+                                          inter_threads=inter_threads, intra_threads=intra_threads)
+
+        case _:
+            raise ValueError(f'Incompatible model type "{model_type}" was given.')
+
+
+def string_dtype() -> pd.ArrowDtype | pd.StringDtype:
+    """Return the dtype that input codes are imported as, which is an Arrow string when pyarrow is installed."""
+    import pandas as pd
+    if PYARROW_AVAILABLE:
+        import pyarrow as pa
+        return pd.ArrowDtype(pa.string())
+    return pd.StringDtype()
 
 
 def import_data(input_type: str, filepath: str) -> tuple[list | str, list | None]:
     """
    Import data from input file.
 
+   CSV files are read as text, with one code per line in long format or one case per line in wide format, and are
+   decompressed as they are read if they end in .gz or .zst. Parquet and
+   Arrow IPC (Feather) files are read as tables, with a patient/case ID column and an ICD-10 code column in long format
+   or a patient/case ID column followed by one column per code, with missing codes as nulls, in wide format.
+
    Args:
        input_type (str): Case representing how the data is formatted. Either 'code_per_row' or 'case_per_row'.
-       filepath (str): Path to the input file.
+       filepath (str): Path to the input file. Read as Parquet or Feather if it has one of their extensions.
 
    Returns:
        patient_ids (list): List of the patient/case IDs.
        codes_per_case_setlist (list): List of sets that contains the ICD-10 codes for a specific case. Index of one corresponds to the index of the other.
    """
+    file_format = input_file_format(filepath)
+    if file_format != 'csv' and not PYARROW_AVAILABLE:
+        return TABLE_PYARROW_ERROR_STRING, None
+
     match input_type:
         case 'code_per_row':  # Data formatted in long format (single code per row)
-            try:
-                codes_per_row_df = pd.read_csv(filepath, dtype='string', header=None)
-            except pandas.errors.ParserError:
-                error_string = 'Encountered a pandas ParserError during importing of the data.\n\n Please check that the correct "input file data structure" option was selected.'
-                return error_string, None
+            import pandas as pd
+            if file_format == 'csv':
+                try:
+                    codes_per_row_df = pd.read_csv(filepath, dtype=string_dtype(), header=None, engine=CSV_ENGINE)
+                # Files without any lines raise an EmptyDataError and are reported like any other file that cannot be parsed
+                except (pd.errors.ParserError, pd.errors.EmptyDataError):
+                    return LONG_FORMAT_PARSER_ERROR_STRING, None
+            else:
+                codes_per_row_df = read_table(filepath)
+            if codes_per_row_df.shape[1] != 2:
+                return LONG_FORMAT_COLUMNS_ERROR_STRING, None
             codes_per_row_df.columns = ['key', 'ICD10Code']
 
-            # Convert long format to list of IDs and list of lists, each containing the codes for a given case
-            keys, values = codes_per_row_df.sort_values('key').values.T
-            patient_ids, index = np.unique(keys, True)
-            arrays = np.split(values, index[1:])
+            # Convert long format to list of IDs and list of sets, each containing the trauma codes for a given case
+            patient_ids, codes_per_case_setlist = long_format_rows_to_cases(codes_per_row_df)
 
-            # Create a list of sets that contain only trauma codes for each case
-            codes_per_case_setlist = []
-            for patient_idx, codes_list in enumerate(arrays):
-                s_and_t_only_codes_list = [code.strip() for code in codes_list if code[0].upper() in ['S', 'T']]
-                if not s_and_t_only_codes_list:
-                    error_string = f'Case with ID#{patient_ids[patient_idx]} does not contain any trauma (S00-T88) ICD-10 codes.'
-                    return error_string, None
-                codes_per_case_setlist.append(set(s_and_t_only_codes_list))
+        case 'case_per_row' if file_format != 'csv':  # Data formatted in wide format in a columnar file
+            patient_ids, codes_per_case_setlist = wide_format_table_to_cases(read_table(filepath))
 
         case 'case_per_row':  # Data formatted in wide format (all codes per case in a row)
             # Open file and read all lines into a list of lists
-            with open(filepath, 'r') as input_file:
+            with helper.open_text_file(filepath, 'r', helper.path_compression(filepath)) as input_file:
                 codes_per_case_list = input_file.readlines()
 
             # Separate first item to a patient ID list and create a list of sets that contains only trauma codes for each case
-            patient_ids = []
-            codes_per_case_setlist = []
-            for codes_str in codes_per_case_list:
-                code_list = codes_str.split(',')
-                patient_ids.append(code_list.pop(0))
-                s_and_t_only_codes_list = [code.strip() for code in code_list if code[0].upper() in ['S', 'T']]
-                if not s_and_t_only_codes_list:
-                    error_string = f'The following case does not contain any trauma (S00-T88) ICD-10 codes:\n{codes_str}'
-                    return error_string, None
-                codes_per_case_setlist.append(set(s_and_t_only_codes_list))
-
-            # Confirm that the correct data structure option was chosen by checking for duplicates in the patient_ids list
-            if len(patient_ids) != len(set(patient_ids)):
-                error_string = 'Duplicate patient IDs were found in the first column, suggesting the input file is not in the selected wide format.\n\n Please check that the correct "input file data structure" option was selected.'
-                return error_string, None
-
+            patient_ids, codes_per_case_setlist = wide_format_lines_to_cases(codes_per_case_list)
 
         case '_':  # Case to catch any other structure type strings and throw error
             error_string = 'Incompatible file structure type was given. Can only accept "code_per_row" or "case_per_row".'
@@ -79,13 +193,265 @@ def import_data(input_type: str, filepath: str) -> tuple[list | str, list | None
     return patient_ids, codes_per_case_setlist
 
 
-def preprocess_data(codes_per_case_setlist: list, unknown_mode: str) -> tuple[list | str, dict | list | None]:
+def iter_import_data(input_type: str, filepath: str, chunk_size: int):
+    """
+    Import data from input file in chunks of cases so that memory use does not grow with the size of the file.
+
+    Unlike import_data, cases are kept in the order they appear in the file. In long format, the rows of each case must be
+    next to each other, which is how registry exports are written. A case whose rows span the boundary between two read
+    chunks is held back and completed with the rows of the next chunk. In wide format, duplicate patient IDs are only
+    checked for within each chunk.
+
+    Args:
+        input_type (str): Case representing how the data is formatted. Either 'code_per_row' or 'case_per_row'.
+        filepath (str): Path to the input file.
+        chunk_size (int): Number of cases per chunk.
+
+    Yields:
+        patient_ids (list | str): List of the patient/case IDs in the chunk or an error string, after which no more chunks
+        are yielded.
+        codes_per_case_setlist (list | None): List of sets that contains the ICD-10 codes for a specific case in the chunk.
+    """
+    if input_file_format(filepath) != 'csv' and not PYARROW_AVAILABLE:
+        yield TABLE_PYARROW_ERROR_STRING, None
+        return
+
+    match input_type:
+        case 'code_per_row':
+            case_chunks = _iter_long_format_cases(filepath, chunk_size)
+        case 'case_per_row':
+            case_chunks = _iter_wide_format_cases(filepath, chunk_size)
+        case _:
+            yield 'Incompatible file structure type was given. Can only accept "code_per_row" or "case_per_row".', None
+            return
+
+    # Regroup the complete cases read from the file into chunks of exactly chunk_size cases
+    patient_ids = []
+    codes_per_case_setlist = []
+    for chunk_patient_ids, chunk_codes_per_case_setlist in case_chunks:
+        if isinstance(chunk_patient_ids, str):
+            yield chunk_patient_ids, None
+            return
+        patient_ids.extend(chunk_patient_ids)
+        codes_per_case_setlist.extend(chunk_codes_per_case_setlist)
+        while len(patient_ids) >= chunk_size:
+            yield patient_ids[:chunk_size], codes_per_case_setlist[:chunk_size]
+            patient_ids = patient_ids[chunk_size:]
+            codes_per_case_setlist = codes_per_case_setlist[chunk_size:]
+    if patient_ids:
+        yield patient_ids, codes_per_case_setlist
+
+
+def _iter_long_format_cases(filepath: str, chunk_size: int):
+    """Yield the complete cases of each chunk of rows of a long format file, holding back any case that may continue in the next chunk."""
+    import pandas as pd
+    held_back_rows_df = None
+    try:
+        if input_file_format(filepath) == 'csv':
+            # The pyarrow engine cannot read in chunks, so chunks are always parsed by the pandas C engine
+            codes_per_row_chunks = pd.read_csv(filepath, dtype=string_dtype(), header=None, chunksize=chunk_size)
+        else:
+            codes_per_row_chunks = iter_table_chunks(filepath, chunk_size)
+        for codes_per_row_df in codes_per_row_chunks:
+            if codes_per_row_df.shape[1] != 2:
+                yield LONG_FORMAT_COLUMNS_ERROR_STRING, None
+                return
+            codes_per_row_df.columns = ['key', 'ICD10Code']
+            if held_back_rows_df is not None:
+                codes_per_row_df = pd.concat([held_back_rows_df, codes_per_row_df], ignore_index=True)
+            # Hold back the rows of the last case in the chunk since its remaining rows may be in the next chunk
+            last_case_row_mask = (codes_per_row_df['key'] == codes_per_row_df['key'].iat[-1]).to_numpy()
+            held_back_rows_df = codes_per_row_df[last_case_row_mask]
+            codes_per_row_df = codes_per_row_df[~last_case_row_mask]
+            if len(codes_per_row_df):
+                yield long_format_rows_to_cases(codes_per_row_df, sort_patient_ids=False)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError):
+        yield LONG_FORMAT_PARSER_ERROR_STRING, None
+        return
+    if held_back_rows_df is not None:
+        yield long_format_rows_to_cases(held_back_rows_df, sort_patient_ids=False)
+
+
+def _iter_wide_format_cases(filepath: str, chunk_size: int):
+    """Yield the cases of each chunk of lines of a wide format file."""
+    if input_file_format(filepath) != 'csv':
+        for codes_per_case_df in iter_table_chunks(filepath, chunk_size):
+            yield wide_format_table_to_cases(codes_per_case_df)
+        return
+    with helper.open_text_file(filepath, 'r', helper.path_compression(filepath)) as input_file:
+        while codes_per_case_list := list(islice(input_file, chunk_size)):
+            yield wide_format_lines_to_cases(codes_per_case_list)
+
+
+def input_file_format(filepath: str) -> str:
+    """Get the format of an input file from its extension, which is 'parquet', 'feather', or 'csv' for any other extension."""
+    return TABLE_FILE_FORMATS.get(splitext(filepath)[1].lower(), 'csv')
+
+
+def read_table(filepath: str) -> pd.DataFrame:
+    """Read a whole Parquet or Arrow IPC (Feather) input file into a data frame of string columns."""
+    import pyarrow.feather
+    import pyarrow.parquet
+    if input_file_format(filepath) == 'parquet':
+        return _string_columns_df(pyarrow.parquet.read_table(filepath))
+    return _string_columns_df(pyarrow.feather.read_table(filepath, memory_map=True))
+
+
+def iter_table_chunks(filepath: str, chunk_size: int):
+    """Yield data frames of string columns of at most chunk_size rows of a Parquet or Arrow IPC (Feather) input file."""
+    import pyarrow.feather
+    import pyarrow.parquet
+    if input_file_format(filepath) == 'parquet':
+        record_batches = pyarrow.parquet.ParquetFile(filepath).iter_batches(batch_size=chunk_size)
+    else:
+        # Arrow IPC files are memory mapped, so only the batches being converted are read from disk
+        record_batches = pyarrow.feather.read_table(filepath, memory_map=True).to_batches(max_chunksize=chunk_size)
+    for record_batch in record_batches:
+        yield _string_columns_df(record_batch)
+
+
+def _string_columns_df(table: pa.Table | pa.RecordBatch) -> pd.DataFrame:
+    """Cast every column of an Arrow table or record batch to strings, such as integer patient IDs, and convert it to a data frame."""
+    import pandas as pd
+    import pyarrow as pa
+    string_table = type(table).from_arrays([column.cast(pa.string()) for column in table.columns], names=table.column_names)
+    return string_table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def long_format_rows_to_cases(codes_per_row_df: pd.DataFrame, sort_patient_ids: bool = True) -> tuple[list | str, list | None]:
+    """
+    Group long format rows into cases, keeping only the trauma codes of each case.
+
+    Args:
+        codes_per_row_df (pd.DataFrame): Long format rows with a 'key' column of patient/case IDs and an 'ICD10Code' column.
+        sort_patient_ids (bool): Boolean representing whether cases should be sorted by patient ID rather than kept in the
+        order they first appear.
+
+    Returns:
+        patient_ids (list | str): List of the patient/case IDs or an error string.
+        codes_per_case_setlist (list | None): List of sets that contains the ICD-10 codes for a specific case.
+    """
+    import pandas as pd
+    key_codes, patient_ids = pd.factorize(codes_per_row_df['key'], sort=sort_patient_ids)
+    codes_per_case_setlist, case_without_trauma_idx = group_trauma_codes(key_codes, codes_per_row_df['ICD10Code'], len(patient_ids))
+    if case_without_trauma_idx is not None:
+        error_string = f'Case with ID#{patient_ids[case_without_trauma_idx]} does not contain any trauma (S00-T88) ICD-10 codes.'
+        return error_string, None
+
+    return patient_ids.to_numpy(dtype=object).tolist(), codes_per_case_setlist
+
+
+def wide_format_lines_to_cases(codes_per_case_list: list) -> tuple[list | str, list | None]:
+    """
+    Split wide format lines into cases, keeping only the trauma codes of each case.
+
+    Args:
+        codes_per_case_list (list): List of lines, each with a patient/case ID followed by the ICD-10 codes of the case.
+
+    Returns:
+        patient_ids (list | str): List of the patient/case IDs or an error string.
+        codes_per_case_setlist (list | None): List of sets that contains the ICD-10 codes for a specific case.
+    """
+    import pandas as pd
+    # Split every line into its fields and melt them into one row per field, indexed by the position of their line. Without
+    # pyarrow, the split creates a list per line.
+    with helper.paused_garbage_collection():
+        fields = pd.Series(codes_per_case_list, dtype=string_dtype()).str.split(',').explode()
+    return wide_format_fields_to_cases(fields, len(codes_per_case_list))
+
+
+def wide_format_table_to_cases(codes_per_case_df: pd.DataFrame) -> tuple[list | str, list | None]:
+    """
+    Split the rows of a wide format table into cases, keeping only the trauma codes of each case.
+
+    Args:
+        codes_per_case_df (pd.DataFrame): Wide format rows with a patient/case ID column followed by one column per code,
+        with missing codes as missing values.
+
+    Returns:
+        patient_ids (list | str): List of the patient/case IDs or an error string.
+        codes_per_case_setlist (list | None): List of sets that contains the ICD-10 codes for a specific case.
+    """
+    # Melt the columns into one row per field, indexed by the position of their row, and put the fields of each row back
+    # in column order
+    fields = codes_per_case_df.reset_index(drop=True).melt(ignore_index=False)['value']
+    fields = fields.iloc[np.argsort(fields.index.to_numpy(), kind='stable')]
+    return wide_format_fields_to_cases(fields, len(codes_per_case_df))
+
+
+def wide_format_fields_to_cases(fields: pd.Series, num_cases: int) -> tuple[list | str, list | None]:
+    """
+    Group the melted fields of wide format cases into cases, keeping only the trauma codes of each case.
+
+    Args:
+        fields (pd.Series): String series of every field of every case, indexed by the position of their case and in case
+        order. The first field of each case is its patient/case ID and the rest are its codes.
+        num_cases (int): Number of cases.
+
+    Returns:
+        patient_ids (list | str): List of the patient/case IDs or an error string.
+        codes_per_case_setlist (list | None): List of sets that contains the ICD-10 codes for a specific case.
+    """
+    # Files without any lines have no cases
+    if fields.empty:
+        return [], []
+    case_indices = fields.index.to_numpy()
+    patient_id_mask = np.r_[True, case_indices[1:] != case_indices[:-1]]
+    patient_ids = fields[patient_id_mask]
+    codes_per_case_setlist, case_without_trauma_idx = group_trauma_codes(case_indices[~patient_id_mask], fields[~patient_id_mask], num_cases)
+    if case_without_trauma_idx is not None:
+        case_string = ','.join(fields[case_indices == case_without_trauma_idx].dropna())
+        error_string = f'The following case does not contain any trauma (S00-T88) ICD-10 codes:\n{case_string}'
+        return error_string, None
+
+    # Confirm that the correct data structure option was chosen by checking for duplicates in the patient_ids list
+    if patient_ids.duplicated().any():
+        error_string = 'Duplicate patient IDs were found in the first column, suggesting the input file is not in the selected wide format.\n\n Please check that the correct "input file data structure" option was selected.'
+        return error_string, None
+
+    return patient_ids.to_numpy(dtype=object).tolist(), codes_per_case_setlist
+
+
+def group_trauma_codes(case_indices: np.ndarray, codes: pd.Series, num_cases: int) -> tuple[list, int | None]:
+    """
+    Gather the trauma codes of each case into a set, trimming and filtering all codes at once.
+
+    Args:
+        case_indices (np.ndarray): Index of the case that each code belongs to.
+        codes (pd.Series): String series of the codes, which may contain missing values.
+        num_cases (int): Number of cases.
+
+    Returns:
+        codes_per_case_setlist (list): List of sets that contains the trimmed trauma codes of each case.
+        case_without_trauma_idx (int | None): Index of the first case without any trauma codes or None if every case has
+        at least one.
+    """
+    codes = codes.str.strip()
+    trauma_code_mask = codes.str[:1].str.upper().isin(['S', 'T']).to_numpy(dtype=bool)
+    trauma_case_indices = case_indices[trauma_code_mask]
+    case_has_trauma_codes = np.bincount(trauma_case_indices, minlength=num_cases) > 0
+    if not case_has_trauma_codes.all():
+        return [], int(np.argmin(case_has_trauma_codes))
+
+    # Sort the trauma codes by case and slice out the codes of each case
+    order = np.argsort(trauma_case_indices, kind='stable')
+    trauma_codes = codes[trauma_code_mask].to_numpy(dtype=object)[order].tolist()
+    case_starts = np.searchsorted(trauma_case_indices[order], np.arange(num_cases + 1)).tolist()
+    with helper.paused_garbage_collection():
+        codes_per_case_setlist = [set(trauma_codes[start:end]) for start, end in pairwise(case_starts)]
+    return codes_per_case_setlist, None
+
+
+def preprocess_data(codes_per_case_setlist: list, unknown_mode: str,
+                    icd10_code_index: helper.CodeIndex | None = None) -> tuple[list | str, dict | list | None]:
     """
     Pre-process input data and handle unknown codes.
 
     Args:
        codes_per_case_setlist (list): List of sets that each contain all of the trauma codes for a given patient/case.
        unknown_mode (str): Case representing how to handle unknown codes.
+       icd10_code_index (helper.CodeIndex | None): Already loaded index of all known ICD-10 codes and their dummy
+       variables. Loaded from the data folder if not given.
 
     Returns:
        codes_per_case_list (list): List of lists contains the sorted trauma codes for a given case to be used in the conversion.
@@ -93,54 +459,31 @@ def preprocess_data(codes_per_case_setlist: list, unknown_mode: str) -> tuple[li
        closest method; list of patient IDs indexes that do not have any codes after ignoring unknown ones in the ignore
        method; None if all cases have at least one code in the ignore method; list of all unrecognized codes in the fail method.
     """
-    # Get all known ICD-10 codes used to train the models into a set
-    with resources.files('data').joinpath('icd10_to_dummy_dict.pickle').open('rb') as dict_serialized:
-        icd10_to_dummy_set = set(pickle.load(dict_serialized).keys())
+    # Look up every distinct code of the input at once and get the ones used to train the models into a set
+    if icd10_code_index is None:
+        icd10_code_index = load_icd10_code_index()
+    known_codes_set = set(icd10_code_index.lookup_dict(set().union(*codes_per_case_setlist)))
 
     match unknown_mode:
         case 'closest':  # Replace unknown codes with the closest lexicographic code
-            # Create sorted list of all known ICD-10 codes used to train the models
-            icd10_to_dummy_sorted_list = sorted(icd10_to_dummy_set)
-            # Create empty list for the final list of lists and empty dictionary of already used unknown to known conversion
-            codes_per_case_list = []
+            # Gather every distinct unknown code across all cases
+            all_unrecognized_codes_set = set().union(*(code_set - known_codes_set for code_set in codes_per_case_setlist))
             all_unrecognized_codes = {}
-            for code_set in codes_per_case_setlist:
-                # Identify which codes for a given case are already known and which are unknown.
-                recognized_code_set = code_set & icd10_to_dummy_set
-                unrecognized_codes_set = code_set - recognized_code_set
-                # For every unknown code for a given case
-                for unrecognized_code in unrecognized_codes_set:
-                    # Return the corresponding known code if its already exist in the dictionary. Returns none if not present.
-                    new_code = all_unrecognized_codes.get(unrecognized_code)
-                    # Find the known code to use if the unknown code is not already a key in the dictionary.
-                    if not new_code:
-                        # Get the left index of where the unknown code would fit in the sorted list of known codes.
-                        bisect_index = bisect_left(icd10_to_dummy_sorted_list, unrecognized_code)
-                        # If bisect index is at the edges of the sorted known codes list, pull the closets known code
-                        if bisect_index == 0:
-                            new_code = icd10_to_dummy_sorted_list[bisect_index]
-                        elif bisect_index == len(icd10_to_dummy_sorted_list):
-                            new_code = icd10_to_dummy_sorted_list[bisect_index - 1]
-                        # If bisect index is in the middle of the sorted known codes list, choose the one with the
-                        # longest commonprefix. Use the left code in case of a tie.
-                        else:
-                            left_code = icd10_to_dummy_sorted_list[bisect_index - 1]
-                            right_code = icd10_to_dummy_sorted_list[bisect_index]
-                            if (len(commonprefix([unrecognized_code, right_code])) >
-                                    len(commonprefix([unrecognized_code, left_code]))):
-                                new_code = right_code
-                            else:
-                                new_code = left_code
-                        # Update the dictionary with a new unknown to known code conversion
-                        all_unrecognized_codes[unrecognized_code] = new_code
-                    # Add the new known code to the list of codes to use for the conversion of a case.
-                    recognized_code_set.add(new_code)
-                # Convert set to sorted list and add it to the final list of lists.
-                codes_per_case_list.append(sorted(recognized_code_set))
+            if all_unrecognized_codes_set:
+                # Find the closest known code of all unknown codes at once using the sorted array of all known ICD-10 codes
+                unrecognized_codes_list = sorted(all_unrecognized_codes_set)
+                closest_codes_array = helper.closest_known_codes(helper.encode_codes(unrecognized_codes_list), icd10_code_index.sorted_codes)
+                all_unrecognized_codes = dict(zip(unrecognized_codes_list, np.char.decode(closest_codes_array, 'ascii').tolist()))
+            # Replace the unknown codes of each case with their closest known code, convert the set to a sorted list,
+            # and add it to the final list of lists.
+            codes_per_case_list = [
+                sorted({all_unrecognized_codes.get(code, code) for code in code_set})
+                for code_set in codes_per_case_setlist
+            ]
 
         case 'ignore':  # Filter out and ignore any unknown codes
             # Create a list of sorted lists containing only the known codes, ignoring the rest
-            codes_per_case_list = [sorted(code_set & icd10_to_dummy_set) for code_set in codes_per_case_setlist]
+            codes_per_case_list = [sorted(code_set & known_codes_set) for code_set in codes_per_case_setlist]
             # Check if any of the nested list is empty, meaning that a case doesn't have any recognizable codes
             if not all(codes_per_case_list):
                 # Get indexes where a nested list is empty that can be used to get the corresponding patient/case IDs
@@ -155,13 +498,13 @@ def preprocess_data(codes_per_case_setlist: list, unknown_mode: str) -> tuple[li
 
             for code_set in codes_per_case_setlist:
                 # Identify which codes for a given case are already known and which are unknown.
-                recognized_code_set = code_set & icd10_to_dummy_set
+                recognized_code_set = code_set & known_codes_set
                 unrecognized_codes_set = code_set - recognized_code_set
 
                 # Convert set of recognized codes into a sorted list and append to final list of lists.
                 codes_per_case_list.append(sorted(recognized_code_set))
                 # Add any unrecognized codes to the master set of unrecognized codes.
-                all_unrecognized_codes_set = all_unrecognized_codes_set | unrecognized_codes_set
+                all_unrecognized_codes_set |= unrecognized_codes_set
             # Convert set of unrecognized codes into a sorted list.
             all_unrecognized_codes = sorted(all_unrecognized_codes_set)
 
@@ -172,27 +515,30 @@ def preprocess_data(codes_per_case_setlist: list, unknown_mode: str) -> tuple[li
     return codes_per_case_list, all_unrecognized_codes
 
 
-def formatting_data(codes_per_case_list: list, model_type: str) -> list | str:
+def formatting_data(codes_per_case_list: list, model_type: str, icd10_code_index: helper.CodeIndex | None = None,
+                    ffnn_batch_size: int = 64) -> helper.SparseCodeMatrix | list | str:
     """
     Format preprocessed trauma codes to be inputted into the selected conversion tool.
 
     Args:
         codes_per_case_list (list): List of lists that each contain all the trauma codes for a given patient/case.
         model_type (str): Case representing which model type to use.
+        icd10_code_index (helper.CodeIndex | None): Already loaded index of all known ICD-10 codes and their dummy
+        variables. Loaded from the data folder if not given.
+        ffnn_batch_size (int): Number of cases per batched sparse matrix. Only for FFNN based models.
 
     Returns:
-        list: List of batched sparse matrices using dummy variables for FFNN based models or list of lists that contain
+        helper.SparseCodeMatrix | list: Sparse matrix of dummy variables that is iterated over in batches for FFNN based models or list of lists that contain
          correctly formatted ICD-10 codes, with a 'D' prefix and no periods, for NMT based models.
     """
     match model_type:
         case 'direct_FFNN' | 'indirect_FFNN':  # When a FFNN is selected
-            # Load in ICD-10 codes to dummy variables dictionary
-            with resources.files('data').joinpath('icd10_to_dummy_dict.pickle').open(
-                    'rb') as dict_serialized:
-                icd10_to_dummy_dict = pickle.load(dict_serialized)
-            # Convert input data into a list of batched sparse matrices of dummy variables as input for FFNN
-            batched_sparse_matrix_list = helper.build_sparse_matrix(codes_per_case_list, icd10_to_dummy_dict)
-            return batched_sparse_matrix_list
+            # Load in the index of ICD-10 codes to dummy variables
+            if icd10_code_index is None:
+                icd10_code_index = load_icd10_code_index()
+            # Convert input data into a sparse matrix of dummy variables, iterated over in batches as input for FFNN
+            sparse_code_matrix = helper.build_sparse_matrix(codes_per_case_list, icd10_code_index, ffnn_batch_size)
+            return sparse_code_matrix
 
         case 'direct_NMT' | 'indirect_NMT':  # When an NMT is selected
             # Format each code in the list of lists with a 'D' prefix and stripping of the periods
@@ -207,14 +553,36 @@ def formatting_data(codes_per_case_list: list, model_type: str) -> list | str:
             return error_string
 
 
-def convert_data(formatted_input_data: list, model_type: str) -> list:
+def convert_data(formatted_input_data: helper.SparseCodeMatrix | list, model_type: str,
+                 model: torch.nn.Module | ffnn_numpy.NumpyNeuralNetwork | ctranslate2.Translator | None = None,
+                 nmt_max_batch_size: int = 64, nmt_asynchronous: bool = False, ffnn_inference: str = 'sparse',
+                 show_progress: bool = True, stage_metrics: dict | None = None, ffnn_backend: str = 'torch',
+                 precision: str = 'float32', progress_callback: Callable[[int], None] | None = None,
+                 score_callback: Callable[[np.ndarray], None] | None = None) -> list:
     """
     Convert the formatted preprocessed input data into raw output data.
 
     Args:
-        formatted_input_data (list): List of batched sparse matrices using dummy variables for FFNN based models or list of lists
+        formatted_input_data (helper.SparseCodeMatrix | list): Sparse matrix of dummy variables iterated over in batches for FFNN based models or list of lists
         that contain correctly formatted ICD-10 codes, with a 'D' prefix and no periods, for NMT based models.
         model_type (str): Case representing which model type to use.
+        model (torch.nn.Module | ffnn_numpy.NumpyNeuralNetwork | ctranslate2.Translator | None): Already loaded FFNN of
+        the selected backend or translator matching the model type. Loaded from the data folder if not given.
+        nmt_max_batch_size (int): Maximum number of cases translated together in one batch. Only for NMT based models.
+        nmt_asynchronous (bool): Boolean representing whether batches should be submitted asynchronously so that
+        translation of consecutive batches overlaps. Only for NMT based models.
+        ffnn_inference (str): Case representing how the FFNN first layer is computed. Either 'sparse' to sum the weights
+        of the codes present in each case or 'dense' to densify each batch before the model. Only for FFNN based models.
+        show_progress (bool): Boolean representing whether a console progress bar should be shown.
+        stage_metrics (dict | None): Dictionary that the number of batches and, for FFNN based models, the seconds spent
+        densifying batches and in the model are added to if given.
+        ffnn_backend (str): Case representing which framework runs the FFNN. Either 'torch' or 'numpy'. Only for FFNN
+        based models.
+        precision (str): Case representing the numeric precision the model is loaded at if not given. See load_model.
+        progress_callback (Callable[[int], None] | None): Function called with the number of cases of each batch once the
+        batch is converted if given. An exception raised by it stops the conversion after that batch.
+        score_callback (Callable[[np.ndarray], None] | None): Function called with the raw output scores of each batch, as
+        a float32 matrix with a row per case, before they are turned into predictions if given. Only for FFNN based models.
 
     Returns:
         list: List of lists containing the predicted dummy variables for each case when FFNN based model is used or list
@@ -222,53 +590,145 @@ def convert_data(formatted_input_data: list, model_type: str) -> list:
 
     """
     match model_type:
+        case 'direct_FFNN' | 'indirect_FFNN' if ffnn_backend == 'numpy':  # Use the NumPy copy of a FFNN based model
+            import ffnn_numpy
+            # Load in the correct FFNN weights if not given
+            if model is None:
+                model = load_model(model_type, ffnn_backend='numpy')
+            # Preallocate the predictions of all cases, holding a predicted dummy variable per case for the direct model
+            # and a list of predicted dummy variables per case for the indirect model
+            if model_type == 'direct_FFNN':
+                prediction_array = np.empty(formatted_input_data.num_cases, dtype=np.int64)
+                get_prediction = ffnn_numpy.get_preds_direct_ff_batch
+            else:
+                prediction_array = [None] * formatted_input_data.num_cases
+                get_prediction = ffnn_numpy.get_preds_indirect_ff_batch
+            batch_start = 0
+            densify_seconds = model_seconds = 0.0
+            for input_indices, offsets in tqdm(formatted_input_data, disable=not show_progress):
+                # Get predicted dummy variables for each batch, gathering the first layer weight rows of the codes present
+                # in each case unless dense inference was selected
+                if ffnn_inference == 'sparse':
+                    model_start = perf_counter()
+                    scores = model.forward_sparse(input_indices, offsets)
+                else:
+                    densify_start = perf_counter()
+                    dense_input = ffnn_numpy.bags_to_dense(input_indices, offsets, formatted_input_data.num_columns)
+                    model_start = perf_counter()
+                    densify_seconds += model_start - densify_start
+                    scores = model(dense_input)
+                    del dense_input
+                model_seconds += perf_counter() - model_start
+                if score_callback is not None:
+                    score_callback(scores.astype(np.float32, copy=False))
+                prediction_array[batch_start:batch_start + len(offsets)] = get_prediction(scores)
+                batch_start += len(offsets)
+                if progress_callback is not None:
+                    progress_callback(len(offsets))
+
+            if stage_metrics is not None:
+                for count_name, count in [('batches', len(formatted_input_data)), ('densify_seconds', densify_seconds),
+                                          ('model_seconds', model_seconds)]:
+                    stage_metrics[count_name] = stage_metrics.get(count_name, 0) + count
+            return prediction_array if isinstance(prediction_array, list) else prediction_array.tolist()
+
         case 'direct_FFNN' | 'indirect_FFNN':  # Use a FFNN based model
 
-            # Use cuda enabled GPU if available or cpu if not
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            device = torch.device(device)
-            # Initialize empty list to hold list of lists of predicted dummy variables
-            prediction_list = []
-            # Initialize and load in the correct FFNN model and prediction selection function based on direct vs indirect
+            import torch
+
+            import ffnn
+            # Load in the correct FFNN model if not given
+            if model is None:
+                model = load_model(model_type, precision=precision)
+            # Preallocate the predictions of all cases, holding a predicted dummy variable per case for the direct model
+            # and a list of predicted dummy variables per case for the indirect model
             if model_type == 'direct_FFNN':
-                model = helper.NeuralNetworkISS(num_input_categories=18372, num_output_categories=44)
-                model_path = str(resources.files('data').joinpath('direct_FF_model.tar'))
-                model.load_state_dict(torch.load(model_path, map_location=device))
-                get_prediction = helper.get_preds_direct_ff
+                prediction_array = np.empty(formatted_input_data.num_cases, dtype=np.int64)
+                get_prediction = ffnn.get_preds_direct_ff_batch
             else:
-                model = helper.NeuralNetworkAIS(num_input_categories=18372, num_output_categories=104)
-                model_path = str(resources.files('data').joinpath('indirect_FF_model.tar'))
-                model.load_state_dict(torch.load(model_path, map_location=device))
-                get_prediction = helper.get_preds_indirect_ff
-            # Load in model to gpu or cpu and use tqdm for progress bar
-            model.to(device)
-            for sparse_matrix_batch in tqdm(formatted_input_data):
+                prediction_array = [None] * formatted_input_data.num_cases
+                get_prediction = ffnn.get_preds_indirect_ff_batch
+            # Send batches to the same device as the model, with dense batches at the precision of the model, and use
+            # tqdm for progress bar
+            model_parameter = next(model.parameters())
+            device = model_parameter.device
+            batch_start = 0
+            densify_seconds = model_seconds = 0.0
+            for input_indices, offsets in tqdm(formatted_input_data, disable=not show_progress):
+                input_indices = torch.from_numpy(input_indices).to(device)
+                offsets = torch.from_numpy(offsets).to(device)
                 # Get predicted dummy variables for each batch using the inference mode
                 with torch.inference_mode():
-                    scores = model(sparse_matrix_batch.to(device).to_dense())
-                # Get predictions using selected function for each case in a given batch and save to main list to be returned
-                prediction_batch = [get_prediction(score) for score in scores.detach().cpu()]
-                prediction_list = prediction_list + prediction_batch
+                    if ffnn_inference == 'sparse':
+                        model_start = perf_counter()
+                        scores = model.forward_sparse(input_indices, offsets)
+                    else:
+                        densify_start = perf_counter()
+                        dense_input = ffnn.bags_to_dense(input_indices, offsets, formatted_input_data.num_columns, model_parameter.dtype)
+                        model_start = perf_counter()
+                        densify_seconds += model_start - densify_start
+                        scores = model(dense_input)
+                        del dense_input
+                    model_seconds += perf_counter() - model_start
+                scores = scores.detach().cpu()
+                if score_callback is not None:
+                    score_callback(scores.float().numpy())
+                # Get predictions using selected function for each case in a given batch and save to the preallocated predictions
+                prediction_array[batch_start:batch_start + len(offsets)] = get_prediction(scores)
+                batch_start += len(offsets)
 
                 del scores
+                if progress_callback is not None:
+                    progress_callback(len(offsets))
 
-            return prediction_list
+            if stage_metrics is not None:
+                for count_name, count in [('batches', len(formatted_input_data)), ('densify_seconds', densify_seconds),
+                                          ('model_seconds', model_seconds)]:
+                    stage_metrics[count_name] = stage_metrics.get(count_name, 0) + count
+            return prediction_array if isinstance(prediction_array, list) else prediction_array.tolist()
 
         case 'direct_NMT' | 'indirect_NMT':  # Use a NMT based model
-            # Load in selected NMT based translator
-            translator_path = 'direct_NMT_model' + sep if model_type == 'direct_NMT' else 'indirect_NMT_model' + sep
-            translator = ctranslate2.Translator(
-                str(resources.files('data').joinpath(translator_path)),
-                device='cpu')
-            # Translated the codes of each case using the selected translator and save predictions to main list to be returned
-            results = []
-            for formatted_codes_list in tqdm(formatted_input_data):
-                prediction = translator.translate_batch([formatted_codes_list])
-                results.append(prediction[0].hypotheses[0])
-            return results
+            # Load in selected NMT based translator if not given
+            translator = model if model is not None else load_model(model_type, precision=precision)
+            if stage_metrics is not None:
+                stage_metrics['batches'] = stage_metrics.get('batches', 0) + -(-len(formatted_input_data) // nmt_max_batch_size)
+            # Translate the codes of all cases in batches of similar length using the selected translator and return the
+            # predictions in the original case order
+            with tqdm(total=len(formatted_input_data), disable=not show_progress) as progress_bar:
+                return helper.translate_in_length_buckets(translator, formatted_input_data, nmt_max_batch_size,
+                                                          nmt_asynchronous, progress_bar, progress_callback)
+
+
+def predictions_from_scores(score_matrix: np.ndarray, model_type: str, threshold: float = helper.INDIRECT_FFNN_THRESHOLD,
+                            batch_size: int = 65536) -> list:
+    """
+    Turn raw FFNN output scores saved during a conversion into predicted dummy variables without running the model again.
+
+    Args:
+        score_matrix (np.ndarray): Matrix of the output scores of each case, such as a memory mapped scores file, which is
+        read in batches of rows.
+        model_type (str): Case representing which FFNN based model produced the scores.
+        threshold (float): Output score at or above which the indirect FFNN predicts an RCS code. Only for the indirect FFNN.
+        batch_size (int): Number of cases whose scores are read and turned into predictions at once.
+
+    Returns:
+        list: List of the predicted dummy variable of each case for the direct FFNN or list of lists containing the
+        predicted dummy variables of each case for the indirect FFNN, as returned by convert_data.
+    """
+    import ffnn_numpy
 
+    prediction_list = []
+    for batch_start in range(0, len(score_matrix), batch_size):
+        batch_scores = np.asarray(score_matrix[batch_start:batch_start + batch_size])
+        if model_type == 'direct_FFNN':
+            prediction_list.extend(ffnn_numpy.get_preds_direct_ff_batch(batch_scores).tolist())
+        else:
+            prediction_list.extend(ffnn_numpy.get_preds_indirect_ff_batch(batch_scores, threshold))
+    return prediction_list
 
-def postprocess_data(conversion_output: list, model_type: str, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool) -> list:
+
+def postprocess_data(conversion_output: list, model_type: str, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                     iss_by_dummy: np.ndarray | None = None, ais_rcs_code_index: helper.CodeIndex | None = None) -> list:
     """
     Post-process raw conversion output and handle any missing or incompatible data.
 
@@ -280,6 +740,10 @@ def postprocess_data(conversion_output: list, model_type: str, no_iss_bool: bool
         mais_bool (bool): Boolean representing whether the MAIS score should be outputted.
         max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter should be
         outputted.
+        iss_by_dummy (np.ndarray | None): Already loaded array of the ISS score of each dummy variable for direct
+        models. Loaded from the data folder if not given.
+        ais_rcs_code_index (helper.CodeIndex | None): Already loaded index of all RCS codes and their dummy variables for
+        indirect models. Loaded from the data folder if not given.
 
     Returns:
         list: List of the predicted ISS scores as a string when a direct model is used or list of strings containing the desired calculated
@@ -288,21 +752,18 @@ def postprocess_data(conversion_output: list, model_type: str, no_iss_bool: bool
     """
     match model_type:
         case 'direct_FFNN':  # When a direct FFNN model is selected
-            # Load in dictionary to convert direct FFNN predicted dummy variables to ISS scores
-            with (resources.files('data').joinpath('dummy_to_iss_dict.pickle').open('rb')
-                  as dict_serialized):
-                dummy_to_iss_dict = pickle.load(dict_serialized)
-            # Convert each predicted dummy variable into corresponding ISS score and return list
-            return [
-                dummy_to_iss_dict[encoded_int]
-                for encoded_int in conversion_output
-            ]
+            # Load in array to convert direct FFNN predicted dummy variables to ISS scores
+            if iss_by_dummy is None:
+                iss_by_dummy = load_iss_by_dummy()
+            # Convert each predicted dummy variable into corresponding ISS score string and return list
+            iss_string_array = np.array(iss_by_dummy.tolist(), dtype=str)
+            return iss_string_array[np.asarray(conversion_output, dtype=np.int64)].tolist()
 
         case 'direct_NMT':  # When a direct NMT model is selected
             # Get a set of all possible ISS scores
-            with (resources.files('data').joinpath('dummy_to_iss_dict.pickle').open('rb')
-                  as dict_serialized):
-                possible_iss_set = set(pickle.load(dict_serialized).values())
+            if iss_by_dummy is None:
+                iss_by_dummy = load_iss_by_dummy()
+            possible_iss_set = set(map(str, iss_by_dummy.tolist()))
             # Select only the first predicted ISS score if multiple are predicted from the NMT, confirm that it is a possible
             # ISS score, and return the full list. If the first predicted ISS score is not possible, replace with NaN.
             return [
@@ -311,42 +772,163 @@ def postprocess_data(conversion_output: list, model_type: str, no_iss_bool: bool
                 for pred in conversion_output]
 
         case 'indirect_FFNN':  # When an indirect FFNN model is selected
-            # Load in dictionary to convert indirect FFNN predicted dummy variables to RCS codes
-            with (resources.files('data').joinpath('dummy_to_ais_rcs_dict.pickle').open('rb')
-                  as dict_serialized):
-                dummy_to_ais_rcs_dict = pickle.load(dict_serialized)
-            # For each set of selected dummy variables as predictions, convert each into corresponding RCS triplets and
-            # generate the desired outputs for the case. If list containing dummy variable predictions is empty, replace with NaN.
-            return [
-                helper.calc_severity_scores(
-                    [dummy_to_ais_rcs_dict[encoded_rcs]
-                     for encoded_rcs in encoded_rcs_list
-                     ], no_iss_bool, mais_bool, max_severity_chapter_bool)
-                if encoded_rcs_list else 'NaN'
-                for encoded_rcs_list in conversion_output
-            ]
+            # Load in index to convert indirect FFNN predicted dummy variables to RCS codes
+            if ais_rcs_code_index is None:
+                ais_rcs_code_index = load_ais_rcs_code_index()
+            # Flatten the predicted dummy variables of all cases, keeping track of the case each prediction belongs to
+            predictions_per_case_count = np.fromiter(map(len, conversion_output), dtype=np.int64, count=len(conversion_output))
+            encoded_rcs_array = np.fromiter(chain.from_iterable(conversion_output), dtype=np.int64, count=predictions_per_case_count.sum())
 
         case 'indirect_NMT':  # When an indirect NMT model is selected
-            # Get a set of all possible RCS codes
-            with (resources.files('data').joinpath('dummy_to_ais_rcs_dict.pickle').open('rb')
-                  as dict_serialized):
-                possible_ais_rcs_set = set(pickle.load(dict_serialized).values())
-            # For each set of predicted RCS codes for a given case, remove any unrecognized/non-RCS codes and generate
-            # the desired outputs for the case. If the set of predictions is empty, replace with NaN.
-            output_list = []
-            for pred_rcs_list in conversion_output:
-                pred_rcs_set = set(pred_rcs_list)
-                for pred_rcs in set(pred_rcs_set):
-                    if pred_rcs not in possible_ais_rcs_set:
-                        pred_rcs_set.remove(pred_rcs)
-                if pred_rcs_set:
-                    output_list.append(helper.calc_severity_scores(pred_rcs_set, no_iss_bool, mais_bool, max_severity_chapter_bool))
-                else:
-                    output_list.append('NaN')
-            return output_list
+            # Get a dictionary of all possible RCS codes to their dummy variables
+            if ais_rcs_code_index is None:
+                ais_rcs_code_index = load_ais_rcs_code_index()
+            ais_rcs_to_dummy_dict = ais_rcs_code_index.lookup_dict(set().union(*conversion_output))
+            # For each set of predicted RCS codes for a given case, remove any unrecognized/non-RCS codes and flatten the
+            # dummy variables of the remaining codes of all cases, keeping track of the case each code belongs to
+            encoded_rcs_per_case_list = [
+                {ais_rcs_to_dummy_dict[pred_rcs] for pred_rcs in pred_rcs_list if pred_rcs in ais_rcs_to_dummy_dict}
+                for pred_rcs_list in conversion_output
+            ]
+            predictions_per_case_count = np.fromiter(map(len, encoded_rcs_per_case_list), dtype=np.int64, count=len(encoded_rcs_per_case_list))
+            encoded_rcs_array = np.fromiter(chain.from_iterable(encoded_rcs_per_case_list), dtype=np.int64, count=predictions_per_case_count.sum())
+
+        case _:
+            raise ValueError(f'Incompatible model type "{model_type}" was given.')
+
+    # Convert the predicted RCS codes of all cases of an indirect model into region, chapter, and severity arrays and
+    # generate the desired outputs for every case at once. Cases without any predicted RCS codes are output as NaN.
+    body_region_lookup, chapter_lookup, severity_lookup = helper.rcs_lookup_arrays(ais_rcs_code_index)
+    case_index = np.repeat(np.arange(len(conversion_output)), predictions_per_case_count)
+    return helper.calc_severity_scores(case_index, body_region_lookup[encoded_rcs_array], chapter_lookup[encoded_rcs_array],
+                                       severity_lookup[encoded_rcs_array], len(conversion_output), no_iss_bool, mais_bool,
+                                       max_severity_chapter_bool)
+
+
+def output_column_names(model_type: str, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool) -> list:
+    """
+    Get the names of the output columns of each case for the selected model and output options.
+
+    Args:
+        model_type (str): Case representing which model type to use.
+        no_iss_bool (bool): Boolean representing whether ISS scores should not be outputted.
+        mais_bool (bool): Boolean representing whether the MAIS score should be outputted.
+        max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter should be
+        outputted.
+
+    Returns:
+        list: Names of the output columns in the order they are written.
+    """
+    if model_type in ['direct_FFNN', 'direct_NMT']:
+        return ['iss']
+    output_column_list = []
+    if not no_iss_bool:
+        output_column_list.append('iss')
+    if mais_bool:
+        output_column_list.append('mais')
+    if max_severity_chapter_bool:
+        output_column_list.extend(['ch1_head', 'ch2_face', 'ch3_neck', 'ch4_thorax', 'ch5_abdomen', 'ch6_spine',
+                                   'ch7_upper_extremity', 'ch8_lower_extremity', 'ch9_external', 'ch0_miscellaneous'])
+    return output_column_list
+
+
+def ensemble_output_column_names(model_list: list, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                                 consensus_bool: bool = False) -> list:
+    """
+    Get the names of the output columns of each case for an ensemble of models, with the output columns of each model
+    prefixed by its model type, followed by the consensus ISS column if selected.
+
+    Args:
+        model_list (list): Model types of the ensemble, in the order their outputs are written.
+        no_iss_bool (bool): Boolean representing whether ISS scores of indirect models should not be outputted.
+        mais_bool (bool): Boolean representing whether the MAIS score of indirect models should be outputted.
+        max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter of indirect
+        models should be outputted.
+        consensus_bool (bool): Boolean representing whether the consensus ISS of the models is outputted.
+
+    Returns:
+        list: Names of the output columns in the order they are written.
+    """
+    output_column_list = [model_type + '_' + column for model_type in model_list
+                          for column in output_column_names(model_type, no_iss_bool, mais_bool, max_severity_chapter_bool)]
+    if consensus_bool:
+        output_column_list.append(CONSENSUS_COLUMN)
+    return output_column_list
+
+
+def merge_ensemble_outputs(output_lists: list, model_list: list, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                           consensus_bool: bool = False) -> list:
+    """
+    Merge the post-processed outputs of each model of an ensemble into one output string per case.
+
+    The outputs of a case whose output of a model is 'NaN' get a NaN for every output column of that model. The consensus
+    ISS of a case is the lower median of the ISS outputs of the models that are not NaN, so that it is always an ISS
+    predicted by one of the models, and NaN if no model predicted an ISS.
+
+    Args:
+        output_lists (list): List of the post-processed outputs of all cases for each model of the ensemble.
+        model_list (list): Model types of the ensemble, in the same order as the outputs.
+        no_iss_bool (bool): Boolean representing whether ISS scores of indirect models should not be outputted.
+        mais_bool (bool): Boolean representing whether the MAIS score of indirect models should be outputted.
+        max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter of indirect
+        models should be outputted.
+        consensus_bool (bool): Boolean representing whether the consensus ISS of the models is outputted.
+
+    Returns:
+        list: List of strings containing the merged outputs of each case, in the order of ensemble_output_column_names.
+    """
+    model_output_lists = []
+    iss_column_list = []
+    for model_type, output_list in zip(model_list, output_lists):
+        output_column_list = output_column_names(model_type, no_iss_bool, mais_bool, max_severity_chapter_bool)
+        nan_string = ','.join(['NaN'] * len(output_column_list))
+        model_output_lists.append([nan_string if output == 'NaN' else output for output in output_list])
+        # Collect the ISS outputs of the models that output an ISS for the consensus, with NaN outputs as NaN
+        if consensus_bool and 'iss' in output_column_list:
+            output_matrix, nan_mask = writers.parse_outputs(output_list, len(output_column_list))
+            iss_idx = output_column_list.index('iss')
+            iss_column_list.append(np.where(nan_mask[:, iss_idx], np.nan, output_matrix[:, iss_idx]))
+
+    if consensus_bool:
+        consensus_iss_array = helper.lower_median(np.column_stack(iss_column_list))
+        model_output_lists.append(['NaN' if np.isnan(iss) else str(int(iss)) for iss in consensus_iss_array.tolist()])
+    return list(map(','.join, zip(*model_output_lists)))
+
+
+def open_ensemble_result_writer(file_path: str, model_list: list, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                                consensus_bool: bool = False, output_format: str = 'csv', compression: str | None = None,
+                                output_file_path: str | None = None, append: bool = False) -> writers.CsvResultWriter | writers.ArrowResultWriter:
+    """
+    Open a writer of the output file of an ensemble of models for an input file, to which merged outputs can be written as
+    they are produced.
+
+    Args:
+        file_path (str): Path to the input file.
+        model_list (list): Model types of the ensemble, in the order their outputs are written.
+        no_iss_bool (bool): Boolean representing whether ISS scores of indirect models should not be outputted.
+        mais_bool (bool): Boolean representing whether the MAIS score of indirect models should be outputted.
+        max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter of indirect
+        models should be outputted.
+        consensus_bool (bool): Boolean representing whether the consensus ISS of the models is outputted.
+        output_format (str): Case representing the output file format. Either 'csv', 'parquet', or 'feather'.
+        compression (str | None): Compression of the output file, either 'gzip' or 'zstd', or None for no compression.
+        output_file_path (str | None): Path to write the output to, or '-' for standard output. Written next to the input
+        file if not given.
+        append (bool): Boolean representing whether the results should be appended to an existing output file, without a
+        header, rather than overwriting it. Only for CSV output.
+
+    Returns:
+        writers.CsvResultWriter | writers.ArrowResultWriter: Writer of the output file, with the output file path as its path.
+    """
+    output_column_list = ensemble_output_column_names(model_list, no_iss_bool, mais_bool, max_severity_chapter_bool, consensus_bool)
+    if output_file_path is None:
+        output_file_path = ensemble_output_file_path(file_path, model_list, no_iss_bool, mais_bool, max_severity_chapter_bool,
+                                                     consensus_bool, output_format, compression)
+    return writers.open_result_writer(output_file_path, output_column_list, output_format, append, compression)
 
 
-def output_iss_results(patient_ids, output_list, file_path, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool) -> str:
+def output_iss_results(patient_ids, output_list, file_path, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool, append=False,
+                       output_format='csv', compression=None, output_file_path=None) -> str:
     """
     Output postprocessed results in desired format.
 
@@ -360,44 +942,151 @@ def output_iss_results(patient_ids, output_list, file_path, model_type, no_iss_b
         mais_bool (bool): Boolean representing whether the MAIS score should be outputted.
         max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter should be
         outputted.
+        append (bool): Boolean representing whether the results should be appended to an existing output file, without a
+        header, rather than overwriting it. Only for CSV output.
+        output_format (str): Case representing the output file format. Either 'csv', 'parquet', or 'feather'.
+        compression (str | None): Compression of the output file, either 'gzip' or 'zstd', or None for no compression.
+        output_file_path (str | None): Path to write the output to, or '-' for standard output. Written next to the input
+        file if not given.
 
     Returns:
         output_file_path (str): Path to the written output file.
 
     """
-    # Since the filename suffix, header of the file, and what to output for a line if there is a NaN depend on the selected model and output options, 
-    # iteratively build up those strings and lists that will be joined together.
+    with open_result_writer(file_path, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool, output_format, append,
+                            compression, output_file_path) as writer:
+        writer.write(patient_ids, output_list)
+    return writer.path
+
+
+def open_result_writer(file_path: str, model_type: str, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                       output_format: str = 'csv', append: bool = False, compression: str | None = None,
+                       output_file_path: str | None = None) -> writers.CsvResultWriter | writers.ArrowResultWriter:
+    """
+    Open a writer of the output file of an input file, to which results can be written as they are produced.
+
+    Args:
+        file_path (str): Path to the input file.
+        model_type (str): Case representing which model type to use.
+        no_iss_bool (bool): Boolean representing whether ISS scores should not be outputted.
+        mais_bool (bool): Boolean representing whether the MAIS score should be outputted.
+        max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter should be
+        outputted.
+        output_format (str): Case representing the output file format. Either 'csv', 'parquet', or 'feather'.
+        append (bool): Boolean representing whether the results should be appended to an existing output file, without a
+        header, rather than overwriting it. Only for CSV output.
+        compression (str | None): Compression of the output file, either 'gzip' or 'zstd', or None for no compression.
+        Compressed CSV output files get the extension of the compression added to their name.
+        output_file_path (str | None): Path to write the output to, or '-' for standard output. Written next to the input
+        file if not given.
+
+    Returns:
+        writers.CsvResultWriter | writers.ArrowResultWriter: Writer of the output file, with the output file path as its path.
+    """
+    output_column_list = output_column_names(model_type, no_iss_bool, mais_bool, max_severity_chapter_bool)
+    if output_file_path is None:
+        output_file_path = default_output_file_path(file_path, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool,
+                                                    output_format, compression)
+    return writers.open_result_writer(output_file_path, output_column_list, output_format, append, compression)
+
+
+def default_output_file_path(file_path: str, model_type: str, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                             output_format: str = 'csv', compression: str | None = None, threshold: float | None = None) -> str:
+    """
+    Get the path of the output file written next to an input file, named after the input file and the selected options.
+
+    Args:
+        file_path (str): Path to the input file.
+        model_type (str): Case representing which model type to use.
+        no_iss_bool (bool): Boolean representing whether ISS scores should not be outputted.
+        mais_bool (bool): Boolean representing whether the MAIS score should be outputted.
+        max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter should be
+        outputted.
+        output_format (str): Case representing the output file format. Either 'csv', 'parquet', or 'feather'.
+        compression (str | None): Compression of the output file, either 'gzip' or 'zstd', or None for no compression.
+        threshold (float | None): Output score threshold the indirect FFNN predictions were made at, added to the filename
+        if given. Only for the indirect FFNN.
+
+    Returns:
+        str: Path to the output file.
+    """
+    # Since the filename suffix depends on the selected model and output options, iteratively build up the string.
     output_file_addon = model_type
-    file_header = 'patient_id'
-    nan_string_list = []
     match model_type:
         case 'direct_FFNN' | 'direct_NMT':
             output_file_addon = output_file_addon + '_iss'
-            file_header = file_header + ',iss'
-            nan_string_list.append('NaN')
         case 'indirect_FFNN' | 'indirect_NMT':
-            if not no_iss_bool:
-                output_file_addon = output_file_addon + '_iss'
-                file_header = file_header + ',iss'
-                nan_string_list.append('NaN')
-            if mais_bool:
-                output_file_addon = output_file_addon + '_mais'
-                file_header = file_header + ',mais'
-                nan_string_list.append('NaN')
-            if max_severity_chapter_bool:
-                output_file_addon = output_file_addon + '_max_chapter_severity'
-                file_header = file_header + ',ch1_head,ch2_face,ch3_neck,ch4_thorax,ch5_abdomen,ch6_spine,ch7_upper_extremity,ch8_lower_extremity,ch9_external,ch0_miscellaneous'
-                nan_string_list = nan_string_list + ['NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN']
-    # Create the path to be used as the output file path and join the list containing the correct number of NaNs into a string.
-    output_file_path = splitext(file_path)[0] + '.' + output_file_addon + '.csv'
-    nan_string = ','.join(nan_string_list)
-    # Write the header to the output file and then all the strings in the output_list, replacing an output string
-    # with the full NaN string if it is 'NaN' in the output_list.
-    with open(output_file_path, 'w') as output_file:
-        output_file.write(file_header + '\n')
-        for patient_id, output in zip(patient_ids, output_list):
-            if output == 'NaN':
-                output_file.write(patient_id + ',' + nan_string + '\n')
-            else:
-                output_file.write(patient_id + ',' + output + '\n')
+            output_file_addon = output_file_addon + _indirect_output_file_addon(no_iss_bool, mais_bool, max_severity_chapter_bool)
+    if threshold is not None and model_type == 'indirect_FFNN':
+        output_file_addon = output_file_addon + f'_threshold_{threshold:g}'
+    return _output_file_path(file_path, output_file_addon, output_format, compression)
+
+
+def default_scores_path(file_path: str, model_type: str) -> str:
+    """
+    Get the path of the folder of raw conversion output saved next to an input file, named after the input file and the
+    model. Output files post-processed from the folder are named as if the folder were the input file, so they are
+    written next to it with the same names as the output files of the input file.
+
+    Args:
+        file_path (str): Path to the input file.
+        model_type (str): Case representing which model type to use.
+
+    Returns:
+        str: Path to the scores folder.
+    """
+    return splitext(helper.strip_compression_extension(file_path))[0] + '.' + model_type + SCORES_FOLDER_SUFFIX
+
+
+def ensemble_output_file_path(file_path: str, model_list: list, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                              consensus_bool: bool = False, output_format: str = 'csv', compression: str | None = None) -> str:
+    """
+    Get the path of the output file of an ensemble of models written next to an input file, named after the input file, the
+    models of the ensemble, and the selected options.
+
+    Args:
+        file_path (str): Path to the input file.
+        model_list (list): Model types of the ensemble, in the order their outputs are written.
+        no_iss_bool (bool): Boolean representing whether ISS scores of indirect models should not be outputted.
+        mais_bool (bool): Boolean representing whether the MAIS score of indirect models should be outputted.
+        max_severity_chapter_bool (bool): Boolean representing whether the maximum severity for each AIS chapter of indirect
+        models should be outputted.
+        consensus_bool (bool): Boolean representing whether the consensus ISS of the models is outputted.
+        output_format (str): Case representing the output file format. Either 'csv', 'parquet', or 'feather'.
+        compression (str | None): Compression of the output file, either 'gzip' or 'zstd', or None for no compression.
+
+    Returns:
+        str: Path to the output file.
+    """
+    output_file_addon = '_'.join(['ensemble'] + model_list)
+    if any(model_type in ['indirect_FFNN', 'indirect_NMT'] for model_type in model_list):
+        output_file_addon = output_file_addon + _indirect_output_file_addon(no_iss_bool, mais_bool, max_severity_chapter_bool)
+    if consensus_bool:
+        output_file_addon = output_file_addon + '_' + CONSENSUS_COLUMN
+    return _output_file_path(file_path, output_file_addon, output_format, compression)
+
+
+def _indirect_output_file_addon(no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool) -> str:
+    """Get the filename suffix of the selected output options of indirect models."""
+    output_file_addon = ''
+    if not no_iss_bool:
+        output_file_addon = output_file_addon + '_iss'
+    if mais_bool:
+        output_file_addon = output_file_addon + '_mais'
+    if max_severity_chapter_bool:
+        output_file_addon = output_file_addon + '_max_chapter_severity'
+    return output_file_addon
+
+
+def _output_file_path(file_path: str, output_file_addon: str, output_format: str, compression: str | None) -> str:
+    """Get the path of an output file next to the input file, with the filename suffix added to the input filename."""
+    # Create the path to be used as the output file path, without any compression extension of the input file
+    output_file_path = splitext(helper.strip_compression_extension(file_path))[0] + '.' + output_file_addon + writers.OUTPUT_FORMATS[output_format]
+    if output_format == 'csv' and compression is not None:
+        output_file_path = output_file_path + helper.COMPRESSION_EXTENSIONS[compression]
     return output_file_path
+
+
+def is_output_file(file_path: str) -> bool:
+    """Whether a file is named like an output file written next to its input file by any model and output options."""
+    return OUTPUT_FILE_NAME_PATTERN.search(file_path) is not None
@@ -0,0 +1,105 @@
+import warnings
+from itertools import pairwise
+
+import torch
+
+import helper
+
+
+class SparseInputMixin:
+    def forward_sparse(self, input_indices, offsets):
+        # Sum the first layer weight columns of the codes present in each case rather than multiplying a dense input
+        # that is almost entirely zeros. Offsets mark where each case starts in the flat input indices.
+        weight_columns, bias = self.first_layer_sparse_weights()
+        hidden = torch.nn.functional.embedding_bag(input_indices, weight_columns, offsets, mode='sum')
+        r = self.linear_relu_stack[1:](hidden + bias)
+        return r
+
+    def first_layer_sparse_weights(self):
+        # Keep a contiguous transposed copy of the first layer weights so that each code's column is a contiguous row,
+        # along with the first layer bias, rebuilding them whenever the weights are moved or updated. The weights of a
+        # dynamically quantized first layer cannot change and are unpacked on every access, so they are dequantized
+        # once and summed at the precision of the rest of the model.
+        first_linear = self.linear_relu_stack[0]
+        if callable(first_linear.weight):
+            weight_key = id(first_linear)
+            if getattr(self, '_weight_columns_key', None) != weight_key:
+                self._weight_columns = (first_linear.weight().dequantize().t().contiguous(), first_linear.bias())
+                self._weight_columns_key = weight_key
+            return self._weight_columns
+        weight = first_linear.weight
+        weight_key = (weight.data_ptr(), weight._version)
+        if getattr(self, '_weight_columns_key', None) != weight_key:
+            self._weight_columns = (weight.detach().t().contiguous(), first_linear.bias)
+            self._weight_columns_key = weight_key
+        return self._weight_columns
+
+
+class NeuralNetworkISS(SparseInputMixin, torch.nn.Module):
+    def __init__(self, num_input_categories, num_output_categories):
+        super().__init__()  # Init the superclass nn.Module
+        self.flatten = torch.nn.Flatten()
+        self.linear_relu_stack = torch.nn.Sequential(
+            torch.nn.Linear(num_input_categories, num_output_categories),
+            torch.nn.PReLU(num_output_categories),
+            torch.nn.Linear(num_output_categories, num_output_categories),
+            torch.nn.LogSoftmax(dim=1)
+        )
+
+    def forward(self, x):
+        r = self.linear_relu_stack(x)
+        return r
+
+
+class NeuralNetworkAIS(SparseInputMixin, torch.nn.Module):
+    def __init__(self, num_input_categories, num_output_categories):
+        super().__init__()  # Init the superclass nn.Module
+        self.flatten = torch.nn.Flatten()
+        self.linear_relu_stack = torch.nn.Sequential(
+            torch.nn.Linear(num_input_categories, num_output_categories),
+            torch.nn.PReLU(num_output_categories),
+            torch.nn.Linear(num_output_categories, num_output_categories),
+            torch.nn.Sigmoid()
+        )
+
+    def forward(self, x):
+        r = self.linear_relu_stack(x)
+        return r
+
+
+def bags_to_dense(input_indices, offsets, num_columns, dtype=torch.float32):
+    # Expand a batch of flat input indices and case offsets into a dense matrix of dummy variables
+    counts = torch.diff(offsets, append=torch.tensor([len(input_indices)], device=offsets.device))
+    row_index = torch.repeat_interleave(torch.arange(len(offsets), device=offsets.device), counts)
+    dense_matrix = torch.zeros(len(offsets), num_columns, dtype=dtype, device=offsets.device)
+    dense_matrix[row_index, input_indices] = 1
+    return dense_matrix
+
+
+def reduce_precision(model, precision):
+    # Run the model with bfloat16 weights and activations, or with the first layer dynamically quantized to int8. Only
+    # the first layer, which holds almost all of the weights, is quantized, with a scale per output channel, since also
+    # quantizing the activations of the small second layer changes many more outputs without being any faster. Dynamic
+    # quantization only runs on the cpu.
+    match precision:
+        case 'bfloat16':
+            return model.to(torch.bfloat16)
+        case 'int8':
+            with warnings.catch_warnings():
+                # PyTorch warns that its eager mode quantization API is moving to the separate torchao package
+                warnings.simplefilter('ignore')
+                return torch.ao.quantization.quantize_dynamic(model.to('cpu'), {'linear_relu_stack.0': torch.ao.quantization.per_channel_dynamic_qconfig},
+                                                              dtype=torch.qint8)
+    return model
+
+
+def get_preds_direct_ff_batch(scores):
+    return torch.argmax(scores, dim=1).numpy()
+
+
+def get_preds_indirect_ff_batch(scores, threshold=helper.INDIRECT_FFNN_THRESHOLD):
+    # Indices of the scores of at least the threshold, split into one list per case
+    case_index, predicted_index = (scores >= threshold).nonzero(as_tuple=True)
+    case_starts = torch.searchsorted(case_index, torch.arange(len(scores) + 1)).tolist()
+    predicted_list = predicted_index.tolist()
+    return [predicted_list[start:end] for start, end in pairwise(case_starts)]
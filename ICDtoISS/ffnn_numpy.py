@@ -0,0 +1,63 @@
+from itertools import pairwise
+
+import numpy as np
+
+import helper
+
+
+class NumpyNeuralNetwork:
+    # NumPy copy of NeuralNetworkISS and NeuralNetworkAIS (Linear -> PReLU -> Linear -> LogSoftmax or Sigmoid) for
+    # inference without torch, using the weights exported from the model by scripts/export_ffnn_weights.py
+    def __init__(self, state_dict, output_activation):
+        # Keep the first layer weights transposed so that the weights of each code are one contiguous row
+        self.weight_columns = np.ascontiguousarray(state_dict['linear_relu_stack.0.weight'].T)
+        self.first_bias = state_dict['linear_relu_stack.0.bias']
+        self.prelu_weight = state_dict['linear_relu_stack.1.weight']
+        self.second_weight = state_dict['linear_relu_stack.2.weight']
+        self.second_bias = state_dict['linear_relu_stack.2.bias']
+        self.output_activation = output_activation
+
+    @classmethod
+    def load(cls, weights_file, output_activation):
+        with np.load(weights_file) as state_dict:
+            return cls(dict(state_dict), output_activation)
+
+    def forward_sparse(self, input_indices, offsets):
+        # Gather and sum the first layer weight rows of the codes present in each case. Offsets mark where each case
+        # starts in the flat input indices. Cases without any codes only get the bias.
+        hidden = np.zeros((len(offsets), len(self.first_bias)), dtype=self.weight_columns.dtype)
+        has_codes = np.diff(offsets, append=len(input_indices)) > 0
+        if has_codes.any():
+            hidden[has_codes] = np.add.reduceat(self.weight_columns[input_indices], offsets[has_codes], axis=0)
+        return self._forward_hidden(hidden + self.first_bias)
+
+    def __call__(self, dense_input):
+        return self._forward_hidden(dense_input @ self.weight_columns + self.first_bias)
+
+    def _forward_hidden(self, hidden):
+        hidden = np.where(hidden >= 0, hidden, self.prelu_weight * hidden)
+        logits = hidden @ self.second_weight.T + self.second_bias
+        if self.output_activation == 'log_softmax':
+            shifted_logits = logits - logits.max(axis=1, keepdims=True)
+            return shifted_logits - np.log(np.exp(shifted_logits).sum(axis=1, keepdims=True))
+        return 1 / (1 + np.exp(-logits))
+
+
+def bags_to_dense(input_indices, offsets, num_columns):
+    # Expand a batch of flat input indices and case offsets into a dense matrix of dummy variables
+    row_index = np.repeat(np.arange(len(offsets)), np.diff(offsets, append=len(input_indices)))
+    dense_matrix = np.zeros((len(offsets), num_columns), dtype=np.float32)
+    dense_matrix[row_index, input_indices] = 1
+    return dense_matrix
+
+
+def get_preds_direct_ff_batch(scores):
+    return np.argmax(scores, axis=1)
+
+
+def get_preds_indirect_ff_batch(scores, threshold=helper.INDIRECT_FFNN_THRESHOLD):
+    # Indices of the scores of at least the threshold, split into one list per case
+    case_index, predicted_index = np.nonzero(scores >= threshold)
+    case_starts = np.searchsorted(case_index, np.arange(len(scores) + 1)).tolist()
+    predicted_list = predicted_index.tolist()
+    return [predicted_list[start:end] for start, end in pairwise(case_starts)]
@@ -1,20 +1,30 @@
+import queue
+import threading
 import tkinter as tk
 import webbrowser
-from datetime import datetime
+from datetime import datetime, timedelta
 from importlib import resources
 from os.path import abspath
 from pathlib import Path
+from time import monotonic
 
 import customtkinter as ctk
 from CTkToolTip import CTkToolTip
 from CTkMessagebox import CTkMessagebox
 
-import converter
+from session import ConverterSession
 
 # Set default GUI appearance
 ctk.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
 
+# Milliseconds between checks of the conversion worker thread's update queue
+UPDATE_QUEUE_POLL_MS = 100
+
+
+class ConversionCancelled(Exception):
+    """Raised in the conversion worker thread to stop the conversion once the user cancels it."""
+
 
 class ICDtoISSApp(ctk.CTk):
     def __init__(self):
@@ -29,6 +39,14 @@ class ICDtoISSApp(ctk.CTk):
         self.mais_intvar = tk.IntVar(self, 0)
         self.max_per_chapter_intvar = tk.IntVar(self, 0)
 
+        # Keep lookup tables and models resident between conversions
+        self.session = ConverterSession(ffnn_batch_size=1024)
+
+        # Conversions run on a worker thread that sends its updates to the main thread through a queue, so that the window
+        # stays responsive. Setting the cancel event stops the conversion after the current batch.
+        self.update_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+
         # Configure main window
         self.title("ICDtoISS GUI")
         # self.geometry(f"{1000}x{400}")
@@ -180,7 +198,7 @@ class ICDtoISSApp(ctk.CTk):
         self.generate_frame = ctk.CTkFrame(self, corner_radius=0)
         self.generate_frame.grid(row=0, column=2, padx=(0, 0), pady=(0, 0), sticky="nsew")
         self.generate_frame.grid_columnconfigure(0, weight=1)
-        self.generate_frame.grid_rowconfigure(3, weight=1)
+        self.generate_frame.grid_rowconfigure(4, weight=1)
 
         # Add progress bar text
         self.progress_bar_text = ctk.CTkLabel(self.generate_frame, text='Conversion Progress', font=ctk.CTkFont(size=16, weight='bold', underline=True))
@@ -195,9 +213,14 @@ class ICDtoISSApp(ctk.CTk):
         self.progress_step_text = ctk.CTkLabel(self.generate_frame, text='Conversion not started.', font=ctk.CTkFont(size=14))
         self.progress_step_text.grid(row=2, column=0, padx=(20, 20), pady=(5, 0))
 
+        # Add cancel conversion button
+        self.cancel_button = ctk.CTkButton(self.generate_frame, text='Cancel Conversion', font=ctk.CTkFont(size=14, weight='bold'), command=self.cancel_conversion, state='disabled')
+        self.cancel_button.grid(row=3, column=0, padx=(20, 20), pady=(10, 0))
+        self.cancel_button_tooltip = CTkToolTip(self.cancel_button, delay=0.5, alpha=0.9, message="Stop the running conversion after the current batch without writing an output file.")
+
         # Add output textbox
         self.textbox = ctk.CTkTextbox(self.generate_frame, wrap='word', state='disabled')
-        self.textbox.grid(row=3, column=0, padx=(20, 20), pady=(20, 20), sticky='nsew')
+        self.textbox.grid(row=4, column=0, padx=(20, 20), pady=(20, 20), sticky='nsew')
 
     def change_appearance_mode_event(self, new_appearance_mode: str):
         """Update gui appearance."""
@@ -240,7 +263,7 @@ class ICDtoISSApp(ctk.CTk):
                 self.indirect_options_logo.configure(text_color=["gray10", "#DCE4EE"])
 
     def convert_data(self):
-        """Convert data in the selected file."""
+        """Validate the selected options and start converting the data in the selected file on a worker thread."""
 
         # Clear output textbox
         self.textbox.configure(state='normal')
@@ -275,88 +298,171 @@ class ICDtoISSApp(ctk.CTk):
         variables_dict = {'input_filepath': input_filepath, 'input_type': input_type, 'unknown_mode': unknown_mode, 'model_type': model_type, 'iss_checkbox_value': iss_checkbox_value, 'mais_checkbox_value': mais_checkbox_value, 'max_per_chapter_checkbox_value': max_per_chapter_checkbox_value}
         self.print_updates('Selected options: ' + str(variables_dict))
 
+        # Only allow one conversion at a time and start polling for the updates of the worker thread
+        self.start_button.configure(state='disabled')
+        self.cancel_button.configure(state='normal')
+        self.cancel_event.clear()
+        conversion_thread = threading.Thread(target=self.run_conversion, daemon=True,
+                                             args=(input_filepath, input_type, unknown_mode, model_type, iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value))
+        conversion_thread.start()
+        self.after(UPDATE_QUEUE_POLL_MS, self.process_update_queue)
+
+    def run_conversion(self, input_filepath, input_type, unknown_mode, model_type, iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value):
+        """Convert data in the selected file on the worker thread, reporting when it finishes, fails, or is cancelled."""
+        try:
+            self.convert_file(input_filepath, input_type, unknown_mode, model_type, iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value)
+        except ConversionCancelled:
+            self.queue_update('print_updates', 'Conversion cancelled. No output file was written.')
+            self.queue_update('update_progressbar', 'Conversion cancelled.', 0)
+        except Exception as error:  # noqa: BLE001
+            # Report any error of the conversion in the window, since the worker thread has no caller to raise it to
+            self.queue_update('print_updates', f'Conversion failed: {error!r}')
+            self.queue_update('update_progressbar', 'Error - Conversion failed.', 0)
+            self.queue_update('show_error', f'Conversion failed: {error}')
+        finally:
+            self.queue_update('conversion_finished')
+
+    def convert_file(self, input_filepath, input_type, unknown_mode, model_type, iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value):
+        """Convert data in the selected file. Runs on the worker thread, so all widget updates are queued."""
+
         # Import selected file data into list of patient IDs and a list of sets containing the codes per case
-        self.print_updates('Loading in input data......')
-        self.update_progressbar('Working on Step 1 of 6: Loading in input data......', 0)
-        self.update_idletasks()
-        patient_ids, codes_per_case_setlist = converter.import_data(input_type, input_filepath)
+        self.queue_update('print_updates', 'Loading in input data......')
+        self.queue_update('update_progressbar', 'Working on Step 1 of 6: Loading in input data......', 0)
+        patient_ids, codes_per_case_setlist = self.session.import_data(input_type, input_filepath)
         # If patient_ids is a string, there was an error in loading the data
         if isinstance(patient_ids, str):
-            self.print_updates(patient_ids)
-            self.update_progressbar('Error on Step 1 of 6: Loading in input data......', 0)
-            self.update_idletasks()
-            CTkMessagebox(title="Error!", message=patient_ids, icon="cancel")
+            self.queue_update('print_updates', patient_ids)
+            self.queue_update('update_progressbar', 'Error on Step 1 of 6: Loading in input data......', 0)
+            self.queue_update('show_error', patient_ids)
             return
 
         # Preprocess imported codes and handle unknown codes
-        self.print_updates('Input data loaded. Preprocessing/cleaning data......')
-        self.update_progressbar('Working on Step 2 of 6: Preprocessing/cleaning data......', 1)
-        self.update_idletasks()
-        codes_per_case_list, unrecognized_codes = converter.preprocess_data(codes_per_case_setlist, unknown_mode)
+        self.check_cancelled()
+        self.queue_update('print_updates', 'Input data loaded. Preprocessing/cleaning data......')
+        self.queue_update('update_progressbar', 'Working on Step 2 of 6: Preprocessing/cleaning data......', 1)
+        codes_per_case_list, unrecognized_codes = self.session.preprocess_data(codes_per_case_setlist, unknown_mode)
         # If codes_per_case_list is a string, there was an error in preprocessing/cleaning the data
         if isinstance(codes_per_case_list, str):
-            self.print_updates(codes_per_case_list)
-            self.update_progressbar('Error on Step 2 of 6: Preprocessing/cleaning data......', 1)
-            self.update_idletasks()
-            CTkMessagebox(title="Error!", message=codes_per_case_list, icon="cancel")
+            self.queue_update('print_updates', codes_per_case_list)
+            self.queue_update('update_progressbar', 'Error on Step 2 of 6: Preprocessing/cleaning data......', 1)
+            self.queue_update('show_error', codes_per_case_list)
             return
 
         # Report and handle if unrecognized codes were found
         if unrecognized_codes:
             if unknown_mode == 'fail':  # Abort conversion by returning to main function if fail approach is chosen
-                self.print_updates('The models were not developed using the following ICD-10 codes. The conversion will now abort.')
+                self.queue_update('print_updates', 'The models were not developed using the following ICD-10 codes. The conversion will now abort.')
                 print(unrecognized_codes)
                 return
 
             elif unknown_mode == 'ignore': # Abort conversion if cases without codes exist after ignoring unknown codes
                 ids_wo_s_and_t_codes = [patient_ids[idx] for idx in unrecognized_codes]
-                self.print_updates('The cases with the following IDs did not contain any codes to convert after ignoring untrained codes. The conversion will now abort.')
+                self.queue_update('print_updates', 'The cases with the following IDs did not contain any codes to convert after ignoring untrained codes. The conversion will now abort.')
                 print(ids_wo_s_and_t_codes)
                 return
 
             else:  # Report code replacements used and continue conversion
-                self.print_updates('The following ICD-10 codes replacements were made.')
+                self.queue_update('print_updates', 'The following ICD-10 codes replacements were made.')
                 print(unrecognized_codes)
 
         # Format pre-processed data for conversion
-        self.print_updates('Data preprocessed/cleaned. Formatting data for prediction......')
-        self.update_progressbar('Working on Step 3 of 6: Formatting data for prediction......', 2)
-        self.update_idletasks()
-        formatted_input_data = converter.formatting_data(codes_per_case_list, model_type)
+        self.check_cancelled()
+        self.queue_update('print_updates', 'Data preprocessed/cleaned. Formatting data for prediction......')
+        self.queue_update('update_progressbar', 'Working on Step 3 of 6: Formatting data for prediction......', 2)
+        formatted_input_data = self.session.formatting_data(codes_per_case_list, model_type)
         # If formatted_input_data is a string, there was an error in formatting the data
         if isinstance(formatted_input_data, str):
-            self.print_updates(formatted_input_data)
-            self.update_progressbar('Error on Step 3 of 6: Formatting data for prediction......', 2)
-            self.update_idletasks()
-            CTkMessagebox(title="Error!", message=formatted_input_data, icon="cancel")
+            self.queue_update('print_updates', formatted_input_data)
+            self.queue_update('update_progressbar', 'Error on Step 3 of 6: Formatting data for prediction......', 2)
+            self.queue_update('show_error', formatted_input_data)
             return
 
-        # Convert formatted pre-processed data into either FFNN logit scores or NMT translated words
+        # Convert formatted pre-processed data into either FFNN logit scores or NMT translated words, filling the progress
+        # bar and reporting the conversion speed after every batch
+        self.check_cancelled()
         if model_type in ['direct_FFNN', 'indirect_FFNN']:
-            str_update = f'Data formatted. Converting using {model_type} in {len(formatted_input_data):,} 64-set batches...'
+            str_update = f'Data formatted. Converting using {model_type} in {len(formatted_input_data):,} {self.session.ffnn_batch_size}-set batches...'
         else:
             str_update = f'Data formatted. Converting using {model_type}......'
-        self.print_updates(str_update)
-        self.update_progressbar(f'Working on Step 4 of 6: Converting using {model_type}......', 3)
-        self.update_idletasks()
-        conversion_output = converter.convert_data(formatted_input_data, model_type)
+        self.queue_update('print_updates', str_update)
+        self.queue_update('update_progressbar', f'Working on Step 4 of 6: Converting using {model_type}......', 3)
+        conversion_output = self.session.convert_data(formatted_input_data, model_type, self.batch_progress_reporter(model_type, len(codes_per_case_list)))
 
         # Post-process converted output into chosen format
-        self.print_updates('Data converted. Processing conversion output and extracting ISS......')
-        self.update_progressbar('Working on Step 5 of 6: Processing conversion output and extracting ISS......', 4)
-        self.update_idletasks()
-        output_list = converter.postprocess_data(conversion_output, model_type, not iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value)
+        self.check_cancelled()
+        self.queue_update('print_updates', 'Data converted. Processing conversion output and extracting ISS......')
+        self.queue_update('update_progressbar', 'Working on Step 5 of 6: Processing conversion output and extracting ISS......', 4)
+        output_list = self.session.postprocess_data(conversion_output, model_type, not iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value)
 
         # Write output results in specified format
-        self.print_updates('Conversion output process and ISS extracted. Exporting ISS predictions......')
-        self.update_progressbar('Working on Step 6 of 6: Exporting ISS predictions......', 5)
-        self.update_idletasks()
-        output_file_path = converter.output_iss_results(patient_ids, output_list, input_filepath, model_type, not iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value)
+        self.check_cancelled()
+        self.queue_update('print_updates', 'Conversion output process and ISS extracted. Exporting ISS predictions......')
+        self.queue_update('update_progressbar', 'Working on Step 6 of 6: Exporting ISS predictions......', 5)
+        output_file_path = self.session.output_iss_results(patient_ids, output_list, input_filepath, model_type, not iss_checkbox_value, mais_checkbox_value, max_per_chapter_checkbox_value)
 
         # Update textbox and progress bar on completion of all conversion steps
-        self.print_updates('ISS predictions written out to: ' + output_file_path)
-        self.update_progressbar(f'Done - Conversion using {model_type} completely successfully!', 6)
-        self.update_idletasks()
+        self.queue_update('print_updates', 'ISS predictions written out to: ' + output_file_path)
+        self.queue_update('update_progressbar', f'Done - Conversion using {model_type} completely successfully!', 6)
+
+    def batch_progress_reporter(self, model_type, num_cases):
+        """Get a function that stops the conversion if it was cancelled and otherwise reports the progress of each converted batch."""
+        start_time = monotonic()
+        cases_done = 0
+
+        def report_batch_progress(num_batch_cases):
+            nonlocal cases_done
+            self.check_cancelled()
+            cases_done += num_batch_cases
+            cases_per_second = cases_done / max(monotonic() - start_time, 1e-9)
+            eta = timedelta(seconds=round((num_cases - cases_done) / cases_per_second))
+            self.queue_update('update_progressbar', f'Working on Step 4 of 6: Converting using {model_type}......\n'
+                                                    f'{cases_done:,} of {num_cases:,} cases ({cases_per_second:,.0f} cases/s, ETA {eta})',
+                              3 + cases_done / max(num_cases, 1))
+
+        return report_batch_progress
+
+    def check_cancelled(self):
+        """Stop the conversion on the worker thread if it was cancelled."""
+        if self.cancel_event.is_set():
+            raise ConversionCancelled
+
+    def cancel_conversion(self):
+        """Cancel the running conversion, which stops after the current batch."""
+        self.cancel_event.set()
+        self.cancel_button.configure(state='disabled')
+        self.print_updates('Cancelling conversion......')
+
+    def queue_update(self, update_type, *update_args):
+        """Send an update from the worker thread to be applied to the widgets by the main thread."""
+        self.update_queue.put((update_type, update_args))
+
+    def process_update_queue(self):
+        """Apply all queued updates of the worker thread and keep polling until the conversion finishes."""
+        # Only the latest of the progress bar updates queued since the last poll is shown
+        progressbar_args = None
+        conversion_finished = False
+        while not conversion_finished:
+            try:
+                update_type, update_args = self.update_queue.get_nowait()
+            except queue.Empty:
+                break
+            match update_type:
+                case 'print_updates':
+                    self.print_updates(*update_args)
+                case 'update_progressbar':
+                    progressbar_args = update_args
+                case 'show_error':
+                    CTkMessagebox(title="Error!", message=update_args[0], icon="cancel")
+                case 'conversion_finished':
+                    conversion_finished = True
+
+        if progressbar_args is not None:
+            self.update_progressbar(*progressbar_args)
+        if conversion_finished:
+            self.start_button.configure(state='normal')
+            self.cancel_button.configure(state='disabled')
+        else:
+            self.after(UPDATE_QUEUE_POLL_MS, self.process_update_queue)
 
     def print_updates(self, string):
         """Write out log string to console and GUI textbox"""
@@ -1,58 +1,168 @@
-from itertools import islice
+import gc
+import gzip
+import io
+import sys
+from collections import deque
+from contextlib import contextmanager
+from glob import glob
+from itertools import chain
+from os.path import isfile, normpath
 
-import torch
+import numpy as np
 
+# Stream compressions of text files and the extension of their file names. A path of '-' stands for standard output.
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+STDOUT_PATH = '-'
+# Size of the write buffer of uncompressed output files
+FILE_BUFFER_SIZE = 1 << 20
+# gzip level of compressed output files. The default level of 9 is over 50 times slower than level 1 on conversion
+# outputs while only making them about a fifth smaller.
+GZIP_COMPRESSION_LEVEL = 1
+# Output score at or above which the indirect FFNN predicts an RCS code, shared by every FFNN backend and by predictions from
+# saved scores so that they always agree
+INDIRECT_FFNN_THRESHOLD = 0.3
 
-class NeuralNetworkISS(torch.nn.Module):
-    def __init__(self, num_input_categories, num_output_categories):
-        super(NeuralNetworkISS, self).__init__()  # Init the superclass nn.Module
-        self.flatten = torch.nn.Flatten()
-        self.linear_relu_stack = torch.nn.Sequential(
-            torch.nn.Linear(num_input_categories, num_output_categories),
-            torch.nn.PReLU(num_output_categories),
-            torch.nn.Linear(num_output_categories, num_output_categories),
-            torch.nn.LogSoftmax(dim=1)
-        )
 
-    def forward(self, x):
-        r = self.linear_relu_stack(x)
-        return r
+class SparseCodeMatrix:
+    # Compressed sparse row (CSR) matrix of the dummy variables of every case, where the dummy variable indices of case i
+    # are indices[indptr[i]:indptr[i + 1]]. Iterating over it yields batches of cases as zero-copy slices.
+    def __init__(self, indptr, indices, num_columns, batch_size=64):
+        self.indptr = indptr
+        self.indices = indices
+        self.num_columns = num_columns
+        self.batch_size = batch_size
 
+    @property
+    def num_cases(self):
+        return len(self.indptr) - 1
 
-class NeuralNetworkAIS(torch.nn.Module):
-    def __init__(self, num_input_categories, num_output_categories):
-        super(NeuralNetworkAIS, self).__init__()  # Init the superclass nn.Module
-        self.flatten = torch.nn.Flatten()
-        self.linear_relu_stack = torch.nn.Sequential(
-            torch.nn.Linear(num_input_categories, num_output_categories),
-            torch.nn.PReLU(num_output_categories),
-            torch.nn.Linear(num_output_categories, num_output_categories),
-            torch.nn.Sigmoid()
-        )
+    def __len__(self):
+        # Number of batches
+        return (self.num_cases + self.batch_size - 1) // self.batch_size
 
-    def forward(self, x):
-        r = self.linear_relu_stack(x)
-        return r
+    def __iter__(self):
+        for start in range(0, self.num_cases, self.batch_size):
+            end = min(start + self.batch_size, self.num_cases)
+            yield self.indices[self.indptr[start]:self.indptr[end]], self.indptr[start:end] - self.indptr[start]
 
 
-def build_sparse_matrix(codes_per_case_list, icd10_to_dummy_dict):
-    batched_sparse_matrix_list = []
-    for batch_of_codes_list in batch(codes_per_case_list, 64):
-        patient_index_in_batch = []
-        option_col_index = []
+class CodeIndex:
+    # Sorted fixed width ASCII codes and the dummy variable index of each code, usually memory mapped from the data
+    # folder so that they load without parsing and every process shares the same pages. Codes are looked up with one
+    # binary search over all of the given codes.
+    def __init__(self, sorted_codes, dummy_indices):
+        self.sorted_codes = sorted_codes
+        self.dummy_indices = dummy_indices
 
-        for idx, code_list in enumerate(batch_of_codes_list):
-            patient_index_in_batch = patient_index_in_batch + [idx] * len(code_list)
-            option_col_index = option_col_index + [icd10_to_dummy_dict[code] for code in code_list]
+    def __len__(self):
+        return len(self.sorted_codes)
 
-        sparse_matrix_batch = torch.sparse_coo_tensor([patient_index_in_batch, option_col_index],
-                                                      [1] * len(patient_index_in_batch),
-                                                      [len(batch_of_codes_list), len(icd10_to_dummy_dict)],
-                                                      dtype=torch.float)
-        # Append tensor to the list of tensors
-        batched_sparse_matrix_list.append(sparse_matrix_batch.detach().clone())
+    def lookup(self, codes):
+        # Dummy variable index of every code, or -1 for unknown codes
+        encoded_codes_array = encode_codes(codes)
+        position = np.minimum(np.searchsorted(self.sorted_codes, encoded_codes_array), len(self.sorted_codes) - 1)
+        return np.where(self.sorted_codes[position] == encoded_codes_array, self.dummy_indices[position], -1)
 
-    return batched_sparse_matrix_list
+    def lookup_dict(self, codes):
+        # Dictionary of the known codes among the given codes to their dummy variable index
+        codes_list = list(codes)
+        return {code: dummy_index for code, dummy_index in zip(codes_list, self.lookup(codes_list).tolist()) if dummy_index >= 0}
+
+    def codes_by_dummy(self):
+        # Array of the codes ordered by their dummy variable index
+        codes_array = np.empty(len(self.sorted_codes), dtype=self.sorted_codes.dtype)
+        codes_array[self.dummy_indices] = self.sorted_codes
+        return codes_array
+
+
+def encode_codes(codes):
+    # Encode codes as a fixed width ASCII array that can be compared with the codes of a CodeIndex. Characters that are
+    # not ASCII are replaced with '?', which no known code contains.
+    return np.array([code.encode('ascii', 'replace') for code in codes], dtype='S')
+
+
+def build_sparse_matrix(codes_per_case_list, icd10_code_index, batch_size=64):
+    # Look up the dummy variable index of every distinct code at once, then map every code of every case to its dummy
+    # variable index in one pass and record where each case starts
+    code_to_dummy_dict = icd10_code_index.lookup_dict(set(chain.from_iterable(codes_per_case_list)))
+    codes_per_case_count = np.fromiter(map(len, codes_per_case_list), dtype=np.int64, count=len(codes_per_case_list))
+    indptr = np.zeros(len(codes_per_case_list) + 1, dtype=np.int64)
+    np.cumsum(codes_per_case_count, out=indptr[1:])
+    indices = np.fromiter((code_to_dummy_dict[code] for code in chain.from_iterable(codes_per_case_list)),
+                          dtype=np.int64, count=indptr[-1])
+    return SparseCodeMatrix(indptr, indices, len(icd10_code_index), batch_size)
+
+
+def deduplicate_code_lists(codes_per_case_list):
+    # Collapse identical code lists into their first occurrence, returning the unique code lists and the index of the
+    # unique code list of every case, which scatters per unique code list results back to every case
+    unique_idx_dict = {}
+    unique_idx_array = np.fromiter((unique_idx_dict.setdefault(tuple(code_list), len(unique_idx_dict)) for code_list in codes_per_case_list),
+                                   dtype=np.int64, count=len(codes_per_case_list))
+    return [list(code_tuple) for code_tuple in unique_idx_dict], unique_idx_array
+
+
+def path_compression(path):
+    # Compression of a file as given by the extension of its path, or None if it is not compressed
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return compression
+    return None
+
+
+def strip_compression_extension(path):
+    compression = path_compression(path)
+    return path[:-len(COMPRESSION_EXTENSIONS[compression])] if compression else path
+
+
+def expand_file_patterns(patterns):
+    # Expand paths and glob patterns into the files they match, keeping the order of the patterns with the matches of each
+    # pattern sorted and every file only listed once. Also returns the patterns that did not match any file.
+    file_paths = {}
+    unmatched_patterns = []
+    for pattern in patterns:
+        matched_paths = [pattern] if isfile(pattern) else sorted(path for path in glob(pattern, recursive=True) if isfile(path))
+        if not matched_paths:
+            unmatched_patterns.append(pattern)
+        file_paths.update(dict.fromkeys(map(normpath, matched_paths)))
+    return list(file_paths), unmatched_patterns
+
+
+def open_text_file(path, mode='r', compression=None):
+    # Open a text file, or standard output if the path is '-', decompressing or compressing it as a stream if a compression
+    # is given. zstd needs the zstandard package. Standard output stays open when the returned file is closed.
+    if path == STDOUT_PATH:
+        binary_file = open(sys.__stdout__.fileno(), 'wb', buffering=0, closefd=False)  # noqa: SIM115
+        match compression:
+            case 'gzip':
+                binary_file = gzip.GzipFile(fileobj=binary_file, mode='wb', compresslevel=GZIP_COMPRESSION_LEVEL)
+            case 'zstd':
+                import zstandard
+                binary_file = zstandard.ZstdCompressor().stream_writer(binary_file, closefd=False)
+            case _:
+                binary_file = io.BufferedWriter(binary_file, FILE_BUFFER_SIZE)
+        return io.TextIOWrapper(binary_file)
+    match compression:
+        case 'gzip':
+            return gzip.open(path, mode + 't', compresslevel=GZIP_COMPRESSION_LEVEL)
+        case 'zstd':
+            import zstandard
+            return zstandard.open(path, mode + 't')
+        case _:
+            return open(path, mode, buffering=FILE_BUFFER_SIZE)
+
+
+@contextmanager
+def paused_garbage_collection():
+    # Creating millions of small containers, like the code set of every case, triggers the cyclic garbage collector over
+    # and over even though none of them can form reference cycles, so it is paused while they are created
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
 
 def batch(list_of_items, batch_size=1):
@@ -61,38 +171,116 @@ def batch(list_of_items, batch_size=1):
         yield list_of_items[idx:min(idx + batch_size, list_length)]
 
 
-def get_preds_direct_ff(scores):
-    return int(torch.argmax(scores))
-
-
-def get_preds_indirect_ff(scores):
-    return (scores >= 0.3).nonzero(as_tuple=False).flatten().tolist()
-
-
-def calc_severity_scores(rcs_list, no_iss_bool, mais_bool, max_severity_chapter_bool):
-    severity_region_chapter = sorted([rcs[4] + '.' + rcs[0] + '.' + rcs[2] for rcs in rcs_list if rcs[4] != '9'], reverse=True)
-    if not severity_region_chapter:
-        return 'NaN'
-    else:
-        output_severity_list = []
-        if not no_iss_bool or mais_bool:
-            body_regions_list = [pair[2] for pair in severity_region_chapter]
-            unique_body_regions_list = list(dict.fromkeys(body_regions_list))
-            severity_body_regions_iter = (int(severity_region_chapter[body_regions_list.index(body_region)][0]) for
-                                          body_region in unique_body_regions_list)
-            top_3_region_unique_severities = list(islice(severity_body_regions_iter, 3))
-            if not no_iss_bool:
-                if top_3_region_unique_severities[0] == 6:
-                    output_severity_list.append(str(75))
-                else:
-                    output_severity_list.append(str(sum(severity * severity for severity in top_3_region_unique_severities)))
-            if mais_bool:
-                output_severity_list.append(str(top_3_region_unique_severities[0]))
-        if max_severity_chapter_bool:
-            max_severity_dict = {'1': '0', '2': '0', '3': '0', '4': '0', '5': '0', '6': '0', '7': '0', '8': '0', '9': '0', '0': '0'}
-            for src in severity_region_chapter:
-                if max_severity_dict[src[4]] < src[0]:
-                    max_severity_dict[src[4]] = src[0]
-            output_severity_list = output_severity_list + list(max_severity_dict.values())
-
-        return ','.join(output_severity_list)
+def closest_known_codes(unknown_codes_array, sorted_known_codes_array):
+    # Find the position of every unknown code in the sorted known codes at once and choose between the known codes on
+    # either side the one with the longest common prefix, using the left code in case of a tie. Unknown codes that sort
+    # before or after all known codes use the first or last known code.
+    bisect_index = np.searchsorted(sorted_known_codes_array, unknown_codes_array, side='left')
+    left_code_array = sorted_known_codes_array[np.maximum(bisect_index - 1, 0)]
+    right_code_array = sorted_known_codes_array[np.minimum(bisect_index, len(sorted_known_codes_array) - 1)]
+    use_right_code = (bisect_index == 0) | ((bisect_index < len(sorted_known_codes_array)) &
+                                            (common_prefix_length(unknown_codes_array, right_code_array) >
+                                             common_prefix_length(unknown_codes_array, left_code_array)))
+    return np.where(use_right_code, right_code_array, left_code_array)
+
+
+def common_prefix_length(codes_array, other_codes_array):
+    # Compare two string or bytes arrays character by character as fixed width character matrices and count the
+    # matching characters before the first difference, up to the length of the shorter string
+    kind, char_dtype = ('S', np.uint8) if codes_array.dtype.kind == 'S' else ('U', np.uint32)
+    width = max(codes_array.dtype.itemsize, other_codes_array.dtype.itemsize) // np.dtype(char_dtype).itemsize
+    codes_matrix = codes_array.astype(f'{kind}{width}').view(char_dtype).reshape(-1, width)
+    other_codes_matrix = other_codes_array.astype(f'{kind}{width}').view(char_dtype).reshape(-1, width)
+    matching_chars = np.append(codes_matrix == other_codes_matrix, np.zeros((len(codes_matrix), 1), dtype=bool), axis=1)
+    return np.minimum(matching_chars.argmin(axis=1),
+                      np.minimum(np.char.str_len(codes_array), np.char.str_len(other_codes_array)))
+
+
+def translate_in_length_buckets(translator, formatted_codes_per_case_list, max_batch_size=64, asynchronous=False, progress_bar=None,
+                                progress_callback=None):
+    # Sort cases by number of codes so that each batch holds similarly sized inputs and needs little padding
+    length_sorted_idx_list = sorted(range(len(formatted_codes_per_case_list)), key=lambda idx: len(formatted_codes_per_case_list[idx]))
+    hypotheses_list = [None] * len(formatted_codes_per_case_list)
+
+    def collect(batch_idx_list, batch_results):
+        # Scatter the top hypothesis of each case back to its original position
+        for idx, result in zip(batch_idx_list, batch_results):
+            hypotheses_list[idx] = (result.result() if asynchronous else result).hypotheses[0]
+        if progress_bar is not None:
+            progress_bar.update(len(batch_idx_list))
+        if progress_callback is not None:
+            progress_callback(len(batch_idx_list))
+
+    # Keep enough batches in flight for every translator replica to stay busy when submitting asynchronously
+    pending_batches = deque()
+    max_pending_batches = 2 * translator.num_translators if asynchronous else 0
+    for batch_idx_list in batch(length_sorted_idx_list, max_batch_size):
+        batch_results = translator.translate_batch([formatted_codes_per_case_list[idx] for idx in batch_idx_list], asynchronous=asynchronous)
+        pending_batches.append((batch_idx_list, batch_results))
+        while len(pending_batches) > max_pending_batches:
+            collect(*pending_batches.popleft())
+    while pending_batches:
+        collect(*pending_batches.popleft())
+
+    return hypotheses_list
+
+
+def lower_median(value_matrix):
+    # Lower median of each row of a float matrix, ignoring NaN values, so that the median is always one of the values of its
+    # row. Rows of only NaN values have a NaN median. NaN values are sorted after all other values.
+    sorted_value_matrix = np.sort(value_matrix, axis=1)
+    value_count = np.count_nonzero(~np.isnan(sorted_value_matrix), axis=1)
+    return sorted_value_matrix[np.arange(len(sorted_value_matrix)), np.maximum(value_count - 1, 0) // 2]
+
+
+def rcs_lookup_arrays(ais_rcs_code_index):
+    # Split each RCS code ('region_chapter_severity') into integer arrays indexed by its dummy variable
+    rcs_digit_matrix = ais_rcs_code_index.codes_by_dummy().astype('S5').view(np.uint8).reshape(-1, 5) - ord('0')
+    body_region, chapter, severity = (rcs_digit_matrix[:, digit_idx].astype(np.int8) for digit_idx in [0, 2, 4])
+    return body_region, chapter, severity
+
+
+def max_severity_per_group(case_index, group, severity, num_cases):
+    # Greatest severity for each case and group digit (0-9), found by sorting the triplets by cell and then severity and
+    # keeping the last triplet of each cell
+    cell_index = case_index.astype(np.int64) * 10 + group
+    order = np.lexsort((severity, cell_index))
+    cell_index, severity = cell_index[order], severity[order]
+    is_cell_max = np.ones(len(cell_index), dtype=bool)
+    is_cell_max[:-1] = cell_index[1:] != cell_index[:-1]
+    max_severity_grid = np.zeros((num_cases, 10), dtype=np.int64)
+    max_severity_grid.ravel()[cell_index[is_cell_max]] = severity[is_cell_max]
+    return max_severity_grid
+
+
+def calc_severity_scores(case_index, body_region, chapter, severity, num_cases, no_iss_bool, mais_bool, max_severity_chapter_bool):
+    # Each index of the arrays is one predicted RCS triplet of the case given in case_index. Triplets with an unknown
+    # severity of 9 are not used, and cases without any other triplets are output as NaN.
+    known_severity_mask = severity != 9
+    case_index, body_region, chapter, severity = (case_index[known_severity_mask], body_region[known_severity_mask],
+                                                  chapter[known_severity_mask], severity[known_severity_mask])
+    has_severity = np.zeros(num_cases, dtype=bool)
+    has_severity[case_index] = True
+
+    output_column_list = []
+    if not no_iss_bool or mais_bool:
+        # Greatest severity of each body region per case, with the three most severe body regions used for ISS
+        max_severity_per_region = max_severity_per_group(case_index, body_region, severity, num_cases)
+        top_3_region_severities = -np.sort(-max_severity_per_region, axis=1)[:, :3]
+        mais = top_3_region_severities[:, 0]
+        if not no_iss_bool:
+            output_column_list.append(np.where(mais == 6, 75, (top_3_region_severities ** 2).sum(axis=1)))
+        if mais_bool:
+            output_column_list.append(mais)
+    if max_severity_chapter_bool:
+        # Greatest severity of each AIS chapter per case, ordered as chapters 1 to 9 followed by chapter 0
+        max_severity_per_chapter = max_severity_per_group(case_index, chapter, severity, num_cases)
+        output_column_list.extend(max_severity_per_chapter[:, [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]].T)
+
+    # Join the output columns of each case into a single comma separated string
+    output_matrix = np.column_stack(output_column_list)
+    output_str_matrix = np.array([str(value) for value in range(output_matrix.max(initial=0) + 1)], dtype=object)[output_matrix]
+    output_list = [','.join(output_str_row) for output_str_row in output_str_matrix.tolist()]
+    for case_idx in np.flatnonzero(~has_severity):
+        output_list[case_idx] = 'NaN'
+    return output_list
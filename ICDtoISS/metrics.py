@@ -0,0 +1,115 @@
+import cProfile
+import json
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+from time import perf_counter, process_time
+
+
+class PipelineMetrics:
+    """
+    Structured measurements of the conversion pipeline stages.
+
+    Each stage records its number of calls, wall time, CPU time, cases converted, and the peak resident set size of the
+    process once the stage finishes. Stages called many times, such as for every chunk of a streamed conversion, are
+    accumulated. Stages may add their own counts, such as batches processed, and run wide counts, such as unknown codes,
+    are kept as counters. Stages and counters can be recorded from several threads at once, such as when converting
+    several files concurrently. If profile is set, the stages selected for profiling are run under cProfile, which can
+    only measure one profiled stage at a time.
+    """
+
+    def __init__(self, profile: bool = False):
+        self.info = {}
+        self.stages = {}
+        self.counters = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self._started_at = datetime.now()
+        self._start_wall = perf_counter()
+        self._start_cpu = process_time()
+        self._lock = Lock()
+
+    @contextmanager
+    def stage(self, name: str, cases: int = 0, profile: bool = False):
+        """Measure a stage, yielding a dictionary that the stage can add its own counts and times to."""
+        stage_counts = {}
+        start_wall = perf_counter()
+        start_cpu = process_time()
+        if profile and self.profiler is not None:
+            self.profiler.enable()
+        try:
+            yield stage_counts
+        finally:
+            if profile and self.profiler is not None:
+                self.profiler.disable()
+            wall_seconds = perf_counter() - start_wall
+            cpu_seconds = process_time() - start_cpu
+            with self._lock:
+                stage_metrics = self.stages.setdefault(name, {'calls': 0, 'cases': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+                stage_metrics['calls'] += 1
+                stage_metrics['cases'] += cases
+                stage_metrics['wall_seconds'] += wall_seconds
+                stage_metrics['cpu_seconds'] += cpu_seconds
+                for count_name, count in stage_counts.items():
+                    stage_metrics[count_name] = stage_metrics.get(count_name, 0) + count
+                stage_metrics['peak_rss_bytes'] = peak_rss_bytes()
+
+    def count(self, name: str, value: int = 1):
+        """Add to a run wide counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        """Get all measurements, with the throughput of every stage, as a JSON serializable dictionary."""
+        stages = {}
+        for name, stage_metrics in self.stages.items():
+            stages[name] = dict(stage_metrics)
+            stages[name]['cases_per_second'] = stage_metrics['cases'] / stage_metrics['wall_seconds'] if stage_metrics['cases'] and stage_metrics['wall_seconds'] else None
+        return {'started_at': self._started_at.isoformat(), 'info': self.info,
+                'total_wall_seconds': perf_counter() - self._start_wall, 'total_cpu_seconds': process_time() - self._start_cpu,
+                'peak_rss_bytes': peak_rss_bytes(), 'stages': stages, 'counters': self.counters}
+
+    def write(self, file_path: str):
+        """Write all measurements to a JSON file."""
+        with open(file_path, 'w') as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
+
+    def write_profile(self, file_path: str):
+        """Write the cProfile statistics of the profiled stages, readable with pstats or snakeviz."""
+        self.profiler.dump_stats(file_path)
+
+
+def peak_rss_bytes() -> int | None:
+    """Get the peak resident set size of the process in bytes, or None if it cannot be measured on this platform."""
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_working_set_bytes()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def _windows_peak_working_set_bytes() -> int | None:
+    """Get the peak working set of the process on Windows, which is its peak resident set size."""
+    try:
+        import ctypes
+        from ctypes import wintypes
+    except ImportError:
+        return None
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t), ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t),
+                    ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    try:
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(ProcessMemoryCounters)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+    except (AttributeError, OSError):
+        return None
+    return counters.PeakWorkingSetSize
@@ -1,6 +1,22 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from copy import copy
 from datetime import datetime
+from os import remove, stat, truncate
+from pathlib import Path
+from time import sleep
+
+import numpy as np
 
 import converter
+import helper
+from cache import ResultCache, model_files_fingerprint
+from checkpoint import ChunkCheckpoint
+from metrics import PipelineMetrics
+from parallel import ShardedConverter
+from scores import SavedScores, ScoreWriter
+from session import ConverterSession
 
 
 def print_updates(string):
@@ -9,61 +25,525 @@ def print_updates(string):
     print(string)
 
 
-def main(args):
-    """Convert data in the selected file."""
+def main(args, session=None):
+    """
+    Convert data in the selected files and then any new files in the watch folder if one is selected, reusing the resident
+    lookup tables and models of the session if given, or post-process the saved scores of a previous conversion if selected.
+    """
+    if session is None:
+        session = build_session(args)
+    if session.metrics is not None:
+        session.metrics.info.update(files=args.files, watch=args.watch, input_type=args.input_type, unknown_mode=args.unknown_mode,
+                                    model=args.model, ensemble=args.ensemble, consensus=args.consensus, precision=args.precision, workers=args.workers, file_workers=args.file_workers,
+                                    chunk_size=args.chunk_size, resume=args.resume, save_scores=args.save_scores, from_scores=args.from_scores,
+                                    threshold=args.threshold)
+
+    # Convert the cases again at full precision in a separate session to measure the agreement of a reduced precision
+    baseline_session = ConverterSession(**dict(session_kwargs(args), precision='float32', show_progress=False)) if args.agreement_check else None
+
+    # Shard the conversion of cases across worker processes if more than one worker is requested
+    try:
+        if args.from_scores:
+            postprocess_saved_scores(args, session)
+        elif args.workers > 1:
+            print_updates(f'Starting {args.workers} worker processes......')
+            with ShardedConverter(args.workers, args.model, args.no_iss, args.mais, args.max_sev_per_chapter, **session_kwargs(args)) as pool:
+                convert_files(args, session, pool, baseline_session)
+        else:
+            convert_files(args, session, baseline_session=baseline_session)
+    finally:
+        write_metrics(args, session)
+
+
+def convert_files(args, session, pool=None, baseline_session=None):
+    """Convert the selected files and then keep converting new files in the watch folder if one is selected."""
+    if len(args.files) == 1 and not args.watch:
+        run_conversion(file_args(args, args.files[0]), session, pool, baseline_session)
+    elif args.files:
+        failed_file_list = convert_file_batch(args, args.files, session, pool, baseline_session)
+        if failed_file_list and not args.watch:
+            raise ValueError(f'{len(failed_file_list):,} of {len(args.files):,} files failed to convert: ' + ', '.join(failed_file_list))
+    if args.watch:
+        watch_folder(args, session, pool, baseline_session)
+
+
+def file_args(args, file_path):
+    """Get a copy of the arguments for the conversion of one file."""
+    single_file_args = copy(args)
+    single_file_args.file = file_path
+    return single_file_args
+
+
+def convert_file_batch(args, file_list, session, pool=None, baseline_session=None):
+    """
+    Convert several files with the same session, converting up to file_workers files at once. A file that fails to convert
+    is reported without stopping the conversion of the other files. Returns the files that failed to convert.
+    """
+    def convert_one_file(file_idx, file_path):
+        print_updates(f'Converting file {file_idx + 1:,} of {len(file_list):,}: {file_path}......')
+        try:
+            run_conversion(file_args(args, file_path), session, pool, baseline_session)
+        except Exception as error:  # noqa: BLE001
+            # Report any error of the file and carry on with the other files of the batch
+            print_updates(f'Failed to convert {file_path}: {error}')
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=args.file_workers) as executor:
+        converted_list = list(executor.map(convert_one_file, range(len(file_list)), file_list))
+    failed_file_list = [file_path for file_path, converted in zip(file_list, converted_list) if not converted]
+    print_updates(f'{len(file_list) - len(failed_file_list):,} of {len(file_list):,} files converted.')
+    return failed_file_list
+
+
+def watch_folder(args, session, pool=None, baseline_session=None):
+    """
+    Convert files matching the watch pattern as they land in the watch folder until interrupted. A file is converted once
+    its size and modification time stop changing between two polls, unless it is an output file or its output file is
+    already newer than it, so that files converted before the watch started are not converted again.
+    """
+    print_updates(f'Watching {args.watch} for {args.watch_pattern} files every {args.watch_interval:g} seconds. Press Ctrl+C to stop......')
+    # Size and modification time of each file at the last poll and when it was last converted
+    polled_file_stats = {}
+    converted_file_stats = {}
+    try:
+        while True:
+            ready_file_list = []
+            for path in sorted(Path(args.watch).glob(args.watch_pattern)):
+                file_path = str(path)
+                if not path.is_file() or converter.is_output_file(file_path):
+                    continue
+                file_stat = stat(file_path)
+                file_stats = (file_stat.st_size, file_stat.st_mtime_ns)
+                last_polled_stats = polled_file_stats.get(file_path)
+                polled_file_stats[file_path] = file_stats
+                # Wait for files that are still being written and skip files that were converted since they last changed
+                if file_stats != last_polled_stats or converted_file_stats.get(file_path) == file_stats:
+                    continue
+                output_path = Path(default_output_file_path(args, file_path))
+                if output_path.is_file() and output_path.stat().st_mtime_ns >= file_stat.st_mtime_ns:
+                    converted_file_stats[file_path] = file_stats
+                    continue
+                ready_file_list.append(file_path)
+
+            if ready_file_list:
+                convert_file_batch(args, ready_file_list, session, pool, baseline_session)
+                # Failed files are only retried once they change
+                for file_path in ready_file_list:
+                    converted_file_stats[file_path] = polled_file_stats[file_path]
+            sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        print_updates('Stopped watching ' + args.watch + '.')
+
+
+def build_session(args, **kwargs):
+    """Create a conversion session with the settings, result cache, and metrics selected in the arguments."""
+    result_cache = ResultCache(args.cache, args.cache_max_entries) if args.cache else None
+    metrics = PipelineMetrics(profile=bool(args.profile)) if args.metrics or args.profile else None
+    return ConverterSession(result_cache=result_cache, metrics=metrics, **dict(session_kwargs(args), **kwargs))
+
+
+def write_metrics(args, session):
+    """Write the measured stage metrics and the convert_data profile if they were requested in the arguments."""
+    if session.metrics is None:
+        return
+    if args.metrics:
+        session.metrics.write(args.metrics)
+        print_updates('Conversion metrics written out to: ' + args.metrics)
+    if args.profile:
+        session.metrics.write_profile(args.profile)
+        print_updates('Conversion profile written out to: ' + args.profile)
+
+
+def session_kwargs(args):
+    """Get the conversion session settings selected in the arguments."""
+    return {'inter_threads': args.inter_threads, 'intra_threads': args.intra_threads, 'nmt_max_batch_size': args.nmt_batch_size,
+            'nmt_asynchronous': args.nmt_async, 'ffnn_batch_size': args.ffnn_batch_size, 'ffnn_inference': args.ffnn_inference,
+            'ffnn_backend': args.ffnn_backend, 'precision': args.precision}
+
+
+def output_compression(args):
+    """Get the output compression selected in the arguments, or None for no compression."""
+    return None if args.compression == 'none' else args.compression
+
+
+def run_conversion(args, session, pool=None, baseline_session=None):
+    """Convert the file in chunks of cases if a chunk size is given or all at once if not."""
+    if args.chunk_size:
+        stream_file(args, session, pool, baseline_session)
+    else:
+        convert_file(args, session, pool, baseline_session)
+
+
+def convert_file(args, session, pool=None, baseline_session=None):
+    """Convert all data in the selected file at once."""
 
     # Import selected file data into list of patient IDs and a list of sets containing the codes per case
     print_updates('Loading in input data......')
-    patient_ids, codes_per_case_setlist = converter.import_data(args.input_type, args.file)
+    patient_ids, codes_per_case_setlist = session.import_data(args.input_type, args.file)
     # If patient_ids is a string, there was an error in loading the data
     if isinstance(patient_ids, str):
         raise ValueError(patient_ids)
 
     # Preprocess imported codes and handle unknown codes
     print_updates('Input data loaded. Preprocessing/cleaning data......')
-    codes_per_case_list, unrecognized_codes = converter.preprocess_data(codes_per_case_setlist, args.unknown_mode)
+    codes_per_case_list, unrecognized_codes = session.preprocess_data(codes_per_case_setlist, args.unknown_mode)
     # If codes_per_case_list is a string, there was an error in preprocessing/cleaning the data
     if isinstance(codes_per_case_list, str):
         raise ValueError(codes_per_case_list)
 
     # Report and handle if unrecognized codes were found
-    if unrecognized_codes:
-        if args.unknown_mode == 'fail':
-            print_updates('The models were not developed using the following ICD-10 codes. The prediction will now abort.')
-            print(unrecognized_codes)
-            return
-
-        elif args.unknown_mode == 'ignore':
-            ids_wo_s_and_t_codes = [patient_ids[idx] for idx in unrecognized_codes]
-            print_updates('The cases with the following IDs did not contain any codes to convert after ignoring untrained codes.')
-            print(ids_wo_s_and_t_codes)
-            return
+    if unrecognized_codes and report_unrecognized_codes(args, patient_ids, unrecognized_codes):
+        return
 
-        else:
-            print_updates('The following ICD-10 codes replacements were made.')
-            print(unrecognized_codes)
+    # Format, convert, and post-process the pre-processed data, saving the raw conversion output if requested
+    with ScoreWriter(converter.default_scores_path(args.file, args.model), args.model, patient_ids, input_file=args.file,
+                     precision=args.precision, ffnn_backend=args.ffnn_backend) if args.save_scores else nullcontext() as score_writer:
+        output_list = convert_cases(args, session, codes_per_case_list, pool, score_writer=score_writer)
+    if score_writer is not None:
+        print_updates('Raw conversion output saved to: ' + score_writer.path)
+
+    # Report how many outputs differ from the full precision outputs if requested
+    if baseline_session is not None:
+        print_updates('Converting at float32 precision for the agreement check......')
+        report_agreement(args, session, count_output_differences(args, baseline_session, codes_per_case_list, output_list))
+
+    # Write output results in specified format
+    print_updates('Conversion output process and ISS extracted. Exporting ISS predictions......')
+    with open_output_writer(args, session) as writer:
+        session.write_results(writer, patient_ids, output_list)
+
+    # Update console with completion of conversion
+    print_updates('ISS predictions written out to: ' + writer.path)
+
+
+def stream_file(args, session, pool=None, baseline_session=None):
+    """
+    Convert data in the selected file chunk by chunk, writing the results of each chunk to the output file as it is converted.
+    If resuming is selected, every chunk is committed to a checkpoint once its results are on disk, and a conversion with a
+    checkpoint of the same file and options resumes after its last committed chunk, giving the same output file as an
+    uninterrupted conversion.
+    """
+    print_updates(f'Converting input data in chunks of {args.chunk_size:,} cases......')
+    all_code_replacements = {}
+    difference_counter = Counter()
+    writer = None
+    total_cases = 0
+    resumed_chunks = 0
+    checkpoint = ChunkCheckpoint(default_output_file_path(args, args.file), args.file, checkpoint_options(args)) if args.resume else None
+    checkpoint_state = checkpoint.load() if checkpoint is not None else None
+    if checkpoint_state is not None:
+        resumed_chunks = checkpoint_state['completed_chunks']
+        total_cases = checkpoint_state['cases_written']
+        all_code_replacements = checkpoint_state['code_replacements']
+        difference_counter = Counter(checkpoint_state['agreement_differences'])
+        # Cut off the results of any chunk that was being written when the conversion was interrupted
+        truncate(checkpoint.output_file_path, checkpoint_state['output_bytes'])
+        writer = open_output_writer(args, session, append=True)
+        print_updates(f'Resuming after {resumed_chunks:,} converted chunks with {total_cases:,} cases from {checkpoint.path}......')
+    for chunk_idx, (patient_ids, codes_per_case_setlist) in enumerate(session.iter_import_data(args.input_type, args.file, args.chunk_size)):
+        # Skip the chunks whose results are already in the output file
+        if chunk_idx < resumed_chunks:
+            continue
+
+        # If patient_ids is a string, there was an error in loading the data
+        if isinstance(patient_ids, str):
+            remove_partial_output(writer, checkpoint)
+            raise ValueError(patient_ids)  # noqa: TRY004
+
+        # Preprocess imported codes and handle unknown codes
+        codes_per_case_list, unrecognized_codes = session.preprocess_data(codes_per_case_setlist, args.unknown_mode)
+        # If codes_per_case_list is a string, there was an error in preprocessing/cleaning the data
+        if isinstance(codes_per_case_list, str):
+            remove_partial_output(writer, checkpoint)
+            raise ValueError(codes_per_case_list)  # noqa: TRY004
+
+        # Abort on unrecognized codes when required and collect code replacements to report once all chunks are done, only
+        # committing the replacements that earlier chunks did not make to the checkpoint
+        chunk_code_replacements = {}
+        if unrecognized_codes:
+            if args.unknown_mode == 'closest':
+                chunk_code_replacements = {code: replacement for code, replacement in unrecognized_codes.items()
+                                           if code not in all_code_replacements}
+                all_code_replacements.update(unrecognized_codes)
+            elif report_unrecognized_codes(args, patient_ids, unrecognized_codes):
+                remove_partial_output(writer, checkpoint)
+                return
+
+        # Format, convert, and post-process the pre-processed chunk and write its results to the output file
+        output_list = convert_cases(args, session, codes_per_case_list, pool, verbose=False)
+        if baseline_session is not None:
+            difference_counter += count_output_differences(args, baseline_session, codes_per_case_list, output_list)
+        if writer is None:
+            writer = open_output_writer(args, session)
+        session.write_results(writer, patient_ids, output_list)
+        total_cases += len(patient_ids)
+        if checkpoint is not None:
+            checkpoint.commit(chunk_idx + 1, total_cases, writer.flush(), chunk_code_replacements,
+                              agreement_differences=dict(difference_counter))
+        print_updates(f'Chunk {chunk_idx + 1:,} converted. {total_cases:,} cases written so far......')
+
+    # Write a header only output file for input files without any cases, like the conversion of a whole file
+    if writer is None:
+        writer = open_output_writer(args, session)
+    writer.close()
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    if all_code_replacements:
+        print_updates('The following ICD-10 codes replacements were made.')
+        print(all_code_replacements)
+    if baseline_session is not None:
+        report_agreement(args, session, difference_counter)
+
+    # Update console with completion of conversion
+    print_updates('ISS predictions written out to: ' + writer.path)
+
+
+def default_output_file_path(args, file_path):
+    """Get the path of the output file written next to an input file for the selected model or ensemble of models and output options."""
+    if args.ensemble:
+        return converter.ensemble_output_file_path(file_path, args.ensemble, args.no_iss, args.mais, args.max_sev_per_chapter,
+                                                   args.consensus, args.output_format, output_compression(args))
+    return converter.default_output_file_path(file_path, args.model, args.no_iss, args.mais, args.max_sev_per_chapter,
+                                              args.output_format, output_compression(args), args.threshold)
+
+
+def open_output_writer(args, session, append=False):
+    """
+    Open the writer of the output file of the selected file, model or ensemble of models, and output options, appending to
+    the existing output file if selected.
+    """
+    output_file_path = helper.STDOUT_PATH if args.stdout else default_output_file_path(args, args.file)
+    if args.ensemble:
+        return converter.open_ensemble_result_writer(args.file, args.ensemble, args.no_iss, args.mais, args.max_sev_per_chapter, args.consensus,
+                                                     args.output_format, output_compression(args), output_file_path, append)
+    return session.open_result_writer(args.file, args.model, args.no_iss, args.mais, args.max_sev_per_chapter, args.output_format,
+                                      output_compression(args), output_file_path, append)
+
+
+def checkpoint_options(args):
+    """
+    Get the options of a chunked conversion that change its output file, which must match for the conversion to resume
+    from a checkpoint, along with fingerprints of the model files.
+    """
+    model_list = args.ensemble or [args.model]
+    return {'input_type': args.input_type, 'unknown_mode': args.unknown_mode, 'chunk_size': args.chunk_size, 'models': model_list,
+            'model_files': [model_files_fingerprint(model_type) for model_type in model_list], 'consensus': args.consensus,
+            'no_iss': args.no_iss, 'mais': args.mais, 'max_sev_per_chapter': args.max_sev_per_chapter, 'precision': args.precision,
+            'ffnn_backend': args.ffnn_backend, 'ffnn_inference': args.ffnn_inference, 'output_format': args.output_format,
+            'compression': args.compression, 'agreement_check': args.agreement_check}
+
+
+def convert_cases(args, session, codes_per_case_list, pool=None, verbose=True, score_writer=None):
+    """
+    Format, convert, and post-process pre-processed cases, returning the output of each case. If a score writer is given,
+    every case is converted without the result cache and the raw conversion output is written to it.
+    """
+
+    # Convert each distinct code list only once and scatter its output back to every case with the same codes
+    unique_codes_per_case_list, unique_idx_array = helper.deduplicate_code_lists(codes_per_case_list)
+    if session.metrics is not None:
+        session.metrics.count('cases', len(codes_per_case_list))
+        session.metrics.count('unique_code_sets', len(unique_codes_per_case_list))
+    if verbose:
+        print_updates(f'{len(codes_per_case_list):,} cases contain {len(unique_codes_per_case_list):,} unique code sets '
+                      f'({len(codes_per_case_list) / max(1, len(unique_codes_per_case_list)):.2f}x deduplication)......')
+    if args.ensemble:
+        unique_output_list = convert_ensemble_cases(args, session, unique_codes_per_case_list, verbose)
+    elif score_writer is not None:
+        score_writer.write_case_index(unique_idx_array, len(unique_codes_per_case_list))
+        unique_output_list = infer_cases(args, session, unique_codes_per_case_list, verbose=verbose, score_writer=score_writer)
+    else:
+        unique_output_list = convert_unique_cases(args, session, unique_codes_per_case_list, pool, verbose)
+    return np.array(unique_output_list, dtype=object)[unique_idx_array].tolist()
+
+
+def convert_ensemble_cases(args, session, codes_per_case_list, verbose=True):
+    """
+    Convert pre-processed cases with every model of the ensemble, returning the merged outputs of the models for each case.
+    FFNN and NMT models run on separate threads so that the two kinds of models convert at the same time, while models of
+    the same kind run one after the other rather than competing for the same cores.
+    """
+    with ThreadPoolExecutor(max_workers=1) as ffnn_executor, ThreadPoolExecutor(max_workers=1) as nmt_executor:
+        output_futures = [(ffnn_executor if model_type in ['direct_FFNN', 'indirect_FFNN'] else nmt_executor).submit(
+                              convert_unique_cases, model_args(args, model_type), session, codes_per_case_list, None, verbose)
+                          for model_type in args.ensemble]
+        output_lists = [output_future.result() for output_future in output_futures]
+    return converter.merge_ensemble_outputs(output_lists, args.ensemble, args.no_iss, args.mais, args.max_sev_per_chapter, args.consensus)
+
+
+def model_args(args, model_type):
+    """Get a copy of the arguments for the conversion with one model of the ensemble."""
+    single_model_args = copy(args)
+    single_model_args.model = model_type
+    return single_model_args
+
+
+def convert_unique_cases(args, session, codes_per_case_list, pool=None, verbose=True):
+    """Convert pre-processed cases, reusing the cached outputs of any cases found in the result cache."""
+    if session.result_cache is None:
+        return infer_cases(args, session, codes_per_case_list, pool, verbose)
+
+    # Reuse the cached outputs of previously converted code sets and only convert the cases missing from the cache
+    output_list = session.result_cache.get_many(codes_per_case_list, args.model, args.no_iss, args.mais, args.max_sev_per_chapter,
+                                                args.ffnn_inference, args.ffnn_backend, args.precision)
+    uncached_idx_list = [idx for idx, output in enumerate(output_list) if output is None]
+    if session.metrics is not None:
+        session.metrics.count('result_cache_hits', len(output_list) - len(uncached_idx_list))
+        session.metrics.count('result_cache_misses', len(uncached_idx_list))
+    if verbose:
+        print_updates(f'{len(output_list) - len(uncached_idx_list):,} of {len(output_list):,} cases found in the result cache......')
+    if uncached_idx_list:
+        uncached_codes_per_case_list = [codes_per_case_list[idx] for idx in uncached_idx_list]
+        uncached_output_list = infer_cases(args, session, uncached_codes_per_case_list, pool, verbose)
+        session.result_cache.put_many(uncached_codes_per_case_list, uncached_output_list, args.model, args.no_iss, args.mais,
+                                      args.max_sev_per_chapter, args.ffnn_inference, args.ffnn_backend, args.precision)
+        for idx, output in zip(uncached_idx_list, uncached_output_list):
+            output_list[idx] = output
+    return output_list
+
+
+def infer_cases(args, session, codes_per_case_list, pool=None, verbose=True, score_writer=None):
+    """
+    Format, convert, and post-process pre-processed cases with the selected model, returning the output of each case. The
+    raw conversion output is written to the score writer if one is given.
+    """
+
+    # Let the worker processes format, convert, and post-process contiguous shards of the cases
+    if pool is not None:
+        if verbose:
+            print_updates(f'Data preprocessed/cleaned. Converting using {args.model} across {pool.workers} worker processes......')
+        # The worker processes format, convert, and post-process the cases, so only the sharded conversion as a whole is measured
+        with session.stage('sharded_conversion', len(codes_per_case_list)):
+            return pool.convert_cases(codes_per_case_list)
 
     # Format pre-processed data for conversion
-    print_updates('Data preprocessed/cleaned. Formatting data for prediction......')
-    formatted_input_data = converter.formatting_data(codes_per_case_list, args.model)
+    if verbose:
+        print_updates('Data preprocessed/cleaned. Formatting data for prediction......')
+    formatted_input_data = session.formatting_data(codes_per_case_list, args.model)
     # If formatted_input_data is a string, there was an error in formatting the data
     if isinstance(formatted_input_data, str):
         raise ValueError(formatted_input_data)
 
     # Convert formatted pre-processed data into either FFNN logit scores or NMT translated words
-    if args.model in ['direct_FFNN', 'indirect_FFNN']:
-        print_updates(f'Data formatted. Converting using {args.model} in {len(formatted_input_data):,} 64-set batches...')
+    if verbose:
+        if args.model in ['direct_FFNN', 'indirect_FFNN']:
+            print_updates(f'Data formatted. Converting using {args.model} in {len(formatted_input_data):,} {session.ffnn_batch_size}-set batches...')
+        else:
+            print_updates(f'Data formatted. Converting using {args.model} in batches of up to {args.nmt_batch_size:,} cases......')
+    if score_writer is None:
+        conversion_output = session.convert_data(formatted_input_data, args.model)
+    elif args.model in ['direct_FFNN', 'indirect_FFNN']:
+        conversion_output = session.convert_data(formatted_input_data, args.model, score_callback=score_writer.write_scores)
     else:
-        print_updates(f'Data formatted. Converting using {args.model}......')
-    conversion_output = converter.convert_data(formatted_input_data, args.model)
+        conversion_output = session.convert_data(formatted_input_data, args.model)
+        score_writer.write_hypotheses(conversion_output)
 
     # Post-process converted output into chosen format
-    print_updates('Data converted. Processing conversion output and extracting ISS......')
-    output_list = converter.postprocess_data(conversion_output, args.model, args.no_iss, args.mais, args.max_sev_per_chapter)
+    if verbose:
+        print_updates('Data converted. Processing conversion output and extracting ISS......')
+    return session.postprocess_data(conversion_output, args.model, args.no_iss, args.mais, args.max_sev_per_chapter)
 
-    # Write output results in specified format
-    print_updates('Conversion output process and ISS extracted. Exporting ISS predictions......')
-    output_file_path = converter.output_iss_results(patient_ids, output_list, args.file, args.model, args.no_iss, args.mais, args.max_sev_per_chapter)
 
-    # Update console with completion of conversion
-    print_updates('ISS predictions written out to: ' + output_file_path)
+def postprocess_saved_scores(args, session):
+    """
+    Post-process the raw conversion output saved in the selected scores folder with the selected output options and score
+    threshold and write the outputs, without importing or converting the input file again. The output file is written
+    next to the scores folder with the name of the output file of its input file.
+    """
+    print_updates('Loading saved conversion output from ' + args.from_scores + '......')
+    saved_scores = SavedScores(args.from_scores)
+    args = file_args(args, args.from_scores)
+
+    # Predict from the saved FFNN scores at the selected threshold or reuse the saved NMT hypotheses
+    if args.model in ['direct_FFNN', 'indirect_FFNN']:
+        threshold = helper.INDIRECT_FFNN_THRESHOLD if args.threshold is None else args.threshold
+        print_updates(f'Predicting from the saved scores of {len(saved_scores.scores):,} unique code sets'
+                      + (f' at a threshold of {threshold:g}' if args.model == 'indirect_FFNN' else '') + '......')
+        with session.stage('predictions_from_scores', len(saved_scores.scores)):
+            conversion_output = converter.predictions_from_scores(saved_scores.scores, args.model, threshold)
+    else:
+        conversion_output = saved_scores.hypotheses()
+
+    # Post-process the unique code sets and scatter their outputs back to every case
+    print_updates('Processing conversion output and extracting ISS......')
+    unique_output_list = session.postprocess_data(conversion_output, args.model, args.no_iss, args.mais, args.max_sev_per_chapter)
+    output_list = np.array(unique_output_list, dtype=object)[saved_scores.case_index].tolist()
+    if session.metrics is not None:
+        session.metrics.count('cases', len(output_list))
+        session.metrics.count('unique_code_sets', len(unique_output_list))
+
+    print_updates('Exporting ISS predictions......')
+    with open_output_writer(args, session) as writer:
+        session.write_results(writer, saved_scores.patient_ids.tolist(), output_list)
+    print_updates('ISS predictions written out to: ' + writer.path)
+
+
+def count_output_differences(args, baseline_session, codes_per_case_list, output_list) -> Counter:
+    """
+    Convert pre-processed cases at full precision and count the cases whose output differs from the given outputs, in
+    total under 'differing_cases' and for each output column under its name, along with the number of 'cases'.
+    """
+    unique_codes_per_case_list, unique_idx_array = helper.deduplicate_code_lists(codes_per_case_list)
+    baseline_output_list = np.array(infer_cases(args, baseline_session, unique_codes_per_case_list, verbose=False), dtype=object)[unique_idx_array].tolist()
+    output_column_list = converter.output_column_names(args.model, args.no_iss, args.mais, args.max_sev_per_chapter)
+
+    difference_counter = Counter(cases=len(output_list))
+    for output, baseline_output in zip(output_list, baseline_output_list):
+        if output == baseline_output:
+            continue
+        difference_counter['differing_cases'] += 1
+        # Cases without any predictions are output as a single NaN rather than a NaN for every column
+        value_list = ['NaN'] * len(output_column_list) if output == 'NaN' else output.split(',')
+        baseline_value_list = ['NaN'] * len(output_column_list) if baseline_output == 'NaN' else baseline_output.split(',')
+        for column, value, baseline_value in zip(output_column_list, value_list, baseline_value_list):
+            if value != baseline_value:
+                difference_counter[column] += 1
+    return difference_counter
+
+
+def report_agreement(args, session, difference_counter):
+    """Report how many outputs of a reduced precision conversion differ from the full precision outputs."""
+    num_cases = difference_counter['cases']
+    output_column_list = converter.output_column_names(args.model, args.no_iss, args.mais, args.max_sev_per_chapter)
+    print_updates(f'{args.precision} agreement with float32: {num_cases - difference_counter["differing_cases"]:,} of {num_cases:,} cases '
+                  f'({(num_cases - difference_counter["differing_cases"]) / max(1, num_cases):.4%}) have identical outputs. Differing '
+                  'outputs per column: ' + ', '.join(f'{column}={difference_counter[column]:,}' for column in output_column_list))
+    if session.metrics is not None:
+        session.metrics.count('agreement_differing_cases', difference_counter['differing_cases'])
+        for column in output_column_list:
+            session.metrics.count(f'agreement_differing_{column}', difference_counter[column])
+
+
+def report_unrecognized_codes(args, patient_ids, unrecognized_codes):
+    """Report unrecognized codes found during preprocessing and return whether the conversion should abort."""
+    if args.unknown_mode == 'fail':
+        print_updates('The models were not developed using the following ICD-10 codes. The prediction will now abort.')
+        print(unrecognized_codes)
+        return True
+
+    elif args.unknown_mode == 'ignore':
+        ids_wo_s_and_t_codes = [patient_ids[idx] for idx in unrecognized_codes]
+        print_updates('The cases with the following IDs did not contain any codes to convert after ignoring untrained codes.')
+        print(ids_wo_s_and_t_codes)
+        return True
+
+    else:
+        print_updates('The following ICD-10 codes replacements were made.')
+        print(unrecognized_codes)
+        return False
+
+
+def remove_partial_output(writer, checkpoint=None):
+    """
+    Close and remove the output file of an aborted chunked conversion, along with its checkpoint if given, so that
+    incomplete results are not left behind.
+    """
+    if checkpoint is not None:
+        checkpoint.remove()
+    if writer is not None:
+        writer.close()
+        if writer.path != helper.STDOUT_PATH:
+            remove(writer.path)
+            print_updates('Removed incomplete output file: ' + writer.path)
@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import cpu_count
+
+from session import ConverterSession
+
+# Session and output options of the current worker process, set once by the pool initializer
+_worker_session = None
+_worker_options = None
+
+
+class ShardedConverter:
+    """
+    Process pool that converts cases across multiple worker processes.
+
+    Each worker process loads the selected model once on start up. Cases are split into contiguous shards that are
+    formatted, converted, and post-processed by the workers, with the outputs merged back in the original case order.
+    The same pool can be reused for many calls, such as every chunk of a streamed conversion.
+    """
+
+    def __init__(self, workers: int, model_type: str, no_iss_bool: bool, mais_bool: bool, max_severity_chapter_bool: bool,
+                 shards_per_worker: int = 4, **session_kwargs):
+        self.workers = workers
+        self.shards_per_worker = shards_per_worker
+        # Split the available cores between the workers so that they do not compete for the same cores
+        threads_per_worker = max(1, (cpu_count() or 1) // workers)
+        session_kwargs.update(inter_threads=1, intra_threads=threads_per_worker, show_progress=False)
+        # Spawn rather than fork worker processes so that no torch or ctranslate2 thread state is inherited
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=_init_worker,
+                                             initargs=(session_kwargs, threads_per_worker, model_type, no_iss_bool,
+                                                       mais_bool, max_severity_chapter_bool))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shut down the worker processes."""
+        self._executor.shutdown(cancel_futures=True)
+
+    def convert_cases(self, codes_per_case_list: list) -> list:
+        """
+        Format, convert, and post-process pre-processed cases across the worker processes.
+
+        Args:
+            codes_per_case_list (list): List of lists that each contain all the trauma codes for a given patient/case.
+
+        Returns:
+            list: Post-processed output of each case in the same order as the given cases.
+        """
+        shard_size = max(1, -(-len(codes_per_case_list) // (self.workers * self.shards_per_worker)))
+        shards = [codes_per_case_list[idx:idx + shard_size] for idx in range(0, len(codes_per_case_list), shard_size)]
+        output_list = []
+        for shard_output_list in self._executor.map(_convert_shard, shards):
+            output_list.extend(shard_output_list)
+        return output_list
+
+
+def _init_worker(session_kwargs, threads_per_worker, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool):
+    """Create the session of a worker process and load the selected model once."""
+    global _worker_session, _worker_options
+    if model_type in ['direct_FFNN', 'indirect_FFNN'] and session_kwargs.get('ffnn_backend', 'torch') == 'torch':
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    _worker_session = ConverterSession(**session_kwargs)
+    _worker_session.get_model(model_type)
+    _worker_options = (model_type, no_iss_bool, mais_bool, max_severity_chapter_bool)
+
+
+def _convert_shard(codes_per_case_list):
+    """Format, convert, and post-process a contiguous shard of cases in a worker process."""
+    model_type, no_iss_bool, mais_bool, max_severity_chapter_bool = _worker_options
+    formatted_input_data = _worker_session.formatting_data(codes_per_case_list, model_type)
+    if isinstance(formatted_input_data, str):
+        raise ValueError(formatted_input_data)  # noqa: TRY004
+    conversion_output = _worker_session.convert_data(formatted_input_data, model_type)
+    return _worker_session.postprocess_data(conversion_output, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool)
@@ -0,0 +1,118 @@
+import json
+from itertools import chain, pairwise
+from pathlib import Path
+
+import numpy as np
+
+# Version of the layout of scores folders, increased whenever older folders can no longer be read
+SCORES_FORMAT_VERSION = 1
+METADATA_FILE = 'metadata.json'
+
+
+class ScoreWriter:
+    """
+    Writer of the raw conversion output of the cases of an input file to a scores folder, from which the cases can be
+    post-processed again with other output options without converting them.
+
+    The folder holds the patient IDs of the cases (patient_ids.npy), the index of each case's unique code set among the
+    converted code sets (case_index.npy), and the raw output of every unique code set. FFNN output scores are written as
+    a float32 matrix with a row per code set (scores.npy), filled batch by batch through a memory map as the model produces
+    them. NMT hypotheses are written as their flattened tokens (hypothesis_tokens.npy) and the offset of the first token of
+    each code set (hypothesis_offsets.npy). The metadata file is written last when the writer is closed without an error,
+    so a folder without it was not written completely.
+    """
+
+    def __init__(self, path: str, model_type: str, patient_ids: list, **metadata):
+        self.path = path
+        self.model_type = model_type
+        self.metadata = dict(format_version=SCORES_FORMAT_VERSION, model_type=model_type, num_cases=len(patient_ids), **metadata)
+
+        self._folder = Path(path)
+        self._folder.mkdir(parents=True, exist_ok=True)
+        # Mark the folder as incomplete until the writer is closed
+        (self._folder / METADATA_FILE).unlink(missing_ok=True)
+        np.save(self._folder / 'patient_ids.npy', np.array(patient_ids, dtype=str))
+        self._score_matrix = None
+        self._num_scored_cases = 0
+        self._scores_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._score_matrix = None
+
+    def write_case_index(self, case_index: np.ndarray, num_scored_cases: int):
+        """Write the index of the unique code set of each case, out of the num_scored_cases code sets that are converted."""
+        self._num_scored_cases = num_scored_cases
+        self.metadata['num_unique_cases'] = num_scored_cases
+        np.save(self._folder / 'case_index.npy', np.asarray(case_index, dtype=np.int64))
+
+    def write_scores(self, batch_scores: np.ndarray):
+        """Write the FFNN output scores of the next batch of code sets."""
+        if self._score_matrix is None:
+            self._score_matrix = np.lib.format.open_memmap(self._folder / 'scores.npy', mode='w+', dtype=np.float32,
+                                                           shape=(self._num_scored_cases, batch_scores.shape[1]))
+        self._score_matrix[self._scores_written:self._scores_written + len(batch_scores)] = batch_scores
+        self._scores_written += len(batch_scores)
+
+    def write_hypotheses(self, hypotheses_list: list):
+        """Write the NMT hypothesis tokens of every code set."""
+        token_counts = np.fromiter(map(len, hypotheses_list), dtype=np.int64, count=len(hypotheses_list))
+        np.save(self._folder / 'hypothesis_tokens.npy', np.array(list(chain.from_iterable(hypotheses_list)), dtype=str))
+        np.save(self._folder / 'hypothesis_offsets.npy', np.concatenate([[0], np.cumsum(token_counts)]))
+        self._scores_written = len(hypotheses_list)
+
+    def close(self):
+        """Flush the scores and write the metadata file that marks the folder as complete."""
+        if self._scores_written != self._num_scored_cases:
+            raise ValueError(f'Only {self._scores_written:,} of {self._num_scored_cases:,} code sets were written to {self.path}.')
+        if self._score_matrix is not None:
+            self._score_matrix.flush()
+            self._score_matrix = None
+        elif self.model_type in ['direct_FFNN', 'indirect_FFNN']:
+            np.save(self._folder / 'scores.npy', np.empty((0, 0), dtype=np.float32))
+        with open(self._folder / METADATA_FILE, 'w') as metadata_file:
+            json.dump(self.metadata, metadata_file, indent=2)
+
+
+class SavedScores:
+    """
+    Raw conversion output read from a scores folder written by ScoreWriter. The arrays are memory mapped, so only the
+    parts that are used are read from disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.metadata = read_scores_metadata(path)
+        self.model_type = self.metadata['model_type']
+
+        folder = Path(path)
+        self.patient_ids = np.load(folder / 'patient_ids.npy', mmap_mode='r')
+        self.case_index = np.load(folder / 'case_index.npy', mmap_mode='r')
+        if self.model_type in ['direct_FFNN', 'indirect_FFNN']:
+            self.scores = np.load(folder / 'scores.npy', mmap_mode='r')
+        else:
+            self._hypothesis_tokens = np.load(folder / 'hypothesis_tokens.npy', mmap_mode='r')
+            self._hypothesis_offsets = np.load(folder / 'hypothesis_offsets.npy', mmap_mode='r')
+
+    def hypotheses(self) -> list:
+        """Get the NMT hypothesis tokens of every code set, as returned by convert_data."""
+        token_list = self._hypothesis_tokens.tolist()
+        offset_list = self._hypothesis_offsets.tolist()
+        return [token_list[start:end] for start, end in pairwise(offset_list)]
+
+
+def read_scores_metadata(path: str) -> dict:
+    """Read the metadata of a scores folder, raising a ValueError if the folder is missing, incomplete, or of another version."""
+    metadata_path = Path(path) / METADATA_FILE
+    if not metadata_path.is_file():
+        raise ValueError(f'{path} is not a completely written scores folder. Convert the input file again with --save_scores.')
+    with open(metadata_path) as metadata_file:
+        metadata = json.load(metadata_file)
+    if metadata.get('format_version') != SCORES_FORMAT_VERSION:
+        raise ValueError(f'{path} was written by an incompatible version. Convert the input file again with --save_scores.')
+    return metadata
@@ -0,0 +1,242 @@
+import json
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain
+from queue import Empty, Queue
+from threading import Thread
+from time import monotonic
+
+import converter
+import no_gui
+from no_gui import print_updates
+from parallel import ShardedConverter
+
+
+class MicroBatcher:
+    """
+    Background thread that coalesces the cases of concurrent requests into micro-batches before converting them.
+
+    A micro-batch is converted once it holds at least max_batch_size cases or max_wait_ms milliseconds after its first
+    request arrived, whichever comes first. Requests are never split between micro-batches, so a request with more than
+    max_batch_size cases is converted as a micro-batch of its own.
+    """
+
+    def __init__(self, convert_cases, max_batch_size: int = 256, max_wait_ms: float = 5.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._convert_cases = convert_cases
+        self._queue = Queue()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, codes_per_case_list: list) -> Future:
+        """Queue pre-processed cases for conversion. The returned future resolves to the output of each case."""
+        future = Future()
+        self._queue.put((codes_per_case_list, future))
+        return future
+
+    def close(self):
+        """Convert any queued requests and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while (request := self._queue.get()) is not None:
+            # Collect further requests until the micro-batch is full or the wait of its first request is over
+            request_list = [request]
+            case_count = len(request[0])
+            deadline = monotonic() + self.max_wait_ms / 1000
+            closing = False
+            while case_count < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(0.0, deadline - monotonic()))
+                except Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                request_list.append(request)
+                case_count += len(request[0])
+            self._convert_batch(request_list)
+            if closing:
+                return
+
+    def _convert_batch(self, request_list):
+        """Convert the cases of all requests in the micro-batch at once and hand each request its own outputs."""
+        try:
+            output_list = self._convert_cases(list(chain.from_iterable(codes_per_case_list for codes_per_case_list, _ in request_list)))
+        except Exception as error:  # noqa: BLE001
+            # Hand the error to every request of the micro-batch rather than stopping the background thread
+            for _, future in request_list:
+                future.set_exception(error)
+            return
+        start = 0
+        for codes_per_case_list, future in request_list:
+            future.set_result(output_list[start:start + len(codes_per_case_list)])
+            start += len(codes_per_case_list)
+
+
+class ConversionServer(ThreadingHTTPServer):
+    """HTTP server that converts the cases of JSON requests with the resident model of a session."""
+    daemon_threads = True
+    # Listen backlog of connections waiting to be accepted. The default of 5 resets the connections of concurrent clients
+    # beyond it before their requests can join a micro-batch.
+    request_queue_size = 1024
+
+    def __init__(self, address, args, session, batcher):
+        super().__init__(address, ConversionRequestHandler)
+        self.args = args
+        self.session = session
+        self.batcher = batcher
+        self.output_column_list = converter.output_column_names(args.model, args.no_iss, args.mais, args.max_sev_per_chapter)
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle conversion requests.
+
+    POST /convert with a JSON body of {"cases": [{"patient_id": "1", "codes": ["S72.001A", ...]}, ...]} returns
+    {"results": [{"patient_id": "1", "iss": 9, ...}, ...]} with the selected output columns of each case, where NaN
+    outputs are null. Replacements made for unknown codes in the closest mode are returned under "replacements".
+    GET /health reports the served model.
+    """
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': f'Unknown path "{self.path}".'})
+            return
+        self.send_json(200, {'status': 'ok', 'model': self.server.args.model})
+
+    def do_POST(self):
+        if self.path != '/convert':
+            self.send_json(404, {'error': f'Unknown path "{self.path}".'})
+            return
+        args = self.server.args
+        try:
+            request_dict = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.send_json(400, {'error': 'Request body is not valid JSON.'})
+            return
+
+        # Import the request cases, keeping only the trauma codes of each case
+        patient_ids, codes_per_case_setlist = request_to_cases(request_dict)
+        # If patient_ids is a string, there was an error in the request data
+        if isinstance(patient_ids, str):
+            self.send_json(400, {'error': patient_ids})
+            return
+        if not patient_ids:
+            self.send_json(200, {'results': []})
+            return
+
+        # Preprocess the codes and handle unknown codes as the command line conversion would
+        codes_per_case_list, unrecognized_codes = self.server.session.preprocess_data(codes_per_case_setlist, args.unknown_mode)
+        if isinstance(codes_per_case_list, str):
+            self.send_json(400, {'error': codes_per_case_list})
+            return
+        response_dict = {}
+        if unrecognized_codes:
+            if args.unknown_mode == 'fail':
+                self.send_json(422, {'error': 'The models were not developed using some of the ICD-10 codes.',
+                                     'unrecognized_codes': unrecognized_codes})
+                return
+            elif args.unknown_mode == 'ignore':
+                self.send_json(422, {'error': 'Some cases did not contain any codes to convert after ignoring untrained codes.',
+                                     'patient_ids': [patient_ids[idx] for idx in unrecognized_codes]})
+                return
+            response_dict['replacements'] = unrecognized_codes
+
+        # Wait for the micro-batch holding the cases to be converted
+        try:
+            output_list = self.server.batcher.submit(codes_per_case_list).result()
+        except Exception as error:  # noqa: BLE001
+            # Report the error of the conversion to the client, keeping the server running
+            self.send_json(500, {'error': str(error)})
+            return
+        response_dict['results'] = [
+            dict(patient_id=patient_id, **output_to_columns(output, self.server.output_column_list))
+            for patient_id, output in zip(patient_ids, output_list)
+        ]
+        self.send_json(200, response_dict)
+
+    def send_json(self, status, response_dict):
+        response_body = json.dumps(response_dict).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, format, *args):
+        print_updates(f'{self.address_string()} -- {format % args}')
+
+
+def request_to_cases(request_dict) -> tuple[list | str, list | None]:
+    """
+    Split the cases of a conversion request into patient IDs and trauma codes.
+
+    Args:
+        request_dict: Decoded JSON body of the request.
+
+    Returns:
+        patient_ids (list | str): List of the patient/case IDs or an error string.
+        codes_per_case_setlist (list | None): List of sets that contains the ICD-10 codes for a specific case.
+    """
+    if not isinstance(request_dict, dict) or not isinstance(request_dict.get('cases'), list):
+        return 'Request must be a JSON object with a "cases" list.', None
+    patient_ids = []
+    codes_per_case_setlist = []
+    for case_dict in request_dict['cases']:
+        if not isinstance(case_dict, dict) or 'patient_id' not in case_dict or not isinstance(case_dict.get('codes'), list):
+            return 'Each case must be a JSON object with a "patient_id" and a "codes" list.', None
+        s_and_t_only_codes_list = [code.strip() for code in map(str, case_dict['codes']) if code.strip()[:1].upper() in ['S', 'T']]
+        if not s_and_t_only_codes_list:
+            return f'Case with ID#{case_dict["patient_id"]} does not contain any trauma (S00-T88) ICD-10 codes.', None
+        patient_ids.append(str(case_dict['patient_id']))
+        codes_per_case_setlist.append(set(s_and_t_only_codes_list))
+
+    # Confirm that every case of the request can be told apart in the results
+    if len(patient_ids) != len(set(patient_ids)):
+        return 'Duplicate patient IDs were found in the request.', None
+
+    return patient_ids, codes_per_case_setlist
+
+
+def output_to_columns(output: str, output_column_list: list) -> dict:
+    """Split a post-processed output string into its named output columns, with NaN outputs as None."""
+    if output == 'NaN':
+        return dict.fromkeys(output_column_list)
+    return {column: None if value == 'NaN' else int(value) for column, value in zip(output_column_list, output.split(','))}
+
+
+def main(args):
+    """Keep the selected model loaded and serve conversion requests until interrupted."""
+    session = no_gui.build_session(args, show_progress=False)
+    if session.metrics is not None:
+        session.metrics.info.update(unknown_mode=args.unknown_mode, model=args.model, precision=args.precision, workers=args.workers,
+                                    server=True)
+    print_updates(f'Loading {args.model}......')
+    session.get_model(args.model)
+
+    if args.workers > 1:
+        print_updates(f'Starting {args.workers} worker processes......')
+        with ShardedConverter(args.workers, args.model, args.no_iss, args.mais, args.max_sev_per_chapter, **no_gui.session_kwargs(args)) as pool:
+            serve(args, session, pool)
+    else:
+        serve(args, session)
+
+    no_gui.write_metrics(args, session)
+
+
+def serve(args, session, pool=None):
+    """Serve conversion requests, converting the cases of concurrent requests together in micro-batches."""
+    batcher = MicroBatcher(lambda codes_per_case_list: no_gui.convert_cases(args, session, codes_per_case_list, pool, verbose=False),
+                           args.max_batch_size, args.max_wait_ms)
+    server = ConversionServer((args.host, args.port), args, session, batcher)
+    print_updates(f'Serving {args.model} conversions at http://{args.host}:{server.server_port}/convert. Press Ctrl+C to stop......')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print_updates('Stopping server......')
+    finally:
+        server.server_close()
+        batcher.close()
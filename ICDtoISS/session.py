@@ -0,0 +1,209 @@
+from collections import OrderedDict
+from contextlib import nullcontext
+from threading import RLock
+from time import monotonic
+
+import numpy as np
+
+import converter
+import helper
+from cache import ResultCache
+from metrics import PipelineMetrics
+
+
+class ConverterSession:
+    """
+    Long-lived conversion session that keeps the lookup tables and conversion models resident between conversions.
+
+    The lookup tables are memory mapped once on first use. Each of the four models is lazily loaded on first use and
+    kept resident until it is evicted by the configured eviction policy:
+        - max_resident_models: Keep at most this many models loaded, evicting the least recently used model first.
+        - model_idle_timeout: Evict any model that has not been used for this many seconds.
+    Leaving either option as None disables that part of the policy.
+
+    NMT translators are created with the session's inter_threads and intra_threads settings and translate in batches of
+    at most nmt_max_batch_size cases, submitted asynchronously if nmt_asynchronous is set. FFNNs run on batches of
+    ffnn_batch_size cases using the selected ffnn_inference mode, run by PyTorch or, if ffnn_backend is 'numpy', by NumPy
+    from the exported model weights without importing torch. Models run at the selected precision, with 'bfloat16' and
+    'int8' quantizing torch FFNNs and 'int8' and 'int8_float32' setting the compute type of NMT translators. A console
+    progress bar is shown during conversion if show_progress is set. If a result_cache is given, cases already converted
+    with the same codes, model, and output options reuse their cached outputs rather than being converted again. If
+    metrics are given, every pipeline step is measured as a stage of the metrics, with convert_data run under the
+    metrics profiler if it has one.
+    """
+
+    def __init__(self, max_resident_models: int | None = None, model_idle_timeout: float | None = None,
+                 inter_threads: int = 1, intra_threads: int = 0, nmt_max_batch_size: int = 64, nmt_asynchronous: bool = False,
+                 ffnn_batch_size: int = 64, ffnn_inference: str = 'sparse', ffnn_backend: str = 'torch', precision: str = 'float32',
+                 show_progress: bool = True,
+                 result_cache: ResultCache | None = None, metrics: PipelineMetrics | None = None):
+        if max_resident_models is not None and max_resident_models < 1:
+            raise ValueError('max_resident_models must be at least 1 or None.')
+        self.max_resident_models = max_resident_models
+        self.model_idle_timeout = model_idle_timeout
+        self.inter_threads = inter_threads
+        self.intra_threads = intra_threads
+        self.nmt_max_batch_size = nmt_max_batch_size
+        self.nmt_asynchronous = nmt_asynchronous
+        self.ffnn_batch_size = ffnn_batch_size
+        self.ffnn_inference = ffnn_inference
+        self.ffnn_backend = ffnn_backend
+        self.precision = precision
+        self.show_progress = show_progress
+        self.result_cache = result_cache
+        self.metrics = metrics
+
+        self._lock = RLock()
+        self._icd10_code_index = None
+        self._iss_by_dummy = None
+        self._ais_rcs_code_index = None
+        # Ordered from least to most recently used, with each value being a (model, last used time) pair
+        self._models = OrderedDict()
+
+    @property
+    def icd10_code_index(self) -> helper.CodeIndex:
+        """Index of all known ICD-10 codes and their dummy variables, memory mapped on first access."""
+        with self._lock:
+            if self._icd10_code_index is None:
+                self._icd10_code_index = converter.load_icd10_code_index()
+            return self._icd10_code_index
+
+    @property
+    def iss_by_dummy(self) -> np.ndarray:
+        """ISS score of each direct dummy variable, memory mapped on first access."""
+        with self._lock:
+            if self._iss_by_dummy is None:
+                self._iss_by_dummy = converter.load_iss_by_dummy()
+            return self._iss_by_dummy
+
+    @property
+    def ais_rcs_code_index(self) -> helper.CodeIndex:
+        """Index of all RCS codes and their indirect dummy variables, memory mapped on first access."""
+        with self._lock:
+            if self._ais_rcs_code_index is None:
+                self._ais_rcs_code_index = converter.load_ais_rcs_code_index()
+            return self._ais_rcs_code_index
+
+    @property
+    def resident_models(self) -> list:
+        """Model types currently loaded, ordered from least to most recently used."""
+        with self._lock:
+            return list(self._models)
+
+    def get_model(self, model_type: str):
+        """Return the selected model, loading it if it is not already resident and applying the eviction policy."""
+        with self._lock:
+            self._evict_idle_models()
+            if model_type in self._models:
+                model = self._models.pop(model_type)[0]
+            else:
+                with self.stage('load_model'):
+                    model = converter.load_model(model_type, self.inter_threads, self.intra_threads, self.ffnn_backend, self.precision)
+            self._models[model_type] = (model, monotonic())
+            # Evict least recently used models until within the resident model limit
+            if self.max_resident_models is not None:
+                while len(self._models) > self.max_resident_models:
+                    self._models.popitem(last=False)
+            return model
+
+    def evict_model(self, model_type: str) -> bool:
+        """Unload the selected model if resident. Returns whether a model was evicted."""
+        with self._lock:
+            return self._models.pop(model_type, None) is not None
+
+    def clear(self):
+        """Unload all models and lookup tables."""
+        with self._lock:
+            self._models.clear()
+            self._icd10_code_index = None
+            self._iss_by_dummy = None
+            self._ais_rcs_code_index = None
+
+    def _evict_idle_models(self):
+        """Unload any model that has not been used within the idle timeout."""
+        if self.model_idle_timeout is None:
+            return
+        now = monotonic()
+        for model_type, (_, last_used) in list(self._models.items()):
+            if now - last_used > self.model_idle_timeout:
+                del self._models[model_type]
+
+    def stage(self, name: str, cases: int = 0, profile: bool = False):
+        """Measure a stage with the session metrics if given, yielding a dictionary for the stage's own counts."""
+        if self.metrics is None:
+            return nullcontext({})
+        return self.metrics.stage(name, cases, profile)
+
+    # Conversion pipeline steps using the resident resources. See the matching converter functions for details.
+    def import_data(self, input_type: str, filepath: str) -> tuple[list | str, list | None]:
+        with self.stage('import_data') as stage_metrics:
+            patient_ids, codes_per_case_setlist = converter.import_data(input_type, filepath)
+            if codes_per_case_setlist is not None:
+                stage_metrics['cases'] = len(codes_per_case_setlist)
+        return patient_ids, codes_per_case_setlist
+
+    def iter_import_data(self, input_type: str, filepath: str, chunk_size: int):
+        case_chunks = converter.iter_import_data(input_type, filepath, chunk_size)
+        while True:
+            # Measure the reading of each chunk separately from the conversion of the previous chunk
+            with self.stage('import_data') as stage_metrics:
+                patient_ids, codes_per_case_setlist = next(case_chunks, (None, None))
+                if codes_per_case_setlist is not None:
+                    stage_metrics['cases'] = len(codes_per_case_setlist)
+            if patient_ids is None:
+                return
+            yield patient_ids, codes_per_case_setlist
+
+    def preprocess_data(self, codes_per_case_setlist: list, unknown_mode: str) -> tuple[list | str, dict | list | None]:
+        with self.stage('preprocess_data', len(codes_per_case_setlist)) as stage_metrics:
+            codes_per_case_list, unrecognized_codes = converter.preprocess_data(
+                codes_per_case_setlist, unknown_mode, self.icd10_code_index)
+            if self.metrics is not None and not isinstance(codes_per_case_list, str):
+                # Count the distinct unknown codes replaced or found, or the unknown codes dropped from the cases
+                match unknown_mode:
+                    case 'closest':
+                        stage_metrics['unknown_codes_replaced'] = len(unrecognized_codes)
+                    case 'ignore':
+                        stage_metrics['unknown_codes_ignored'] = sum(map(len, codes_per_case_setlist)) - sum(map(len, codes_per_case_list))
+                        stage_metrics['cases_without_known_codes'] = len(unrecognized_codes or [])
+                    case 'fail':
+                        stage_metrics['unknown_codes_found'] = len(unrecognized_codes)
+        return codes_per_case_list, unrecognized_codes
+
+    def formatting_data(self, codes_per_case_list: list, model_type: str) -> helper.SparseCodeMatrix | list | str:
+        with self.stage('formatting_data', len(codes_per_case_list)):
+            return converter.formatting_data(codes_per_case_list, model_type, self.icd10_code_index, self.ffnn_batch_size)
+
+    def convert_data(self, formatted_input_data: helper.SparseCodeMatrix | list, model_type: str, progress_callback=None,
+                     score_callback=None) -> list:
+        model = self.get_model(model_type)
+        num_cases = formatted_input_data.num_cases if isinstance(formatted_input_data, helper.SparseCodeMatrix) else len(formatted_input_data)
+        with self.stage('convert_data', num_cases, profile=True) as stage_metrics:
+            return converter.convert_data(formatted_input_data, model_type, model, self.nmt_max_batch_size, self.nmt_asynchronous,
+                                          self.ffnn_inference, self.show_progress, stage_metrics if self.metrics is not None else None,
+                                          self.ffnn_backend, progress_callback=progress_callback, score_callback=score_callback)
+
+    def postprocess_data(self, conversion_output: list, model_type: str, no_iss_bool: bool, mais_bool: bool,
+                         max_severity_chapter_bool: bool) -> list:
+        with self.stage('postprocess_data', len(conversion_output)):
+            if model_type in ['direct_FFNN', 'direct_NMT']:
+                return converter.postprocess_data(conversion_output, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool,
+                                                  iss_by_dummy=self.iss_by_dummy)
+            return converter.postprocess_data(conversion_output, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool,
+                                              ais_rcs_code_index=self.ais_rcs_code_index)
+
+    def output_iss_results(self, patient_ids, output_list, file_path, model_type, no_iss_bool, mais_bool,
+                           max_severity_chapter_bool, append=False, output_format='csv', compression=None, output_file_path=None) -> str:
+        with self.stage('output_iss_results', len(patient_ids)):
+            return converter.output_iss_results(patient_ids, output_list, file_path, model_type, no_iss_bool, mais_bool,
+                                                max_severity_chapter_bool, append, output_format, compression, output_file_path)
+
+    def open_result_writer(self, file_path, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool, output_format='csv',
+                           compression=None, output_file_path=None, append=False):
+        return converter.open_result_writer(file_path, model_type, no_iss_bool, mais_bool, max_severity_chapter_bool, output_format,
+                                            append, compression, output_file_path)
+
+    def write_results(self, writer, patient_ids, output_list):
+        """Write the outputs of cases with a writer opened by open_result_writer, measured as an output_iss_results stage."""
+        with self.stage('output_iss_results', len(patient_ids)):
+            writer.write(patient_ids, output_list)
@@ -0,0 +1,160 @@
+from os import fstat, fsync
+
+import numpy as np
+
+import helper
+
+# Output file formats and the extension of their output files
+OUTPUT_FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+# Number of CSV lines joined into one block of text per write
+WRITE_BLOCK_ROWS = 65536
+
+
+def open_result_writer(output_file_path: str, output_column_list: list, output_format: str = 'csv', append: bool = False,
+                       compression: str | None = None):
+    """
+    Open a writer of conversion outputs in the given output format.
+
+    Args:
+        output_file_path (str): Path to the output file, or '-' to write CSV output to standard output.
+        output_column_list (list): Names of the output columns of each case, written after the patient_id column.
+        output_format (str): Case representing the output file format. Either 'csv', 'parquet', or 'feather'.
+        append (bool): Boolean representing whether the outputs should be appended to an existing CSV output file rather
+        than overwriting it. Only for CSV output.
+        compression (str | None): Compression of the output, either 'gzip' or 'zstd', or None for no compression. CSV
+        output is compressed as a stream, while Parquet and Feather outputs are compressed with their own codecs.
+
+    Returns:
+        CsvResultWriter | ArrowResultWriter: Writer whose write method writes the outputs of a list of cases.
+    """
+    match output_format:
+        case 'csv':
+            return CsvResultWriter(output_file_path, output_column_list, append, compression)
+        case 'parquet' | 'feather':
+            if append:
+                raise ValueError(f'Cannot append to an existing {output_format} output file.')
+            if output_file_path == helper.STDOUT_PATH:
+                raise ValueError('Only CSV output can be written to standard output.')
+            if output_format == 'feather' and compression == 'gzip':
+                raise ValueError('Feather output can only be compressed with zstd.')
+            return ArrowResultWriter(output_file_path, output_column_list, output_format, compression)
+        case _:
+            raise ValueError(f'Incompatible output format "{output_format}" was given.')
+
+
+class CsvResultWriter:
+    """
+    Writer of conversion outputs as comma separated lines.
+
+    Each output is written as the patient ID followed by the comma separated output string of the case, with a NaN for
+    every output column if the output of the case is 'NaN'. The lines of each write are joined into blocks of
+    WRITE_BLOCK_ROWS lines that are written at once through a large buffer, compressed as a stream if a compression is
+    given. The header is written when the file is opened unless the outputs are appended to an existing file.
+    """
+
+    def __init__(self, path: str, output_column_list: list, append: bool = False, compression: str | None = None):
+        self.path = path
+        self._nan_string = ','.join(['NaN'] * len(output_column_list))
+        self._output_file = helper.open_text_file(path, 'a' if append else 'w', compression)
+        if not append:
+            self._output_file.write(','.join(['patient_id'] + output_column_list) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, patient_ids: list, output_list: list):
+        """Write the outputs of a list of cases."""
+        output_array = np.array(output_list, dtype=object)
+        output_array[output_array == 'NaN'] = self._nan_string
+        for start in range(0, len(output_array), WRITE_BLOCK_ROWS):
+            block_lines = map(','.join, zip(patient_ids[start:start + WRITE_BLOCK_ROWS], output_array[start:start + WRITE_BLOCK_ROWS].tolist()))
+            self._output_file.write('\n'.join(block_lines) + '\n')
+
+    def flush(self) -> int:
+        """
+        Flush the written outputs to disk and return the size of the output file in bytes. Only for uncompressed output
+        files, since flushing a compressed stream changes the bytes of the rest of the file.
+        """
+        self._output_file.flush()
+        fsync(self._output_file.fileno())
+        return fstat(self._output_file.fileno()).st_size
+
+    def close(self):
+        """Flush and close the output file."""
+        self._output_file.close()
+
+
+class ArrowResultWriter:
+    """
+    Writer of conversion outputs as a Parquet or Arrow IPC (Feather) file with typed columns.
+
+    The patient_id column is a string column and every output column is an int16 column, with the outputs of cases whose
+    output is 'NaN' and any NaN output values written as nulls. Each call to write adds its cases to the file as new Parquet row groups or Arrow
+    record batches, so the outputs of a chunked conversion are written as each chunk is converted. The file is only
+    complete once the writer is closed. Parquet files are compressed with snappy unless another compression is given,
+    while Feather files are uncompressed unless zstd is given. Needs pyarrow.
+    """
+
+    def __init__(self, path: str, output_column_list: list, output_format: str = 'parquet', compression: str | None = None):
+        import pyarrow as pa
+
+        self.path = path
+        self.output_column_list = output_column_list
+        self.schema = pa.schema([('patient_id', pa.string())] + [(column, pa.int16()) for column in output_column_list])
+        if output_format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression=compression or 'snappy')
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, patient_ids: list, output_list: list):
+        """Write the outputs of a list of cases."""
+        import pyarrow as pa
+
+        output_matrix, nan_mask = parse_outputs(output_list, len(self.output_column_list))
+        columns = [pa.array(patient_ids, pa.string())] + [pa.array(column, pa.int16(), mask=column_nan_mask)
+                                                          for column, column_nan_mask in zip(output_matrix.T, nan_mask.T)]
+        self._writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        """Write the file footer and close the output file."""
+        self._writer.close()
+
+
+def parse_outputs(output_list: list, num_columns: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Parse comma separated output strings into a matrix of integer outputs.
+
+    Args:
+        output_list (list): Output string of each case, or 'NaN' for cases without an output. Single output values may
+        also be 'NaN', such as in the merged outputs of several models.
+        num_columns (int): Number of output columns in each output string.
+
+    Returns:
+        output_matrix (np.ndarray): Matrix with a row of int16 outputs for each case. NaN outputs are zeros.
+        nan_mask (np.ndarray): Boolean matrix of which outputs are NaN.
+    """
+    output_array = np.array(output_list, dtype=object)
+    case_nan_mask = output_array == 'NaN'
+    output_matrix = np.zeros((len(output_list), num_columns), dtype=np.int16)
+    nan_mask = np.repeat(case_nan_mask[:, np.newaxis], num_columns, axis=1)
+    if not case_nan_mask.all():
+        # Join every output into one string so that all of the values are parsed at once. Values are only parsed as the
+        # slower floats if single NaN values need to be parsed.
+        output_string = ','.join(output_array[~case_nan_mask])
+        if 'NaN' in output_string:
+            value_matrix = np.fromstring(output_string, dtype=np.float64, sep=',').reshape(-1, num_columns)
+            nan_mask[~case_nan_mask] = np.isnan(value_matrix)
+            output_matrix[~case_nan_mask] = np.nan_to_num(value_matrix).astype(np.int16)
+        else:
+            output_matrix[~case_nan_mask] = np.fromstring(output_string, dtype=np.int16, sep=',').reshape(-1, num_columns)
+    return output_matrix, nan_mask
@@ -0,0 +1,125 @@
+"""
+Check the cold start time of command line conversions against a startup-time budget.
+
+For each model, the command line application converts the 16-code example file in a fresh interpreter, timing the
+whole process from interpreter start to exit. Each run also checks that only the modules the model needs were imported:
+GUI modules are never allowed, NMT models and FFNN models run by the NumPy backend must not import torch, and FFNN models
+must not import ctranslate2. The best
+time of the repeated runs is compared with the budget of the model's backend. Exits with a non-zero status if any model
+is over budget or imports a disallowed module.
+
+Run from the repository root:
+    python benchmarks/check_startup.py --ffnn_budget_ms 4000 --nmt_budget_ms 1500
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent / 'ICDtoISS'
+EXAMPLE_FILE = Path(__file__).resolve().parent.parent / 'example_data' / 'long_format_sample_16_codes.csv'
+MODEL_TYPES = ['direct_FFNN', 'indirect_FFNN', 'direct_NMT', 'indirect_NMT']
+GUI_MODULES = ['tkinter', 'customtkinter', 'CTkToolTip', 'CTkMessagebox']
+
+# Run the application as `python ICDtoISS` would and report the heavy modules that were imported
+RUN_APPLICATION = """
+import json, runpy, sys
+sys.argv = ['ICDtoISS'] + sys.argv[2:]
+try:
+    runpy.run_path({package_dir!r}, run_name='__main__')
+finally:
+    sys.stderr.write('IMPORTED_MODULES=' + json.dumps(sorted(set(sys.modules) & set({watched_modules!r}))) + '\\n')
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs='+', default=MODEL_TYPES, choices=MODEL_TYPES, help="Models to check.")
+    parser.add_argument("--ffnn_budget_ms", type=float, default=4000, help="Startup-time budget of FFNN models in milliseconds.")
+    parser.add_argument("--nmt_budget_ms", type=float, default=1500, help="Startup-time budget of NMT models in milliseconds.")
+    parser.add_argument("--ffnn_backend", default='torch', choices=['torch', 'numpy'], help="Framework that runs the FFNN models.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per model. The fastest run is compared with the budget.")
+    parser.add_argument("--importtime", action='store_true', help="Also print the slowest imports of each model using -X importtime.")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = Path(temp_dir) / EXAMPLE_FILE.name
+        shutil.copyfile(EXAMPLE_FILE, input_path)
+        for model_type in args.models:
+            is_ffnn = model_type.endswith('FFNN')
+            budget_ms = args.ffnn_budget_ms if is_ffnn else args.nmt_budget_ms
+            disallowed_modules = GUI_MODULES + (['ctranslate2'] if is_ffnn else ['torch'])
+            if is_ffnn and args.ffnn_backend == 'numpy':
+                disallowed_modules.append('torch')
+            backend_args = ['--ffnn_backend', args.ffnn_backend] if is_ffnn else []
+
+            run_times_ms = []
+            for _ in range(args.repeat):
+                run_time_ms, imported_modules, stderr = run_application(model_type, input_path, disallowed_modules, backend_args)
+                if run_time_ms is None:
+                    break
+                run_times_ms.append(run_time_ms)
+            if run_time_ms is None:
+                print(f'{model_type}: FAILED TO RUN\n{stderr}')
+                failures.append(model_type)
+                continue
+            startup_ms = min(run_times_ms)
+            unexpected_modules = [module for module in imported_modules if module in disallowed_modules]
+
+            status = 'OK'
+            if startup_ms > budget_ms or unexpected_modules:
+                status = 'OVER BUDGET' if startup_ms > budget_ms else 'UNEXPECTED IMPORTS'
+                failures.append(model_type)
+            print(f'{model_type}: {startup_ms:.0f} ms (budget {budget_ms:.0f} ms), imported {", ".join(imported_modules) or "no heavy modules"}'
+                  f'{" including disallowed " + ", ".join(unexpected_modules) if unexpected_modules else ""} -- {status}')
+
+            if args.importtime:
+                print_slowest_imports(model_type, input_path, backend_args)
+
+    if failures:
+        sys.exit(f'Startup check failed for: {", ".join(failures)}')
+
+
+def application_command(model_type, input_path, watched_modules, backend_args, python_options=()):
+    """Build the command that converts the input file with the model in a fresh interpreter."""
+    code = RUN_APPLICATION.format(package_dir=str(PACKAGE_DIR), watched_modules=watched_modules)
+    return [sys.executable, *python_options, '-c', code, '-', '-ng', '-f', str(input_path), '-m', model_type, *backend_args]
+
+
+def run_application(model_type, input_path, disallowed_modules, backend_args):
+    """Run one conversion, returning its wall time in milliseconds (None if it failed), the imported heavy modules, and stderr."""
+    watched_modules = sorted(set(disallowed_modules) | {'torch', 'ctranslate2', 'pandas'})
+    start = perf_counter()
+    completed = subprocess.run(application_command(model_type, input_path, watched_modules, backend_args), capture_output=True, text=True,
+                               check=False)
+    run_time_ms = (perf_counter() - start) * 1000
+    imported_modules = []
+    for line in completed.stderr.splitlines():
+        if line.startswith('IMPORTED_MODULES='):
+            imported_modules = json.loads(line.removeprefix('IMPORTED_MODULES='))
+    return run_time_ms if completed.returncode == 0 else None, imported_modules, completed.stderr
+
+
+def print_slowest_imports(model_type, input_path, backend_args, count=10):
+    """Print the imports with the largest cumulative import time during a conversion with the model."""
+    completed = subprocess.run(application_command(model_type, input_path, [], backend_args, ['-X', 'importtime']), capture_output=True,
+                               text=True, check=False)
+    import_times = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative_us, module = line.removeprefix('import time:').split('|')
+        # Only keep top level imports, which are not indented, since their cumulative times include their submodules
+        if cumulative_us.strip().isdigit() and not module.startswith('  '):
+            import_times.append((int(cumulative_us), module.strip()))
+    for cumulative_us, module in sorted(import_times, reverse=True)[:count]:
+        print(f'    {cumulative_us / 1000:8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
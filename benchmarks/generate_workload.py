@@ -0,0 +1,91 @@
+"""
+Generate synthetic long format and wide format trauma code inputs for benchmarking.
+
+Codes are sampled from the known ICD-10 codes of the models with a long tailed popularity, so that common code sets
+repeat across cases like they do in registry extracts. A configurable share of the codes is replaced with unknown codes
+and a share of the cases get extra non-trauma codes that are filtered out on import.
+
+Run from the repository root:
+    python benchmarks/generate_workload.py --cases 10000 100000 1000000
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'ICDtoISS' / 'data'
+NON_TRAUMA_CODES = ['I10', 'E11.9', 'F17.210', 'J45.909', 'K21.9', 'N39.0', 'R51', 'Z23', 'Y92.009', 'V43.52XA', 'W19.XXXA']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, nargs='+', default=[10000, 100000, 1000000], help="Number of cases of each workload.")
+    parser.add_argument("--unknown_rate", type=float, default=0.02, help="Share of trauma codes replaced with codes unknown to the models.")
+    parser.add_argument("--non_trauma_rate", type=float, default=0.1, help="Share of cases that also contain non-trauma codes.")
+    parser.add_argument("--mean_codes", type=float, default=2.5, help="Mean number of trauma codes per case.")
+    parser.add_argument("--popularity_exponent", type=float, default=1.1, help="Zipf exponent of the popularity of the codes."
+                        " Larger values make common codes and repeated code sets more frequent.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator.")
+    parser.add_argument("--output_dir", default=str(Path(__file__).resolve().parent / 'workloads'), help="Folder the inputs are written to.")
+    args = parser.parse_args()
+
+    # Only trauma codes are sampled since the other known codes are filtered out on import
+    known_codes_array = np.array([code for code in np.char.decode(np.load(DATA_DIR / 'icd10_codes.npy'), 'ascii').tolist() if code[0] in ['S', 'T']],
+                                 dtype=object)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for num_cases in args.cases:
+        rng = np.random.default_rng(args.seed)
+        patient_ids, codes_per_case_list = generate_cases(rng, known_codes_array, num_cases, args.mean_codes,
+                                                          args.popularity_exponent, args.unknown_rate, args.non_trauma_rate)
+        long_file_path = output_dir / f'workload_{num_cases}_long.csv'
+        wide_file_path = output_dir / f'workload_{num_cases}_wide.csv'
+        write_long_format(long_file_path, patient_ids, codes_per_case_list)
+        write_wide_format(wide_file_path, patient_ids, codes_per_case_list)
+        print(f'Wrote {num_cases:,} cases to {long_file_path} and {wide_file_path}')
+
+
+def generate_cases(rng, known_codes_array, num_cases, mean_codes, popularity_exponent, unknown_rate, non_trauma_rate):
+    """Generate the patient IDs and the codes of each case."""
+    # Shuffle the known codes and give the code of each rank a Zipf popularity
+    code_popularity = 1 / np.arange(1, len(known_codes_array) + 1) ** popularity_exponent
+    popular_codes_array = known_codes_array[rng.permutation(len(known_codes_array))]
+
+    # Draw the number of trauma codes of each case from a geometric distribution, which gives every case at least one
+    codes_per_case_count = np.minimum(rng.geometric(1 / mean_codes, size=num_cases), 20)
+    codes_array = rng.choice(popular_codes_array, size=codes_per_case_count.sum(), p=code_popularity / code_popularity.sum())
+
+    # Replace a share of the codes with unknown codes by changing or dropping their last character
+    known_codes_set = set(known_codes_array)
+    for code_idx in np.flatnonzero(rng.random(len(codes_array)) < unknown_rate):
+        code = codes_array[code_idx]
+        for unknown_code in (code[:-1] + suffix for suffix in ['Z', 'Y', '9', 'XZ', '']):
+            if unknown_code not in known_codes_set and len(unknown_code) > 3:
+                codes_array[code_idx] = unknown_code
+                break
+
+    # Split the codes into cases and add non-trauma codes to a share of the cases
+    codes_per_case_list = [case_codes_array.tolist() for case_codes_array in np.split(codes_array, np.cumsum(codes_per_case_count)[:-1])]
+    for case_idx in np.flatnonzero(rng.random(num_cases) < non_trauma_rate):
+        codes_per_case_list[case_idx].insert(int(rng.integers(len(codes_per_case_list[case_idx]) + 1)), rng.choice(NON_TRAUMA_CODES))
+
+    patient_ids = [str(patient_id) for patient_id in range(190000000000, 190000000000 + num_cases)]
+    return patient_ids, codes_per_case_list
+
+
+def write_long_format(file_path, patient_ids, codes_per_case_list):
+    """Write one code per row, with the rows of each case next to each other."""
+    with open(file_path, 'w') as output_file:
+        for patient_id, code_list in zip(patient_ids, codes_per_case_list):
+            output_file.writelines(f'{patient_id},{code}\n' for code in code_list)
+
+
+def write_wide_format(file_path, patient_ids, codes_per_case_list):
+    """Write all the codes of a case on one row after its patient ID."""
+    with open(file_path, 'w') as output_file:
+        output_file.writelines(f'{patient_id},{",".join(code_list)}\n' for patient_id, code_list in zip(patient_ids, codes_per_case_list))
+
+
+if __name__ == '__main__':
+    main()
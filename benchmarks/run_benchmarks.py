@@ -0,0 +1,171 @@
+"""
+Time every stage of the conversion pipeline for each workload, input format, model, and unknown code mode.
+
+Each stage of converter is timed separately through a ConverterSession with the lookup tables and the model
+already loaded, with the time to load each model recorded once. Cases that have no known codes left in the ignore and
+fail modes are still converted rather than aborting the run. Results are written as JSON for comparison between
+versions, and a previous results file can be given to print the speedup of every stage against it.
+
+Run from the repository root after generating the workloads:
+    python benchmarks/generate_workload.py --cases 10000 100000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<previous results>.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from importlib.util import find_spec
+from pathlib import Path
+from time import perf_counter
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+PACKAGE_DIR = BENCHMARKS_DIR.parent / 'ICDtoISS'
+sys.path.insert(0, str(PACKAGE_DIR))
+
+STAGES = ['import_data', 'preprocess_data', 'formatting_data', 'convert_data', 'postprocess_data', 'output_iss_results']
+MODEL_TYPES = ['direct_FFNN', 'indirect_FFNN', 'direct_NMT', 'indirect_NMT']
+UNKNOWN_MODES = ['closest', 'ignore', 'fail']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", nargs='+', help="Workload files ending in _long.csv or _wide.csv. Defaults to every workload in"
+                        " benchmarks/workloads.")
+    parser.add_argument("--models", nargs='+', default=MODEL_TYPES, choices=MODEL_TYPES, help="Models to benchmark.")
+    parser.add_argument("--unknown_modes", nargs='+', default=UNKNOWN_MODES, choices=UNKNOWN_MODES, help="Unknown code modes to benchmark.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times each combination is run. The median time of each stage is kept.")
+    parser.add_argument("--ffnn_batch_size", type=int, default=1024, help="Number of cases per FFNN batch.")
+    parser.add_argument("--ffnn_backend", default='torch', choices=['torch', 'numpy'], help="Framework that runs the FFNN models.")
+    parser.add_argument("--nmt_batch_size", type=int, default=64, help="Maximum number of cases per NMT batch.")
+    parser.add_argument("--output", help="Path of the JSON results file. Defaults to a timestamped file in benchmarks/results.")
+    parser.add_argument("--compare", help="Previous JSON results file to compare the stage times against.")
+    args = parser.parse_args()
+
+    workload_path_list = [Path(workload) for workload in args.workloads] if args.workloads else \
+        sorted((BENCHMARKS_DIR / 'workloads').glob('workload_*.csv'), key=lambda path: (len(path.name), path.name))
+    if not workload_path_list:
+        raise ValueError('No workloads found. Generate them first with benchmarks/generate_workload.py.')
+
+    results = run_benchmarks(workload_path_list, args.models, args.unknown_modes, args.repeat, args.ffnn_batch_size, args.nmt_batch_size,
+                             args.ffnn_backend)
+
+    output_path = Path(args.output) if args.output else BENCHMARKS_DIR / 'results' / f'{datetime.now():%Y%m%d_%H%M%S}.json'
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'Results written to {output_path}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print_comparison(json.load(baseline_file), results)
+
+
+def run_benchmarks(workload_path_list, model_type_list, unknown_mode_list, repeat, ffnn_batch_size, nmt_batch_size, ffnn_backend='torch') -> dict:
+    """Run every combination of workload, model, and unknown code mode, returning the metadata and stage times."""
+    from session import ConverterSession
+
+    session = ConverterSession(ffnn_batch_size=ffnn_batch_size, nmt_max_batch_size=nmt_batch_size, ffnn_backend=ffnn_backend, show_progress=False)
+    # Load the lookup tables up front so that their load time is not counted in the first run
+    start = perf_counter()
+    for lookup_table in ['icd10_code_index', 'iss_by_dummy', 'ais_rcs_code_index']:
+        getattr(session, lookup_table)
+    results = {'metadata': dict(run_metadata(ffnn_batch_size, nmt_batch_size, repeat), ffnn_backend=ffnn_backend),
+               'lookup_load_seconds': perf_counter() - start, 'model_load_seconds': {}, 'runs': []}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for model_type in model_type_list:
+            start = perf_counter()
+            session.get_model(model_type)
+            results['model_load_seconds'][model_type] = perf_counter() - start
+            for workload_path in workload_path_list:
+                # Write the output files next to a copy of the workload in the temporary folder
+                input_path = Path(temp_dir) / workload_path.name
+                if not input_path.exists():
+                    shutil.copyfile(workload_path, input_path)
+                input_type = 'code_per_row' if workload_path.stem.endswith('_long') else 'case_per_row'
+                for unknown_mode in unknown_mode_list:
+                    stage_times_list = [time_stages(session, str(input_path), input_type, model_type, unknown_mode) for _ in range(repeat)]
+                    stage_times = {stage: sorted(times[stage] for times in stage_times_list)[len(stage_times_list) // 2] for stage in STAGES}
+                    run = {'workload': workload_path.name, 'input_type': input_type, 'model': model_type, 'unknown_mode': unknown_mode,
+                           'cases': stage_times_list[0]['cases'], 'stages': stage_times, 'total_seconds': sum(stage_times.values())}
+                    run['cases_per_second'] = run['cases'] / run['total_seconds']
+                    results['runs'].append(run)
+                    print(f'{workload_path.name} {model_type} {unknown_mode}: {run["total_seconds"]:.3f}s '
+                          f'({run["cases_per_second"]:,.0f} cases/s) ' + ' '.join(f'{stage}={stage_times[stage]:.3f}s' for stage in STAGES))
+    return results
+
+
+def time_stages(session, input_path, input_type, model_type, unknown_mode) -> dict:
+    """Run the conversion pipeline once, returning the time of every stage in seconds and the number of cases."""
+    stage_times = {}
+
+    start = perf_counter()
+    patient_ids, codes_per_case_setlist = session.import_data(input_type, input_path)
+    stage_times['import_data'] = perf_counter() - start
+    if isinstance(patient_ids, str):
+        raise ValueError(patient_ids)  # noqa: TRY004
+
+    start = perf_counter()
+    codes_per_case_list, _ = session.preprocess_data(codes_per_case_setlist, unknown_mode)
+    stage_times['preprocess_data'] = perf_counter() - start
+
+    start = perf_counter()
+    formatted_input_data = session.formatting_data(codes_per_case_list, model_type)
+    stage_times['formatting_data'] = perf_counter() - start
+
+    start = perf_counter()
+    conversion_output = session.convert_data(formatted_input_data, model_type)
+    stage_times['convert_data'] = perf_counter() - start
+
+    start = perf_counter()
+    output_list = session.postprocess_data(conversion_output, model_type, False, True, True)
+    stage_times['postprocess_data'] = perf_counter() - start
+
+    start = perf_counter()
+    session.output_iss_results(patient_ids, output_list, input_path, model_type, False, True, True)
+    stage_times['output_iss_results'] = perf_counter() - start
+
+    stage_times['cases'] = len(patient_ids)
+    return stage_times
+
+
+def run_metadata(ffnn_batch_size, nmt_batch_size, repeat) -> dict:
+    """Describe the code version, machine, and settings of the run so that results can be compared fairly."""
+    import numpy as np
+
+    # The numpy FFNN backend runs without torch, so only describe torch if it is installed
+    if find_spec('torch') is not None:
+        import torch
+        torch_version, cuda_available = torch.__version__, torch.cuda.is_available()
+    else:
+        torch_version, cuda_available = None, None
+
+    try:
+        git_commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_commit = None
+    return {'timestamp': datetime.now().isoformat(), 'git_commit': git_commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'torch': torch_version, 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'cuda': cuda_available, 'ffnn_batch_size': ffnn_batch_size, 'nmt_batch_size': nmt_batch_size, 'repeat': repeat}
+
+
+def print_comparison(baseline_results, results):
+    """Print the speedup of every stage over the matching run of the baseline results."""
+    baseline_run_dict = {(run['workload'], run['model'], run['unknown_mode']): run for run in baseline_results['runs']}
+    print(f'Speedup over {baseline_results["metadata"]["git_commit"]} (baseline time / new time):')
+    for run in results['runs']:
+        baseline_run = baseline_run_dict.get((run['workload'], run['model'], run['unknown_mode']))
+        if baseline_run is None:
+            continue
+        stage_speedups = ' '.join(f'{stage}={baseline_run["stages"][stage] / max(run["stages"][stage], 1e-9):.2f}x' for stage in STAGES)
+        print(f'{run["workload"]} {run["model"]} {run["unknown_mode"]}: '
+              f'total={baseline_run["total_seconds"] / run["total_seconds"]:.2f}x {stage_speedups}')
+
+
+if __name__ == '__main__':
+    main()
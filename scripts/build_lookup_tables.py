@@ -0,0 +1,45 @@
+"""
+Build the array-backed lookup tables in ICDtoISS/data from the pickled dictionaries.
+
+Each dictionary is written as NumPy arrays that are memory mapped at runtime:
+    - icd10_codes.npy and icd10_code_dummies.npy: Sorted fixed width ICD-10 codes and the FFNN dummy variable index of
+      each code.
+    - ais_rcs_codes.npy and ais_rcs_code_dummies.npy: Sorted fixed width AIS RCS triplets and the indirect dummy
+      variable index of each triplet.
+    - iss_by_dummy.npy: ISS score of each direct dummy variable index.
+
+Run from the repository root after any of the pickled dictionaries change:
+    python scripts/build_lookup_tables.py
+"""
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'ICDtoISS' / 'data'
+
+
+def main():
+    with open(DATA_DIR / 'icd10_to_dummy_dict.pickle', 'rb') as dict_serialized:
+        save_code_index(pickle.load(dict_serialized), 'icd10_codes.npy', 'icd10_code_dummies.npy')
+
+    with open(DATA_DIR / 'dummy_to_ais_rcs_dict.pickle', 'rb') as dict_serialized:
+        dummy_to_ais_rcs_dict = pickle.load(dict_serialized)
+    save_code_index({rcs: encoded_rcs for encoded_rcs, rcs in dummy_to_ais_rcs_dict.items()}, 'ais_rcs_codes.npy', 'ais_rcs_code_dummies.npy')
+
+    with open(DATA_DIR / 'dummy_to_iss_dict.pickle', 'rb') as dict_serialized:
+        dummy_to_iss_dict = pickle.load(dict_serialized)
+    if sorted(dummy_to_iss_dict) != list(range(len(dummy_to_iss_dict))):
+        raise ValueError('The direct dummy variables must be the integers from 0 to the number of ISS scores.')
+    np.save(DATA_DIR / 'iss_by_dummy.npy', np.array([int(dummy_to_iss_dict[encoded_int]) for encoded_int in range(len(dummy_to_iss_dict))], dtype=np.int16))
+
+
+def save_code_index(code_to_dummy_dict, codes_file_name, dummies_file_name):
+    """Save the codes of a dictionary as a sorted fixed width ASCII array and their dummy variables in the same order."""
+    sorted_codes = sorted(code_to_dummy_dict)
+    np.save(DATA_DIR / codes_file_name, np.array([code.encode('ascii') for code in sorted_codes], dtype='S'))
+    np.save(DATA_DIR / dummies_file_name, np.array([code_to_dummy_dict[code] for code in sorted_codes], dtype=np.int16))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""
+Export the weights of the FFNN models in ICDtoISS/data to .npz files used by the NumPy FFNN backend.
+
+Each array of the .npz file is named after its entry in the PyTorch state dictionary of the model. This is the only
+step of the NumPy backend that needs torch.
+
+Run from the repository root after any of the FFNN models change:
+    python scripts/export_ffnn_weights.py
+"""
+from pathlib import Path
+
+import numpy as np
+import torch
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'ICDtoISS' / 'data'
+FFNN_MODEL_FILES = {'direct_FF_model.tar': 'direct_FF_model.npz', 'indirect_FF_model.tar': 'indirect_FF_model.npz'}
+
+
+def main():
+    for model_file_name, weights_file_name in FFNN_MODEL_FILES.items():
+        state_dict = torch.load(DATA_DIR / model_file_name, map_location='cpu')
+        np.savez(DATA_DIR / weights_file_name, **{name: tensor.numpy() for name, tensor in state_dict.items()})
+        print(f'Exported {model_file_name} to {weights_file_name}')
+
+
+if __name__ == '__main__':
+    main()
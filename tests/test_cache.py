@@ -0,0 +1,72 @@
+import pytest
+
+import cache
+from cache import ResultCache
+
+CODES_PER_CASE_LIST = [['S72.001A', 'S06.5X0A'], ['S22.31XA']]
+OUTPUT_LIST = ['9,3', '4,2']
+
+
+@pytest.fixture
+def data_folder(tmp_path, monkeypatch):
+    # Model files of every model type in a temporary data folder
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+    for name_list in cache.MODEL_DATA_FILES.values():
+        for name in name_list:
+            (data_path / name).write_bytes(b'model')
+    monkeypatch.setattr(cache.resources, 'files', lambda package: data_path)
+    return data_path
+
+
+def test_cached_outputs_are_found_in_any_code_order(tmp_path, data_folder):
+    with ResultCache(str(tmp_path / 'cache.sqlite')) as result_cache:
+        result_cache.put_many(CODES_PER_CASE_LIST, OUTPUT_LIST, 'indirect_FFNN', False, True, False)
+        assert result_cache.get_many([['S06.5X0A', 'S72.001A'], ['S01.01XA']], 'indirect_FFNN', False, True, False) == ['9,3', None]
+
+
+def test_changed_options_miss_the_cache(tmp_path, data_folder):
+    with ResultCache(str(tmp_path / 'cache.sqlite')) as result_cache:
+        result_cache.put_many(CODES_PER_CASE_LIST, OUTPUT_LIST, 'indirect_FFNN', False, True, False)
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_FFNN', False, False, False) == [None, None]
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_FFNN', False, True, False, ffnn_inference='dense') == [None, None]
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_FFNN', False, True, False, ffnn_backend='numpy') == [None, None]
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_FFNN', False, True, False, precision='bfloat16') == [None, None]
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_NMT', False, True, False) == [None, None]
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_FFNN', False, True, False) == OUTPUT_LIST
+
+
+def test_options_key_ignores_options_that_do_not_apply():
+    # Direct models have no output options and NMT models do not run the FFNN
+    assert cache.options_key('direct_NMT', True, True, True) == cache.options_key('direct_NMT', False, False, False)
+    assert cache.options_key('indirect_NMT', False, True, False, 'dense', 'numpy') == cache.options_key('indirect_NMT', False, True, False)
+    assert cache.options_key('direct_FFNN', False, False, False, 'dense') != cache.options_key('direct_FFNN', False, False, False, 'sparse')
+    assert cache.options_key('direct_FFNN', False, False, False, 'sparse', 'numpy') != cache.options_key('direct_FFNN', False, False, False)
+    assert cache.options_key('direct_NMT', False, False, False, precision='int8') != cache.options_key('direct_NMT', False, False, False)
+
+
+@pytest.mark.parametrize('model_file', ['indirect_FF_model.tar', 'indirect_FF_model.npz'])
+def test_changed_model_files_invalidate_the_cache(tmp_path, data_folder, model_file):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    with ResultCache(cache_path) as result_cache:
+        result_cache.put_many(CODES_PER_CASE_LIST, OUTPUT_LIST, 'indirect_FFNN', False, True, False)
+        result_cache.put_many(CODES_PER_CASE_LIST, OUTPUT_LIST, 'direct_NMT', False, False, False)
+
+    # Unchanged model files keep the cached outputs for the next run
+    with ResultCache(cache_path) as result_cache:
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_FFNN', False, True, False) == OUTPUT_LIST
+
+    # Replacing the weights of the indirect FFNN for either backend only discards the outputs of that model type
+    (data_folder / model_file).write_bytes(b'retrained model')
+    with ResultCache(cache_path) as result_cache:
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'indirect_FFNN', False, True, False) == [None, None]
+        assert result_cache.get_many(CODES_PER_CASE_LIST, 'direct_NMT', False, False, False) == OUTPUT_LIST
+        assert len(result_cache) == 2
+
+
+def test_least_recently_used_outputs_are_evicted(tmp_path, data_folder):
+    with ResultCache(str(tmp_path / 'cache.sqlite'), max_entries=2) as result_cache:
+        result_cache.put_many(CODES_PER_CASE_LIST, OUTPUT_LIST, 'direct_FFNN', False, False, False)
+        result_cache.get_many(CODES_PER_CASE_LIST[:1], 'direct_FFNN', False, False, False)
+        result_cache.put_many([['S01.01XA']], ['1'], 'direct_FFNN', False, False, False)
+        assert result_cache.get_many(CODES_PER_CASE_LIST + [['S01.01XA']], 'direct_FFNN', False, False, False) == ['9,3', None, '1']
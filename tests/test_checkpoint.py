@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import pytest
+
+from checkpoint import ChunkCheckpoint
+
+OPTIONS = {'models': ['direct_FFNN'], 'chunk_size': 2}
+
+
+@pytest.fixture
+def paths(tmp_path):
+    # Input file and the output file of its conversion, with the outputs of two committed chunks
+    input_path = tmp_path / 'input.csv'
+    input_path.write_text('1,S72.001A\n2,S22.31XA\n3,S06.5X0A\n4,S01.01XA\n')
+    output_path = tmp_path / 'input.direct_FFNN_iss.csv'
+    output_path.write_bytes(b'patient_id,iss\n1,9\n2,4\n3,16\n4,1\n')
+    return str(input_path), str(output_path)
+
+
+def commit_two_chunks(checkpoint):
+    checkpoint.commit(1, 2, len(b'patient_id,iss\n1,9\n2,4\n'), {'S72.001X': 'S72.001A'}, agreement_differences={})
+    checkpoint.commit(2, 4, len(b'patient_id,iss\n1,9\n2,4\n3,16\n4,1\n'), {'S06.5X9A': 'S06.5X0A'}, agreement_differences={'iss': 1})
+
+
+def test_load_returns_committed_state(paths):
+    input_path, output_path = paths
+    commit_two_chunks(ChunkCheckpoint(output_path, input_path, OPTIONS))
+    checkpoint_state = ChunkCheckpoint(output_path, input_path, OPTIONS).load()
+    assert checkpoint_state['completed_chunks'] == 2
+    assert checkpoint_state['cases_written'] == 4
+    assert checkpoint_state['code_replacements'] == {'S72.001X': 'S72.001A', 'S06.5X9A': 'S06.5X0A'}
+    assert checkpoint_state['agreement_differences'] == {'iss': 1}
+
+
+def test_missing_checkpoint_starts_over(paths):
+    input_path, output_path = paths
+    assert ChunkCheckpoint(output_path, input_path, OPTIONS).load() is None
+
+
+def test_changed_options_or_input_file_start_over(paths):
+    input_path, output_path = paths
+    commit_two_chunks(ChunkCheckpoint(output_path, input_path, OPTIONS))
+    assert ChunkCheckpoint(output_path, input_path, dict(OPTIONS, chunk_size=3)).load() is None
+    with open(input_path, 'a') as input_file:
+        input_file.write('5,S22.31XA\n')
+    assert ChunkCheckpoint(output_path, input_path, OPTIONS).load() is None
+
+
+def test_truncated_output_file_starts_over(paths):
+    input_path, output_path = paths
+    commit_two_chunks(ChunkCheckpoint(output_path, input_path, OPTIONS))
+    with open(output_path, 'r+b') as output_file:
+        output_file.truncate(10)
+    assert ChunkCheckpoint(output_path, input_path, OPTIONS).load() is None
+
+
+def test_truncated_code_replacements_file_starts_over(paths):
+    input_path, output_path = paths
+    checkpoint = ChunkCheckpoint(output_path, input_path, OPTIONS)
+    commit_two_chunks(checkpoint)
+    with open(checkpoint.code_replacements_path, 'r+b') as code_replacements_file:
+        code_replacements_file.truncate(5)
+    assert ChunkCheckpoint(output_path, input_path, OPTIONS).load() is None
+
+
+def test_code_replacements_of_an_interrupted_chunk_are_dropped(paths):
+    input_path, output_path = paths
+    checkpoint = ChunkCheckpoint(output_path, input_path, OPTIONS)
+    commit_two_chunks(checkpoint)
+    # Replacements appended by a chunk that was interrupted before it was committed
+    with open(checkpoint.code_replacements_path, 'ab') as code_replacements_file:
+        code_replacements_file.write(b'{"S01.01XZ": "S01.01XA"}\n')
+
+    resumed_checkpoint = ChunkCheckpoint(output_path, input_path, OPTIONS)
+    assert 'S01.01XZ' not in resumed_checkpoint.load()['code_replacements']
+    resumed_checkpoint.commit(3, 5, len(b'patient_id,iss\n1,9\n2,4\n3,16\n4,1\n'), {'S22.31XZ': 'S22.31XA'}, agreement_differences={})
+    assert ChunkCheckpoint(output_path, input_path, OPTIONS).load()['code_replacements'] == {
+        'S72.001X': 'S72.001A', 'S06.5X9A': 'S06.5X0A', 'S22.31XZ': 'S22.31XA'}
+
+
+def test_remove_deletes_checkpoint_files(paths):
+    input_path, output_path = paths
+    checkpoint = ChunkCheckpoint(output_path, input_path, OPTIONS)
+    commit_two_chunks(checkpoint)
+    checkpoint.remove()
+    assert ChunkCheckpoint(output_path, input_path, OPTIONS).load() is None
+    assert not Path(checkpoint.path).exists()
+    assert not Path(checkpoint.code_replacements_path).exists()
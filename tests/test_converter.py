@@ -0,0 +1,76 @@
+import pytest
+
+import converter
+
+LONG_FORMAT_ROWS = [
+    ('1', 'S72.001A'), ('1', 'S06.5X0A'), ('1', 'T07.XXXA'),
+    ('2', 'S22.31XA'),
+    ('3', 'S32.10XA'), ('3', 'S36.116A'), ('3', 'S27.0XXA'), ('3', 'S42.001A'),
+    ('4', 'S01.01XA'), ('4', 'S02.5XXA'),
+]
+
+
+def write_lines(path, lines):
+    path.write_text(''.join(line + '\n' for line in lines))
+    return str(path)
+
+
+def chunked_cases(input_type, file_path, chunk_size):
+    chunk_list = list(converter.iter_import_data(input_type, file_path, chunk_size))
+    for patient_ids, _ in chunk_list:
+        assert not isinstance(patient_ids, str), patient_ids
+    return chunk_list
+
+
+def test_long_format_case_split_across_chunk_boundary(tmp_path):
+    file_path = write_lines(tmp_path / 'long.csv', [f'{key},{code}' for key, code in LONG_FORMAT_ROWS])
+    patient_ids, codes_per_case_setlist = converter.import_data('code_per_row', file_path)
+    expected_case_dict = dict(zip(patient_ids, codes_per_case_setlist))
+
+    # Rows are read two at a time, so the rows of cases 1 and 3 are split between read chunks
+    chunk_list = chunked_cases('code_per_row', file_path, 2)
+    assert [chunk_patient_ids for chunk_patient_ids, _ in chunk_list] == [['1', '2'], ['3', '4']]
+    case_dict = {}
+    for chunk_patient_ids, chunk_codes_per_case_setlist in chunk_list:
+        case_dict.update(zip(chunk_patient_ids, chunk_codes_per_case_setlist))
+    assert case_dict == expected_case_dict
+    assert case_dict['3'] == {'S32.10XA', 'S36.116A', 'S27.0XXA', 'S42.001A'}
+
+
+def test_long_format_chunk_larger_than_file(tmp_path):
+    file_path = write_lines(tmp_path / 'long.csv', [f'{key},{code}' for key, code in LONG_FORMAT_ROWS])
+    chunk_list = chunked_cases('code_per_row', file_path, 100)
+    assert [chunk_patient_ids for chunk_patient_ids, _ in chunk_list] == [['1', '2', '3', '4']]
+
+
+def test_wide_format_chunks(tmp_path):
+    file_path = write_lines(tmp_path / 'wide.csv', ['1,S72.001A,S06.5X0A', '2,S22.31XA', '3,S32.10XA,S36.116A', '4,S01.01XA'])
+    chunk_list = chunked_cases('case_per_row', file_path, 3)
+    assert [chunk_patient_ids for chunk_patient_ids, _ in chunk_list] == [['1', '2', '3'], ['4']]
+    assert chunk_list[0][1][0] == {'S72.001A', 'S06.5X0A'}
+
+
+def test_empty_long_format_file(tmp_path):
+    file_path = write_lines(tmp_path / 'long.csv', [])
+    assert converter.import_data('code_per_row', file_path) == (converter.LONG_FORMAT_PARSER_ERROR_STRING, None)
+    assert list(converter.iter_import_data('code_per_row', file_path, 2)) == [(converter.LONG_FORMAT_PARSER_ERROR_STRING, None)]
+
+
+def test_empty_wide_format_file(tmp_path):
+    file_path = write_lines(tmp_path / 'wide.csv', [])
+    assert converter.import_data('case_per_row', file_path) == ([], [])
+    assert list(converter.iter_import_data('case_per_row', file_path, 2)) == []
+
+
+def test_header_only_file(tmp_path):
+    # Input files have no header line, so a header is read as a case without any trauma codes in both imports
+    for input_type, header in [('code_per_row', 'key,ICD10Code'), ('case_per_row', 'key,code1,code2')]:
+        file_path = write_lines(tmp_path / f'{input_type}.csv', [header])
+        error_string, _ = converter.import_data(input_type, file_path)
+        assert isinstance(error_string, str)
+        assert list(converter.iter_import_data(input_type, file_path, 2)) == [(error_string, None)]
+
+
+def test_postprocess_data_unknown_model_type():
+    with pytest.raises(ValueError, match='Incompatible model type'):
+        converter.postprocess_data([[1]], 'unknown_model', False, False, False)
@@ -0,0 +1,89 @@
+import http.client
+import json
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+import pytest
+
+from server import ConversionServer, MicroBatcher, request_to_cases
+
+
+class FakeSession:
+    # Preprocessing without the lookup tables, keeping every code of each case
+    def preprocess_data(self, codes_per_case_setlist, unknown_mode):
+        return [sorted(codes) for codes in codes_per_case_setlist], {}
+
+
+def fake_convert_cases(codes_per_case_list):
+    # Direct model output of the number of codes of each case as its ISS
+    return [str(len(code_list)) for code_list in codes_per_case_list]
+
+
+@pytest.fixture
+def server_address():
+    args = Namespace(model='direct_FFNN', no_iss=False, mais=False, max_sev_per_chapter=False, unknown_mode='closest')
+    batcher = MicroBatcher(fake_convert_cases, max_batch_size=256, max_wait_ms=5.0)
+    server = ConversionServer(('127.0.0.1', 0), args, FakeSession(), batcher)
+    server_thread = Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+    batcher.close()
+
+
+def post_convert(server_address, request_dict):
+    connection = http.client.HTTPConnection(*server_address, timeout=30)
+    try:
+        connection.request('POST', '/convert', json.dumps(request_dict), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_micro_batcher_hands_each_request_its_own_outputs():
+    batch_size_list = []
+
+    def convert_cases(codes_per_case_list):
+        batch_size_list.append(len(codes_per_case_list))
+        return fake_convert_cases(codes_per_case_list)
+
+    batcher = MicroBatcher(convert_cases, max_batch_size=4, max_wait_ms=1000.0)
+    future_list = [batcher.submit([['S72.001A'] * (idx + 1)]) for idx in range(4)]
+    batcher.close()
+    assert [future.result() for future in future_list] == [['1'], ['2'], ['3'], ['4']]
+    assert batch_size_list == [4]
+
+
+def test_micro_batcher_hands_errors_to_every_request():
+    def convert_cases(codes_per_case_list):
+        raise ValueError('Conversion failed.')
+
+    batcher = MicroBatcher(convert_cases, max_batch_size=2, max_wait_ms=1000.0)
+    future_list = [batcher.submit([['S72.001A']]) for _ in range(2)]
+    batcher.close()
+    for future in future_list:
+        with pytest.raises(ValueError, match='Conversion failed.'):
+            future.result()
+
+
+def test_request_to_cases_rejects_duplicate_patient_ids():
+    request_dict = {'cases': [{'patient_id': 1, 'codes': ['S72.001A']}, {'patient_id': '1', 'codes': ['S22.31XA']}]}
+    error_string, _ = request_to_cases(request_dict)
+    assert error_string == 'Duplicate patient IDs were found in the request.'
+
+
+def test_concurrent_requests(server_address):
+    # More concurrent clients than the default listen backlog of socketserver, which would reset some connections
+    def convert_request(request_idx):
+        request_dict = {'cases': [{'patient_id': f'{request_idx}-{case_idx}', 'codes': ['S72.001A', 'S06.5X0A'][:case_idx + 1]}
+                                  for case_idx in range(2)]}
+        return post_convert(server_address, request_dict)
+
+    with ThreadPoolExecutor(128) as executor:
+        response_list = list(executor.map(convert_request, range(512)))
+    for request_idx, (status, response_dict) in enumerate(response_list):
+        assert status == 200
+        assert response_dict == {'results': [{'patient_id': f'{request_idx}-0', 'iss': 1}, {'patient_id': f'{request_idx}-1', 'iss': 2}]}